@@ -0,0 +1,120 @@
+"""
+pprzlogutils - A Python library for parsing and processing Paparazzi UAV log files.
+
+alignment provides resampling of variables (streams) with different timestamps onto a common timebase,
+so variables of different messages or aircraft can be compared sample by sample or plotted one against another.
+Everything is vectorized with NumPy: the samples around each target time are found with searchsorted.
+
+Methods:
+
+    nearest  -> value of the closest sample in time (keeps the dtype)
+    previous -> value of the last sample at or before each time, NaN before the first sample (zero-order hold)
+    linear   -> linear interpolation between the samples around each time, NaN outside of the stream
+
+Timestamps of every stream must be sorted, as they are in the .data file.
+"""
+
+import numpy
+
+# Constants
+ALIGN_METHODS = ('nearest', 'previous', 'linear')
+DEFAULT_METHOD = 'linear'
+
+'''
+    Resample the values x (sampled at the sorted timestamps t) at the target timestamps
+    x can be 1D or a (n, length) matrix of an array field, which is resampled row by row
+    Object arrays (strings, arrays with different lengths) only support nearest and previous
+
+    Returns an array with len(target) rows
+'''
+def resample(t, x, target, method=DEFAULT_METHOD):
+    if method not in ALIGN_METHODS:
+        raise ValueError('Unknown method %s, use one of %s' % (method, ', '.join(ALIGN_METHODS)))
+
+    t = numpy.asarray(t, dtype=numpy.float64)
+    x = numpy.asarray(x)
+    target = numpy.asarray(target, dtype=numpy.float64)
+    if len(t) != len(x):
+        raise ValueError('Timestamps and values have different lengths (%d and %d)' % (len(t), len(x)))
+
+    if len(t) == 0:
+        return empty_like(x, len(target))
+
+    if method == 'nearest':
+        right = numpy.clip(numpy.searchsorted(t, target, side='left'), 0, len(t) - 1)
+        left = numpy.clip(right - 1, 0, len(t) - 1)
+        index = numpy.where(numpy.abs(target - t[left]) <= numpy.abs(t[right] - target), left, right)
+        return x[index]
+
+    if method == 'previous':
+        index = numpy.searchsorted(t, target, side='right') - 1
+        values = x[numpy.clip(index, 0, None)]
+        return mask_rows(values, index < 0)
+
+    if x.dtype == object:
+        raise ValueError('Linear interpolation is not possible for strings or arrays of different lengths')
+
+    # Linear: weight of the next sample for each target time
+    right = numpy.clip(numpy.searchsorted(t, target, side='right'), 1, len(t) - 1) if len(t) > 1 else numpy.zeros(len(target), dtype=numpy.int64)
+    left = numpy.clip(right - 1, 0, None)
+    dt = t[right] - t[left]
+    weight = numpy.divide(target - t[left], dt, out=numpy.zeros(len(target)), where=dt > 0)
+    weight = weight.reshape((-1,) + (1,) * (x.ndim - 1))
+
+    values = x[left].astype(numpy.float64) * (1 - weight) + x[right].astype(numpy.float64) * weight
+    return mask_rows(values, (target < t[0]) | (target > t[-1]))
+
+# Set the masked rows to NaN (None for object arrays), converting integers to float
+def mask_rows(values, mask):
+    if not mask.any():
+        return values
+
+    if values.dtype == object:
+        values = values.copy()
+        values[mask] = None
+        return values
+
+    values = values.astype(numpy.float64)
+    values[mask] = numpy.nan
+    return values
+
+# Array of n rows without values, with the same row shape as x
+def empty_like(x, n):
+    if x.dtype == object:
+        return numpy.full(n, None, dtype=object)
+    return numpy.full((n,) + x.shape[1:], numpy.nan)
+
+'''
+    Fixed rate timebase (rate in Hz) over the time where every stream has samples (their overlap)
+    If the streams do not overlap, the timebase covers all of them instead
+'''
+def fixed_timebase(timestamps, rate):
+    if rate <= 0:
+        raise ValueError('Rate must be positive, got %s' % rate)
+
+    spans = [(t[0], t[-1]) for t in timestamps if len(t)]
+    if not spans:
+        return numpy.empty(0)
+
+    start = max(s[0] for s in spans)
+    end = min(s[1] for s in spans)
+    if start > end:
+        start = min(s[0] for s in spans)
+        end = max(s[1] for s in spans)
+
+    return start + numpy.arange(int(numpy.floor((end - start) * rate)) + 1) / rate
+
+'''
+    Resample several streams onto a common timebase
+    streams: list of (timestamps, values), timebase: target timestamps, or None to use a fixed rate (Hz)
+
+    Returns (timebase, list of resampled values)
+'''
+def align_streams(streams, timebase=None, rate=None, method=DEFAULT_METHOD):
+    if timebase is None:
+        if rate is None:
+            raise ValueError('Give a timebase or a rate')
+        timebase = fixed_timebase([t for t, _ in streams], rate)
+
+    timebase = numpy.asarray(timebase, dtype=numpy.float64)
+    return timebase, [resample(t, x, timebase, method) for t, x in streams]
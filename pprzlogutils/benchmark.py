@@ -0,0 +1,317 @@
+"""
+pprzlogutils - A Python library for parsing and processing Paparazzi UAV log files.
+
+benchmark provides the benchmark suite, run on a real or synthetic flight (see synthetic).
+Each stage runs in a new process, so its peak RSS is measured alone and no data is reused between stages.
+
+Stages:
+
+    parse           -> logparser.parse_files, lines/s and MB/s
+    parse_parallel  -> the same with several workers (only with workers > 1)
+    index           -> logparser.parse_files with lazy = True (line offsets only)
+    convert         -> logparser.convert_var_to_numpy of one variable (array and text file)
+    first_plot      -> time to first plot: lazy load, canvas creation and first drawn plot
+    refresh         -> MplCanvas.refresh_plot latency, checking and unchecking a variable and zooming
+
+Plot stages render with Agg (Qt offscreen canvas), and are skipped if PyQt5 is not installed.
+Results are saved as JSON, so runs of different commits can be compared (see compare).
+"""
+
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+import pprzlogutils.logparser as lp
+
+# Constants
+BENCH_VERSION = 1
+RESULTS_DIR = './bench/results'
+SYNTHETIC_DIR = './bench/synthetic'
+REFRESH_ROUNDS = 20 # Refreshes measured in the refresh stage
+REGRESSION_THRESHOLD = 0.10 # Relative change reported as a regression by compare
+
+# Metrics where lower is better, every other metric is better when higher
+LOWER_IS_BETTER = ('seconds', 'peak_rss_mb', 'ms_median', 'ms_max', 'ms_p90')
+
+# Peak resident memory of this process, in MB (ru_maxrss is KB on Linux and bytes on macOS)
+def peak_rss_mb():
+    if resource is None:
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return rss / 1024 ** 2
+    return rss / 1024
+
+'''
+    Choose the variable used by the convert and plot stages: the scalar numeric field
+    of the message with most rows (for example INS ins_x)
+
+    Returns (id, message, var)
+'''
+def pick_var():
+    best = None
+    for id, inner_dict in lp.DATA_COLUMNS.items():
+        for name, message in inner_dict.items():
+            numeric = [f.name for f in message.fields if not f.array and not f.string and f.name != 'class']
+            if numeric and (best is None or len(message) > best[0]):
+                best = (len(message), id, name, numeric)
+
+    if best is None:
+        raise ValueError('No numeric variables found in the data file')
+
+    _, id, name, numeric = best
+    return id, name, numeric[0]
+
+def total_rows():
+    return sum(len(m) for inner_dict in lp.DATA_COLUMNS.values() for m in inner_dict.values())
+
+#####################################################################
+#####################################################################
+# Stages, each one is run in a new process
+#####################################################################
+#####################################################################
+
+def stage_parse(log_path, data_path, workers=1):
+    size = os.path.getsize(data_path)
+
+    start = time.perf_counter()
+    lp.parse_files(log_path, data_path, workers=workers)
+    seconds = time.perf_counter() - start
+
+    lines = total_rows()
+    return {'seconds': seconds, 'lines': lines, 'workers': workers,
+            'lines_per_s': lines / seconds, 'mb_per_s': size / 1024 ** 2 / seconds}
+
+def stage_index(log_path, data_path):
+    size = os.path.getsize(data_path)
+
+    start = time.perf_counter()
+    lp.parse_files(log_path, data_path, lazy=True)
+    seconds = time.perf_counter() - start
+
+    return {'seconds': seconds, 'mb_per_s': size / 1024 ** 2 / seconds}
+
+def stage_convert(log_path, data_path):
+    lp.parse_files(log_path, data_path)
+    id, message, var = pick_var()
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        lp.OUTPUT_DIR = output_dir
+
+        start = time.perf_counter()
+        nparray = lp.convert_var_to_numpy(id, message, var)
+        seconds = time.perf_counter() - start
+
+    return {'seconds': seconds, 'rows': len(nparray), 'rows_per_s': len(nparray) / seconds,
+            'var': '%s %s %s' % (id, message, var)}
+
+# Offscreen canvas and the checkboxes dictionary to plot var, or None if PyQt5 is not installed
+def make_canvas(message, var):
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from PyQt5.QtWidgets import QApplication
+        import pprzlogutils.gui.matplotlib as mpl
+    except ImportError:
+        return None, None, None
+
+    app = QApplication.instance() or QApplication([])
+    canvas = mpl.MplCanvas(None, width=16, height=9, dpi=100)
+    canvas.resize(1600, 900)
+    checkboxes = {message: {var: True}}
+    return app, canvas, checkboxes
+
+def stage_first_plot(log_path, data_path):
+    start = time.perf_counter()
+
+    # Same as the GUI: index the data file, then parse only the plotted message
+    lp.parse_files(log_path, data_path, lazy=True)
+    id, message, var = pick_var()
+
+    app, canvas, checkboxes = make_canvas(message, var)
+    if canvas is None:
+        return {'skipped': 'PyQt5 is not installed'}
+
+    canvas.refresh_plot(id, checkboxes)
+    canvas.draw() # refresh_plot only schedules the draw
+    seconds = time.perf_counter() - start
+
+    return {'seconds': seconds, 'var': '%s %s %s' % (id, message, var)}
+
+def stage_refresh(log_path, data_path, rounds=REFRESH_ROUNDS):
+    lp.parse_files(log_path, data_path)
+    id, message, var = pick_var()
+
+    app, canvas, checkboxes = make_canvas(message, var)
+    if canvas is None:
+        return {'skipped': 'PyQt5 is not installed'}
+
+    canvas.refresh_plot(id, checkboxes)
+    canvas.draw()
+    others = [f.name for f in lp.DATA_COLUMNS[id][message].fields
+              if f.name != var and not f.array and not f.string and f.name != 'class']
+    xmin, xmax = canvas.axes.get_xlim()
+
+    times = []
+    for i in range(rounds):
+        start = time.perf_counter()
+        if i % 2 == 0 and others:
+            # Check or uncheck a variable
+            other = others[(i // 2) % len(others)]
+            checkboxes[message][other] = not checkboxes[message].get(other, False)
+            canvas.refresh_plot(id, checkboxes)
+        else:
+            # Zoom in the middle, lines are decimated again
+            width = (xmax - xmin) / (2 + i)
+            center = (xmin + xmax) / 2
+            canvas.axes.set_xlim(center - width, center + width)
+        canvas.draw()
+        times.append((time.perf_counter() - start) * 1000)
+
+    times.sort()
+    return {'rounds': rounds, 'ms_median': statistics.median(times), 'ms_p90': times[int(0.9 * (len(times) - 1))],
+            'ms_max': times[-1]}
+
+STAGES = {
+    'parse': stage_parse,
+    'parse_parallel': stage_parse,
+    'index': stage_index,
+    'convert': stage_convert,
+    'first_plot': stage_first_plot,
+    'refresh': stage_refresh,
+}
+
+# Run a stage in this process (called in a new process), adding its peak RSS
+def run_stage(name, args):
+    result = STAGES[name](*args)
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+#####################################################################
+#####################################################################
+# Suite
+#####################################################################
+#####################################################################
+
+# Current commit of the repository, if it is a git repository
+def git_commit():
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repo, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repo, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return commit + ('-dirty' if dirty else '')
+
+def machine_info():
+    return {'platform': platform.platform(), 'python': platform.python_version(),
+            'numpy': numpy.__version__, 'cpus': os.cpu_count()}
+
+'''
+    Run the benchmark suite on a flight
+    Each stage is run repeat times, each time in a new process, and the fastest run is kept
+
+    Returns the results dictionary, see save_results
+'''
+def run(log_path, data_path, workers=1, repeat=1, stages=None, verbose=True):
+    selected = stages or [s for s in STAGES if s != 'parse_parallel' or workers > 1]
+    args = {
+        'parse': (log_path, data_path, 1),
+        'parse_parallel': (log_path, data_path, workers),
+        'refresh': (log_path, data_path, REFRESH_ROUNDS),
+    }
+
+    results = {}
+    context = multiprocessing.get_context('spawn') # Nothing inherited from this process
+    for name in selected:
+        runs = []
+        for _ in range(max(1, repeat)):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                runs.append(executor.submit(run_stage, name, args.get(name, (log_path, data_path))).result())
+
+        timed = [r for r in runs if 'seconds' in r or 'ms_median' in r]
+        best = min(timed, key=lambda r: r.get('seconds', r.get('ms_median'))) if timed else runs[0]
+        results[name] = best
+        if verbose:
+            print('%-15s %s' % (name, format_result(best)))
+
+    return {
+        'version': BENCH_VERSION,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'machine': machine_info(),
+        'input': {'log': log_path, 'data': data_path, 'bytes': os.path.getsize(data_path)},
+        'repeat': repeat,
+        'results': results,
+    }
+
+def format_result(result):
+    if 'skipped' in result:
+        return 'skipped (%s)' % result['skipped']
+
+    return ', '.join('%s=%.4g' % (k, v) if isinstance(v, float) else '%s=%s' % (k, v) for k, v in result.items())
+
+'''
+    Save the results as JSON in RESULTS_DIR (or the given path)
+    Default filename is date-commit.json, so results of different commits are kept side by side
+
+    Returns the path of the file
+'''
+def save_results(results, path=None):
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        filename = '%s-%s.json' % (results['date'].replace(':', ''), results['commit'] or 'nogit')
+        path = os.path.join(RESULTS_DIR, filename)
+
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+
+    return path
+
+def load_results(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+'''
+    Compare two results dictionaries (old and new), metric by metric
+
+    Returns a list of (stage, metric, old, new, change, regression)
+    change is relative to old, regression is True when it is worse than threshold
+'''
+def compare(old, new, threshold=REGRESSION_THRESHOLD):
+    rows = []
+    for stage, result in new['results'].items():
+        previous = old['results'].get(stage, {})
+        for metric, value in result.items():
+            before = previous.get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(before, (int, float)) or not before:
+                continue
+            if metric in ('lines', 'rows', 'rounds', 'workers'):
+                continue
+
+            change = (value - before) / before
+            worse = change if metric in LOWER_IS_BETTER else -change
+            rows.append((stage, metric, before, value, change, worse > threshold))
+
+    return rows
+
+def print_comparison(rows):
+    for stage, metric, before, value, change, regression in rows:
+        print('%-15s %-12s %12.4g -> %-12.4g %+7.1f%% %s' % (stage, metric, before, value, 100 * change,
+                                                           'REGRESSION' if regression else ''))
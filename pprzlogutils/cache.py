@@ -0,0 +1,334 @@
+"""
+pprzlogutils - A Python library for parsing and processing Paparazzi UAV log files.
+
+cache provides a persistent binary cache of parsed flights.
+Each flight (one .log and one .data) is saved as a directory of .npy columns plus a JSON manifest,
+so opening it again only memory maps the columns instead of parsing the files.
+"""
+
+import hashlib
+import json
+import numpy
+import os
+import shutil
+import time
+
+import pprzlogutils.columns as cols
+import pprzlogutils.compression as compression
+import pprzlogutils.logparser as lp
+import pprzlogutils.profiling as prof
+
+# Constants
+CACHE_DIR = './cache'
+CACHE_VERSION = 2
+CACHE_MAX_BYTES = 4 * 1024 ** 3 # Size cap for all cached flights, oldest used are evicted first
+MANIFEST_FILENAME = 'manifest.json'
+HASH_SAMPLE_BYTES = 1024 ** 2 # Bytes hashed at the beginning and at the end of each file
+TMP_MAX_AGE = 3600 # Seconds after which an interrupted save is removed, even if its process seems alive
+
+'''
+    Compute the cache key of a flight
+    Uses size, mtime and a hash of the first and last HASH_SAMPLE_BYTES of each file,
+    so huge .data files are not read entirely just to find their cache
+'''
+def flight_key(log_path, data_path):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(CACHE_VERSION).encode())
+    if lp.CONVERT_UNITS:
+        digest.update(b'units') # Converted columns are another flight
+
+    for path in (log_path, data_path):
+        stat = os.stat(path)
+        digest.update(b'%d %d' % (stat.st_size, stat.st_mtime_ns))
+
+        with open(path, 'rb') as f:
+            digest.update(f.read(HASH_SAMPLE_BYTES))
+            if stat.st_size > 2 * HASH_SAMPLE_BYTES:
+                f.seek(-HASH_SAMPLE_BYTES, os.SEEK_END)
+                digest.update(f.read(HASH_SAMPLE_BYTES))
+
+    return digest.hexdigest()
+
+def flight_dir(key, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, key)
+
+'''
+    Load a flight into logparser, from the cache if possible
+    Otherwise parse the .log and .data files and save the result in the cache
+
+    use_cache = False parses the files without reading or writing the cache
+    rebuild = True ignores the cached flight and saves it again
+    lazy = True only indexes the .data file if the flight is not cached. Nothing is saved then,
+    as the columns are not parsed yet. Compressed .data files can not be indexed, they are parsed and saved
+    workers > 1 parses the .data file with that many processes
+    verbose = True writes the parsed rows to a text file, see logparser.parse_datafile (nothing when loaded from the cache)
+
+    Returns True if the flight was loaded from the cache
+'''
+def load_or_parse(log_path, data_path, use_cache=True, rebuild=False, lazy=False, workers=1, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, verbose=False):
+    if not use_cache:
+        lp.parse_files(log_path, data_path, verbose, lazy, workers)
+        return False
+
+    key = flight_key(log_path, data_path)
+    if not rebuild and load(key, cache_dir):
+        return True
+
+    lazy = lazy and not compression.is_compressed(data_path)
+    lp.parse_files(log_path, data_path, verbose, lazy, workers, use_cache=True)
+    if not lazy:
+        save(key, cache_dir)
+        evict(max_bytes, cache_dir, keep=key)
+    return False
+
+#####################################################################
+#####################################################################
+# Save
+#####################################################################
+#####################################################################
+
+'''
+    Save the current logparser schema and columns in the cache, or the given ones
+    Files are written to a temporary directory which is renamed when complete,
+    so an interrupted save never leaves a valid looking flight behind
+'''
+@prof.timed('cache_save')
+def save(key, cache_dir=CACHE_DIR, columns=None, messages_fields=None):
+    if columns is None:
+        columns = lp.DATA_COLUMNS
+    if messages_fields is None:
+        messages_fields = lp.MESSAGES_FIELDS
+
+    final_dir = flight_dir(key, cache_dir)
+    tmp_dir = final_dir + '.tmp-%d' % os.getpid()
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    streams = {}
+    for id, inner_dict in columns.items():
+        streams[id] = {}
+        for name, message in inner_dict.items():
+            streams[id][name] = write_message(os.path.join(tmp_dir, str(id), name), message)
+
+    write_manifest(tmp_dir, messages_fields, streams)
+
+    shutil.rmtree(final_dir, ignore_errors=True)
+    os.replace(tmp_dir, final_dir)
+
+'''
+    Write the columns of a message (only the given fields, all by default) as .npy files
+
+    Returns the number of rows written
+'''
+def write_message(message_dir, message, fields=None):
+    if fields is None:
+        fields = message.fields
+
+    os.makedirs(message_dir, exist_ok=True)
+    numpy.save(os.path.join(message_dir, cols.TIMESTAMP + '.npy'), message.column(cols.TIMESTAMP))
+    for field in fields:
+        save_column(message_dir, field, message.columns[field.name])
+
+    return len(message)
+
+'''
+    Write the manifest of a column store: the fields of each message and the rows of each stream
+    The manifest is written last, a directory without it is not valid
+'''
+def write_manifest(path, messages_fields, streams):
+    manifest = {
+        'version': CACHE_VERSION,
+        'messages': {},
+        'streams': {},
+    }
+
+    for name, fields in messages_fields.items():
+        manifest['messages'][name] = [cols.field_attributes(f) for f in fields]
+
+    for id, inner_dict in streams.items():
+        manifest['streams'][str(id)] = dict(inner_dict)
+
+    with open(os.path.join(path, MANIFEST_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+
+def save_column(message_dir, field, buffer):
+    path = os.path.join(message_dir, field.name)
+    if field.array:
+        numpy.save(path + '.offsets.npy', buffer.offsets.view())
+        numpy.save(path + '.values.npy', buffer.values.view())
+    elif field.string:
+        numpy.save(path + '.npy', buffer.view().astype(numpy.str_)) # Object arrays can not be memory mapped
+    else:
+        numpy.save(path + '.npy', buffer.view())
+
+#####################################################################
+#####################################################################
+# Load
+#####################################################################
+#####################################################################
+
+'''
+    Load a cached flight into logparser, memory mapping every column
+    The cached schema replaces the one from the .log file, so it is not parsed
+
+    Returns False if the flight is not cached or the cache is not valid
+'''
+@prof.timed('cache_load')
+def load(key, cache_dir=CACHE_DIR):
+    final_dir = flight_dir(key, cache_dir)
+    store = read_store(final_dir)
+    if store is None:
+        return False
+
+    messages, columns = store
+    for name, fields in messages.items():
+        lp.register_message(name, fields)
+    lp.DATA_COLUMNS.update(columns)
+
+    os.utime(os.path.join(final_dir, MANIFEST_FILENAME)) # Mark as recently used for the LRU eviction
+    return True
+
+'''
+    Read a column store (a cached flight, or one exported with the columns format)
+    Every column is memory mapped
+
+    Returns (messages fields, columns[id][name]), or None if the store is not valid
+'''
+def read_store(path):
+    manifest = read_manifest(path)
+    if manifest is None:
+        return None
+
+    messages = {}
+    for name, fields in manifest['messages'].items():
+        messages[name] = [cols.make_field(*f) for f in fields]
+
+    try:
+        columns = {}
+        for id, streams in manifest['streams'].items():
+            columns[int(id)] = {}
+            for name, rows in streams.items():
+                message_dir = os.path.join(path, id, name)
+                columns[int(id)][name] = load_message(message_dir, name, messages[name], rows)
+    except (OSError, ValueError, KeyError):
+        return None # Missing or truncated column
+
+    return messages, columns
+
+def read_manifest(path):
+    try:
+        with open(os.path.join(path, MANIFEST_FILENAME), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get('version') != CACHE_VERSION:
+        return None
+    return manifest
+
+'''
+    Load the columns of a cached message, checking every column has the expected rows
+'''
+def load_message(message_dir, name, fields, rows):
+    message = cols.MessageColumns(name, fields)
+    message.timestamps = cols.ColumnBuffer.from_array(load_array(message_dir, cols.TIMESTAMP + '.npy', rows))
+
+    for field in fields:
+        if field.array:
+            offsets = load_array(message_dir, field.name + '.offsets.npy', rows + 1)
+            values = load_array(message_dir, field.name + '.values.npy', offsets[-1])
+            message.columns[field.name] = cols.RaggedBuffer.from_arrays(offsets, values)
+        elif field.string:
+            strings = load_array(message_dir, field.name + '.npy', rows)
+            message.columns[field.name] = cols.ColumnBuffer.from_array(numpy.asarray(strings).astype(object))
+        else:
+            message.columns[field.name] = cols.ColumnBuffer.from_array(load_array(message_dir, field.name + '.npy', rows))
+
+    return message
+
+def load_array(message_dir, filename, rows):
+    array = numpy.load(os.path.join(message_dir, filename), mmap_mode='r')
+    if len(array) != rows:
+        raise ValueError('Column %s has %d rows, expected %d' % (filename, len(array), rows))
+    return array
+
+#####################################################################
+#####################################################################
+# Eviction
+#####################################################################
+#####################################################################
+
+def dir_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            size += os.path.getsize(os.path.join(root, file))
+    return size
+
+# Flights are saved in directories named by their key (32 hex digits)
+def is_flight_dir(name):
+    return len(name) == 32 and all(c in '0123456789abcdef' for c in name)
+
+# While being saved, flights are written to key.tmp-pid (see save), only renamed to key when complete
+def is_tmp_dir(name):
+    key, sep, pid = name.partition('.tmp-')
+    return bool(sep) and is_flight_dir(key) and pid.isdigit()
+
+'''
+    Check if a temporary directory is left from an interrupted save
+    It is when its process is gone, or when it is older than TMP_MAX_AGE (the pid may have been reused)
+'''
+def is_stale_tmp_dir(path):
+    if time.time() - os.path.getmtime(path) > TMP_MAX_AGE:
+        return True
+
+    pid = int(os.path.basename(path).partition('.tmp-')[2])
+    if pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass # Alive, owned by another user
+    return False
+
+'''
+    Remove least recently used flights until the cache is smaller than max_bytes
+    The flight with key keep is never removed. Leftover temporary directories are removed too
+'''
+def evict(max_bytes=CACHE_MAX_BYTES, cache_dir=CACHE_DIR, keep=None):
+    if not os.path.isdir(cache_dir):
+        return
+
+    flights = []
+    total = 0
+    for key in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, key)
+        manifest = os.path.join(path, MANIFEST_FILENAME)
+
+        if is_tmp_dir(key):
+            # Interrupted save (with or without manifest), remove it if it is not being written right now
+            if is_stale_tmp_dir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            continue
+
+        if not is_flight_dir(key):
+            continue # Other caches, for example message schemas
+
+        if not os.path.exists(manifest):
+            # Incomplete flight (saves are renamed only once complete), remove it if it is old
+            if time.time() - os.path.getmtime(path) > TMP_MAX_AGE:
+                shutil.rmtree(path, ignore_errors=True)
+            continue
+
+        size = dir_size(path)
+        total += size
+        if key != keep:
+            flights.append((os.path.getmtime(manifest), size, path))
+
+    for _, size, path in sorted(flights):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
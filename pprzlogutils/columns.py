@@ -0,0 +1,593 @@
+"""
+pprzlogutils - A Python library for parsing and processing Paparazzi UAV log files.
+
+columns provides typed, growable NumPy column buffers used to store the parsed .data file.
+Every (id, message) pair is stored as a MessageColumns object, with one column per field.
+"""
+
+import numpy
+
+from collections import namedtuple
+from collections.abc import Mapping, Sequence
+
+import pprzlogutils.memory as memory
+import pprzlogutils.profiling as prof
+import pprzlogutils.statistics as stats
+
+# Constants
+TIMESTAMP = 'TIMESTAMP' # Caps to differentiate from a possible timestamp field inside the message
+INITIAL_CAPACITY = 64 # Rows reserved the first time a column is created
+BLOCK_ROWS = 4096 # Pending rows converted to NumPy at once
+
+# Paparazzi TYPE attribute -> NumPy dtype
+PPRZ_DTYPES = {
+    'int8': numpy.int8,
+    'uint8': numpy.uint8,
+    'int16': numpy.int16,
+    'uint16': numpy.uint16,
+    'int32': numpy.int32,
+    'uint32': numpy.uint32,
+    'int64': numpy.int64,
+    'uint64': numpy.uint64,
+    'float': numpy.float32,
+    'double': numpy.float64,
+}
+STRING_TYPES = ('char', 'string')
+DEFAULT_DTYPE = numpy.float64 # Used for unknown types
+
+'''
+    Field definition of a message, as found in the messages XML
+    unit, alt_unit and alt_unit_coef are the UNIT, ALT_UNIT and ALT_UNIT_COEF attributes (None if missing)
+    scaled fields are converted to alt_unit when parsed (value * alt_unit_coef), and stored as float64
+
+    Examples:
+    Field(name='ins_x', type='int32', dtype=int32, array=False, string=False, unit=None, alt_unit='m', alt_unit_coef=0.0039063, scaled=False)
+    Field(name='ins_x', type='int32', dtype=float64, array=False, string=False, unit=None, alt_unit='m', alt_unit_coef=0.0039063, scaled=True)
+    Field(name='p', type='float[]', dtype=float32, array=True, string=False, unit=None, alt_unit=None, alt_unit_coef=None, scaled=False)
+'''
+Field = namedtuple('Field', ['name', 'type', 'dtype', 'array', 'string', 'unit', 'alt_unit', 'alt_unit_coef', 'scaled'],
+                   defaults=(None, None, None, False))
+
+'''
+    Create a Field from its NAME, TYPE and unit attributes
+    Arrays (uint8[], float[3]...) are flagged, char[] and string are stored as text
+    With scale = True, numbers with an ALT_UNIT_COEF are converted to ALT_UNIT when parsed
+'''
+def make_field(name, type, unit=None, alt_unit=None, alt_unit_coef=None, scale=False):
+    base = type.split('[')[0] if type else ''
+    array = '[' in type if type else False
+
+    try:
+        coef = float(alt_unit_coef) if alt_unit_coef is not None else None
+    except ValueError:
+        coef = None
+
+    if base in STRING_TYPES:
+        return Field(name, type, numpy.dtype(object), False, True, unit, alt_unit, coef, False)
+
+    scaled = bool(scale) and coef is not None
+    dtype = numpy.float64 if scaled else PPRZ_DTYPES.get(base, DEFAULT_DTYPE)
+    return Field(name, type, numpy.dtype(dtype), array, False, unit, alt_unit, coef, scaled)
+
+# Unit of the values stored for a field: alt_unit if they are converted, otherwise unit (None if unknown)
+def field_unit(field):
+    return field.alt_unit if field.scaled else field.unit
+
+# Attributes of a field saved in manifests, make_field(*field_attributes(field)) creates the same field again
+def field_attributes(field):
+    return [field.name, field.type, field.unit, field.alt_unit, field.alt_unit_coef, field.scaled]
+
+#####################################################################
+#####################################################################
+# Buffers
+#####################################################################
+#####################################################################
+
+'''
+    Growable 1D NumPy array. Capacity is doubled when full, so appends are amortized O(1)
+'''
+class ColumnBuffer:
+    def __init__(self, dtype, capacity=INITIAL_CAPACITY):
+        self.dtype = numpy.dtype(dtype)
+        self._data = numpy.empty(capacity, dtype=self.dtype)
+        self._size = 0
+
+    # Wrap an already built array (for example, a memory mapped one). Copied only when grown
+    @classmethod
+    def from_array(cls, array):
+        buffer = cls.__new__(cls)
+        buffer.dtype = array.dtype
+        buffer._data = array
+        buffer._size = len(array)
+        return buffer
+
+    def __len__(self):
+        return self._size
+
+    def append(self, values):
+        values = numpy.asarray(values)
+        n = len(values)
+        if self._size + n > len(self._data):
+            self._grow(self._size + n)
+
+        self._data[self._size:self._size + n] = values
+        self._size += n
+
+    def _grow(self, needed):
+        capacity = max(needed, 2 * len(self._data), INITIAL_CAPACITY)
+        data = numpy.empty(capacity, dtype=self.dtype)
+        data[:self._size] = self._data[:self._size]
+        self._data = data
+
+    def view(self):
+        return self._data[:self._size]
+
+    @property
+    def nbytes(self):
+        return self._size * self.dtype.itemsize
+
+'''
+    Growable column for array fields (uint8[], float[]...)
+    Stored as ragged offsets plus a flat values buffer: row i is values[offsets[i]:offsets[i+1]]
+'''
+class RaggedBuffer:
+    def __init__(self, dtype, capacity=INITIAL_CAPACITY):
+        self.dtype = numpy.dtype(dtype)
+        self.offsets = ColumnBuffer(numpy.int64, capacity + 1)
+        self.offsets.append([0])
+        self.values = ColumnBuffer(self.dtype, capacity)
+
+    @classmethod
+    def from_arrays(cls, offsets, values):
+        buffer = cls.__new__(cls)
+        buffer.dtype = values.dtype
+        buffer.offsets = ColumnBuffer.from_array(offsets)
+        buffer.values = ColumnBuffer.from_array(values)
+        return buffer
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    # Append rows, given the length of each row and the flat values
+    def append(self, lengths, values):
+        last = self.offsets.view()[-1]
+        self.offsets.append(last + numpy.cumsum(lengths, dtype=numpy.int64))
+        self.values.append(numpy.asarray(values).astype(self.dtype, copy=False))
+
+    def row(self, i):
+        offsets = self.offsets.view()
+        return self.values.view()[offsets[i]:offsets[i + 1]]
+
+    '''
+        Convert rows start to stop (excluded, all by default) to a single NumPy array
+        If every row has the same length, returns a (n, length) matrix. Otherwise an object array of rows
+    '''
+    def view(self, start=0, stop=None):
+        offsets = self.offsets.view()[start:len(self) + 1 if stop is None else stop + 1]
+        lengths = numpy.diff(offsets)
+
+        if len(lengths) == 0:
+            return numpy.empty((0, 0), dtype=self.dtype)
+
+        values = self.values.view()[offsets[0]:offsets[-1]]
+        if numpy.all(lengths == lengths[0]):
+            return values.reshape(len(lengths), lengths[0])
+
+        rows = numpy.empty(len(lengths), dtype=object)
+        rows[:] = numpy.split(values, offsets[1:-1] - offsets[0])
+        return rows
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.values.nbytes
+
+#####################################################################
+#####################################################################
+# Message columns
+#####################################################################
+#####################################################################
+
+'''
+    All the columns of one message for one ID: TIMESTAMP plus one column per field
+    Lines are accumulated as text, then split and converted to NumPy by blocks of BLOCK_ROWS rows
+    Columns are tracked by the memory budget (see memory), column, slice and to_block mark them as used
+    Every appended block updates the statistics of the message (see statistics)
+'''
+class MessageColumns:
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.timestamps = ColumnBuffer(numpy.float64)
+        self.columns = {}
+        for field in fields:
+            if field.array:
+                self.columns[field.name] = RaggedBuffer(field.dtype)
+            else:
+                self.columns[field.name] = ColumnBuffer(field.dtype)
+        self.stats = stats.MessageStats(fields)
+
+        self._pending = [] # Lines not converted yet
+
+    def __len__(self):
+        self.flush()
+        return len(self.timestamps)
+
+    # Add one line of the .data file (timestamp, id, name and payload), as text
+    def add_line(self, line):
+        self._pending.append(line)
+        if len(self._pending) >= BLOCK_ROWS:
+            self.flush()
+
+    '''
+        Convert the pending lines to typed NumPy values, one block per call
+        Lines without one token per field are dropped, and so are the rows with a token
+        which is not a valid number (or out of the range of its type)
+    '''
+    def flush(self):
+        if not self._pending:
+            return
+
+        with prof.stage('to_numpy'):
+            tokens = split_lines(self._pending, self.name, len(self.fields) + 3)
+            self._pending.clear() # Cleared in place, see ingest_lines
+            timestamps, invalid = parse_numbers(tokens[0], numpy.float64)
+            values, invalid = tokens_to_arrays(self.fields, tokens[3:], invalid)
+            if invalid is not None:
+                prof.count('lines_skipped', int(invalid.sum()))
+                timestamps, values = drop_rows(self.fields, timestamps, values, invalid)
+            if len(timestamps):
+                self.append_block(timestamps, values)
+        prof.count('rows_converted', len(timestamps))
+
+    '''
+        Append already converted rows
+        values[field] is a 1D array for scalar fields and (lengths, flat values) for array fields
+        block_stats are the statistics of the rows if already computed (see parallel), they are merged then
+    '''
+    def append_block(self, timestamps, values, block_stats=None):
+        with memory.LOCK: # Not spilled while appending
+            self.timestamps.append(timestamps)
+            for field in self.fields:
+                if field.array:
+                    self.columns[field.name].append(*values[field.name])
+                else:
+                    self.columns[field.name].append(values[field.name])
+            memory.track(self)
+
+        with prof.stage('statistics'):
+            if block_stats is None:
+                self.stats.update(timestamps, values)
+            else:
+                self.stats.merge(block_stats)
+
+    '''
+        Return every row as (timestamps, values), in the same format append_block uses
+    '''
+    def to_block(self):
+        self.flush()
+        memory.touch(self)
+
+        values = {}
+        for field in self.fields:
+            column = self.columns[field.name]
+            if field.array:
+                values[field.name] = (numpy.diff(column.offsets.view()), column.values.view())
+            else:
+                values[field.name] = column.view()
+        return self.timestamps.view(), values
+
+    # Return the NumPy array of a variable (or TIMESTAMP)
+    def column(self, var):
+        self.flush()
+        memory.touch(self, [var])
+
+        if var == TIMESTAMP:
+            return self.timestamps.view()
+        return self.columns[var].view()
+
+    '''
+        Rows with timestamps between t0 and t1 (both included, None for no limit)
+        The window is found with a binary search, timestamps of a stream are in file order (sorted)
+
+        Returns a dictionary, {TIMESTAMP: timestamps, var: values...} for the given vars (all by default)
+    '''
+    def window(self, t0=None, t1=None, vars=None):
+        i0, i1 = search_window(self.column(TIMESTAMP), t0, t1)
+        return self.slice(i0, i1, vars)
+
+    # Rows i0 to i1 (excluded) as a dictionary of arrays, see window. Views, nothing is copied
+    def slice(self, i0, i1, vars=None):
+        self.flush()
+        memory.touch(self, None if vars is None else [TIMESTAMP] + list(vars))
+
+        window = {TIMESTAMP: self.timestamps.view()[i0:i1]}
+        for field in self.fields:
+            if vars is not None and field.name not in vars:
+                continue
+            if field.array:
+                window[field.name] = self.columns[field.name].view(i0, i1)
+            else:
+                window[field.name] = self.columns[field.name].view()[i0:i1]
+        return window
+
+    # First and last timestamps, or None if there are no rows
+    def span(self):
+        timestamps = self.column(TIMESTAMP)
+        if len(timestamps) == 0:
+            return None
+        return timestamps[0], timestamps[-1]
+
+    '''
+        Statistics of the rows (see statistics.MessageStats)
+        Columns which were not appended by blocks (loaded from the cache), or whose blocks were too short
+        to find their gaps (sparse messages parsed in parallel), get them with one pass now
+    '''
+    def statistics(self):
+        self.flush()
+        if self.stats.count != len(self.timestamps) or self.stats.approximate:
+            self.stats = stats.MessageStats(self.fields)
+            with prof.stage('statistics'):
+                self.stats.update(*self.to_block())
+        return self.stats
+
+    # Return a row as a tuple of values, in the same order as the fields
+    def row(self, i):
+        self.flush()
+
+        values = [self.timestamps.view()[i]]
+        for field in self.fields:
+            if field.array:
+                values.append(self.columns[field.name].row(i))
+            else:
+                values.append(self.columns[field.name].view()[i])
+        return values
+
+    @property
+    def nbytes(self):
+        self.flush()
+        return self.timestamps.nbytes + sum(c.nbytes for c in self.columns.values())
+
+'''
+    Indexes (i0, i1) of the rows with timestamps between t0 and t1 (included) of a sorted array
+    None is no limit at that side
+'''
+def search_window(timestamps, t0=None, t1=None):
+    i0 = 0 if t0 is None else int(numpy.searchsorted(timestamps, t0, side='left'))
+    i1 = len(timestamps) if t1 is None else int(numpy.searchsorted(timestamps, t1, side='right'))
+    return i0, max(i0, i1)
+
+'''
+    Ingest the lines of a datafile into a columns dictionary, columns[id][name] -> MessageColumns
+    messages_fields[name] is the list of Fields of each known message, other messages are skipped
+    Lines with an unexpected number of fields are skipped too
+
+    The message of each (id, name) tokens is only looked up the first time, the next lines
+    are appended to its pending lines directly. Only the first three tokens are split here,
+    lines with an unexpected number of fields are found when the pending lines are converted (see split_lines)
+
+    Returns the number of ingested lines
+'''
+def ingest_lines(lines, columns, messages_fields):
+    ingested = 0
+    skipped = 0
+    unknown = 0
+    streams = {} # (id, name) tokens -> (message, its pending lines), None if not saved
+    for line in lines:
+        # Split by spaces
+        parts = line.split(None, 3)
+        if len(parts) < 3:
+            skipped += 1
+            continue
+
+        key = (parts[1], parts[2])
+        stream = streams.get(key)
+        if stream is None:
+            if key in streams:
+                unknown += 1
+                continue
+            stream = streams[key] = find_stream(columns, messages_fields, parts)
+            if stream is None:
+                unknown += 1
+                continue
+
+        message, pending = stream
+        pending.append(line)
+        if len(pending) >= BLOCK_ROWS:
+            message.flush()
+        ingested += 1
+
+    # Convert whatever is left pending
+    for stream in streams.values():
+        if stream is not None:
+            stream[0].flush()
+
+    prof.count('lines_parsed', ingested)
+    prof.count('lines_skipped', skipped)
+    prof.count('unknown_messages', unknown)
+    return ingested
+
+'''
+    Message of the line (split in tokens) for ingest_lines, created if needed
+    Messages not in messages_fields (not telemetry) or with an invalid id are not saved
+
+    Returns (message, its pending lines), or None
+'''
+def find_stream(columns, messages_fields, parts):
+    name = parts[2]
+    fields = messages_fields.get(name)
+    if fields is None:
+        return None
+    try:
+        id = int(parts[1])
+    except ValueError:
+        return None
+
+    inner_dict = columns.setdefault(id, {})
+    message = inner_dict.get(name)
+    if message is None:
+        message = inner_dict[name] = MessageColumns(name, fields)
+    message.flush() # Lazy messages are loaded now, their lines go after the indexed ones
+    return message, message._pending
+
+'''
+    Split lines of a message in columns of tokens (timestamp, id, name and one per field)
+    All the lines are split at once. If the tokens are not width per line, or the name
+    is not where it should be in every row, some line is wrong: lines are split one by one
+    and those without width tokens are dropped
+'''
+def split_lines(lines, name, width):
+    tokens = ' '.join(lines).split()
+    rows = len(tokens) // width
+    if len(tokens) != rows * width or tokens[2::width].count(name) != rows:
+        rows = [parts for parts in map(str.split, lines) if len(parts) == width]
+        prof.count('lines_skipped', len(lines) - len(rows))
+        tokens = [token for parts in rows for token in parts]
+    return [tokens[i::width] for i in range(width)]
+
+'''
+    Convert the tokens of a block of rows to typed NumPy values, given as one sequence of tokens per field
+    Each column is parsed in a single call, array fields are split by commas
+    Scaled fields are converted to their alt_unit with one multiplication per column
+
+    invalid flags the rows already found invalid (None if none), the rows with an invalid number are added
+
+    Returns (values, invalid), values as given to MessageColumns.append_block
+'''
+def tokens_to_arrays(fields, columns, invalid=None):
+    values = {}
+    for field, column in zip(fields, columns):
+        if field.string:
+            values[field.name] = numpy.array(column, dtype=object)
+        elif field.array:
+            splitted = [token.split(',') if token else [] for token in column]
+            lengths = numpy.fromiter(map(len, splitted), dtype=numpy.int64, count=len(splitted))
+            numbers, invalid_numbers = parse_numbers([v for s in splitted for v in s], field.dtype)
+            if invalid_numbers is not None:
+                rows = numpy.repeat(numpy.arange(len(lengths)), lengths)[invalid_numbers]
+                invalid = flag_rows(invalid, len(lengths), rows)
+            values[field.name] = (lengths, scale_numbers(numbers, field))
+        else:
+            numbers, invalid_numbers = parse_numbers(column, field.dtype)
+            if invalid_numbers is not None:
+                invalid = flag_rows(invalid, len(numbers), invalid_numbers)
+            values[field.name] = scale_numbers(numbers, field)
+
+    return values, invalid
+
+# Flag rows (indexes or a boolean mask) as invalid, creating the flags of the block if needed
+def flag_rows(invalid, n, rows):
+    if invalid is None:
+        invalid = numpy.zeros(n, dtype=bool)
+    invalid[rows] = True
+    return invalid
+
+# Remove the invalid rows of a block converted by tokens_to_arrays
+def drop_rows(fields, timestamps, values, invalid):
+    valid = ~invalid
+    for field in fields:
+        if field.array:
+            lengths, numbers = values[field.name]
+            values[field.name] = (lengths[valid], numbers[numpy.repeat(valid, lengths)])
+        else:
+            values[field.name] = values[field.name][valid]
+    return timestamps[valid], values
+
+# Convert parsed numbers (float64 for scaled fields) to the alt_unit of their field, in place
+def scale_numbers(numbers, field):
+    if field.scaled:
+        numbers *= field.alt_unit_coef
+    return numbers
+
+'''
+    Parse a sequence of number strings to the given dtype, in a single call if every token is valid
+    Integers are parsed as integers, so int64 and uint64 keep every digit. Only tokens written
+    like a float (e.g. '1544.') are parsed as floats and truncated
+
+    Returns (numbers, invalid), invalid is None or a boolean array of the tokens which are not valid
+    numbers of the dtype (their number is 0)
+'''
+def parse_numbers(tokens, dtype):
+    try:
+        return numpy.array(tokens, dtype=dtype), None
+    except (ValueError, OverflowError):
+        pass
+
+    numbers = numpy.zeros(len(tokens), dtype=dtype)
+    invalid = numpy.zeros(len(tokens), dtype=bool)
+    parse = parse_integer if numbers.dtype.kind in 'iu' else float
+    for i, token in enumerate(tokens):
+        try:
+            numbers[i] = parse(token)
+        except (ValueError, OverflowError):
+            invalid[i] = True
+    return numbers, invalid
+
+def parse_integer(token):
+    try:
+        return int(token)
+    except ValueError:
+        return int(float(token))
+
+#####################################################################
+#####################################################################
+# DATA_DICT compatibility view
+#####################################################################
+#####################################################################
+
+'''
+    Read-only view of the columns with the old DATA_DICT layout:
+
+    DATA_DICT[id][name][n] -> MESSAGES_TYPES[name](TIMESTAMP, var1, var2...)
+
+    Rows are built on access, nothing is stored as namedtuples
+'''
+class DataDictView(Mapping):
+    def __init__(self, columns, types):
+        self._columns = columns
+        self._types = types
+
+    def __getitem__(self, id):
+        return MessagesView(self._columns[id], self._types)
+
+    def __iter__(self):
+        return iter(self._columns)
+
+    def __len__(self):
+        return len(self._columns)
+
+class MessagesView(Mapping):
+    def __init__(self, messages, types):
+        self._messages = messages
+        self._types = types
+
+    def __getitem__(self, name):
+        return RowsView(self._messages[name], self._types[name])
+
+    def __iter__(self):
+        return iter(self._messages)
+
+    def __len__(self):
+        return len(self._messages)
+
+class RowsView(Sequence):
+    def __init__(self, message, type):
+        self._message = message
+        self._type = type
+
+        # Fields dropped from the named tuple (for example 'class') are skipped
+        names = [TIMESTAMP] + [f.name for f in message.fields]
+        self._indexes = [names.index(f) for f in type._fields]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+
+        row = self._message.row(i)
+        return self._type(*[row[j] for j in self._indexes])
+
+    def __len__(self):
+        return len(self._message)
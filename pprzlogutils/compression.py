@@ -0,0 +1,173 @@
+"""
+pprzlogutils - A Python library for parsing and processing Paparazzi UAV log files.
+
+compression provides reading of compressed flights (.data.gz, .data.xz, .data.zst, .log.gz...) without
+decompressing them first. A background thread decompresses fixed size chunks into a bounded queue,
+and the parser takes whole lines from it, so decompression and parsing overlap
+(zlib and lzma release the GIL) and only a few chunks are in memory at once.
+
+Supported extensions:
+
+    .gz   -> gzip (standard library)
+    .xz   -> lzma (standard library)
+    .bz2  -> bz2 (standard library)
+    .zst  -> Zstandard, needs the zstandard package (pip install zstandard)
+
+Compressed files can not be seeked cheaply, so lazy loading, parallel parsing and follow mode
+need plain files. Compressed flights are parsed from start to end instead (and then saved in the cache).
+"""
+
+import bz2
+import gzip
+import lzma
+import os
+import queue
+import threading
+
+import pprzlogutils.profiling as prof
+
+try:
+    import zstandard
+except ImportError: # Optional, only needed for .zst files
+    zstandard = None
+
+# Constants
+CHUNK_BYTES = 4 * 1024 ** 2 # Decompressed bytes read at once
+QUEUE_CHUNKS = 4 # Chunks waiting to be parsed, so at most (QUEUE_CHUNKS + 2) * CHUNK_BYTES are in memory
+PUT_TIMEOUT = 0.1 # Seconds between checks of close() while the queue is full
+COMPRESSED_EXTENSIONS = ('.gz', '.xz', '.bz2', '.zst')
+
+END = None # Queued after the last chunk
+
+def is_compressed(path):
+    return os.path.splitext(path)[1].lower() in COMPRESSED_EXTENSIONS
+
+# Path (or filename) without the compression extension, sample.data.gz -> sample.data
+def strip_extension(path):
+    return os.path.splitext(path)[0] if is_compressed(path) else path
+
+'''
+    Open a compressed file for reading, as a binary file object of its decompressed contents
+    Plain files are opened as they are
+'''
+def open_compressed(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.gz':
+        return gzip.open(path, 'rb')
+    if ext == '.xz':
+        return lzma.open(path, 'rb')
+    if ext == '.bz2':
+        return bz2.open(path, 'rb')
+    if ext == '.zst':
+        if zstandard is None:
+            raise ImportError('Reading %s needs the zstandard package (pip install zstandard)' % path)
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+
+    return open(path, 'rb')
+
+'''
+    Lines of a compressed file, decompressed by a background thread
+    Iterate it (once) like a text file, and close it when done, or use it as a context manager:
+
+    with LineReader('sample.data.gz') as lines:
+        for line in lines: ...
+
+    Errors of the decompression (corrupted or truncated files) are raised by the iteration
+'''
+class LineReader:
+    def __init__(self, path, chunk_bytes=CHUNK_BYTES, queue_chunks=QUEUE_CHUNKS):
+        self.path = path
+        self.chunk_bytes = chunk_bytes
+        self._queue = queue.Queue(maxsize=queue_chunks)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._decompress, name='decompress %s' % os.path.basename(path), daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    # Background thread: decompress the file chunk by chunk, waiting while the queue is full
+    def _decompress(self):
+        try:
+            with open_compressed(self.path) as f:
+                while not self._closed.is_set():
+                    chunk = f.read(self.chunk_bytes)
+                    if not chunk:
+                        break
+                    self._put(chunk)
+        except Exception as e:
+            self._put(e)
+        self._put(END)
+
+    def _put(self, item):
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=PUT_TIMEOUT)
+                return
+            except queue.Full:
+                continue
+
+    # Whole lines of each chunk, the incomplete last line is kept for the next one
+    def __iter__(self):
+        partial = b''
+        while True:
+            chunk = self._queue.get()
+            if chunk is END:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+
+            prof.count('bytes_decompressed', len(chunk))
+            end = chunk.rfind(b'\n')
+            if end < 0:
+                partial += chunk
+                continue
+
+            text = (partial + chunk[:end]).decode('utf-8', 'replace')
+            partial = chunk[end + 1:]
+            yield from text.splitlines()
+
+        if partial:
+            yield partial.decode('utf-8', 'replace')
+
+    # Stop the thread, also when the lines were not read until the end
+    def close(self):
+        self._closed.set()
+        try:
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        self._thread.join()
+
+'''
+    Decompressed bytes of a file from the first start marker to the end of the next end marker,
+    reading chunk by chunk and keeping only that block (for example, the protocol block of a .log.gz)
+
+    Returns the bytes of the block, or None if it is not found
+'''
+def read_block(path, start, end, chunk_bytes=CHUNK_BYTES):
+    with open_compressed(path) as f:
+        buffer = b''
+        found = False
+        while True:
+            chunk = f.read(chunk_bytes)
+            if not chunk:
+                return None
+            buffer += chunk
+
+            if not found:
+                index = buffer.find(start)
+                if index < 0:
+                    buffer = buffer[-(len(start) - 1):] # A marker may be split between chunks
+                    continue
+                buffer = buffer[index:]
+                found = True
+
+            index = buffer.find(end)
+            if index >= 0:
+                return buffer[:index + len(end)]
@@ -0,0 +1,183 @@
+"""
+pprzlogutils - A Python library for parsing and processing Paparazzi UAV log files.
+
+dataindex provides a byte-offset index of the .data file, for lazy on-demand loading.
+A first pass only reads the first three tokens of each line (timestamp, id and message name)
+and saves the line offsets and timestamps for each (id, message). The payload of a message is parsed
+the first time one of its columns is needed, reading the lines through an mmap of the file.
+A time window of a message can be parsed alone, finding its lines with the indexed timestamps.
+"""
+
+import mmap
+import numpy
+
+from array import array
+from collections import namedtuple
+
+import pprzlogutils.columns as cols
+import pprzlogutils.profiling as prof
+import pprzlogutils.statistics as stats
+
+# Constants
+PROGRESS_LINES = 100000 # Lines scanned between calls of the progress callback, see scan_offsets
+
+# Index of the lines of one (id, message): byte offsets (array('q')), timestamps (array('d'))
+# and number of payload tokens (array('H')), to drop the lines of the wrong length before they are parsed
+StreamIndex = namedtuple('StreamIndex', ['offsets', 'timestamps', 'tokens'])
+
+'''
+    Memory mapped .data file, used to read the lines of a message given their offsets
+'''
+class DataFile:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self.mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # Empty file can not be mapped
+            self.mmap = b''
+
+    # Yield the lines (as str, without the newline) starting at each offset
+    def lines(self, offsets):
+        mm = self.mmap
+        size = len(mm)
+        for offset in offsets:
+            end = mm.find(b'\n', offset)
+            if end < 0:
+                end = size
+            yield mm[offset:end].decode('utf-8', 'replace')
+
+    def close(self):
+        if isinstance(self.mmap, mmap.mmap):
+            self.mmap.close()
+        self._file.close()
+
+'''
+    Scan the .data file, saving the byte offset of each line grouped by (id, name)
+    The payload is only split to count its tokens, it is not converted
+
+    Lines with an invalid timestamp are not indexed, they would not be parsed anyway
+
+    progress(offset, streams) is called every PROGRESS_LINES lines, with the bytes scanned and the index so far.
+    If it returns False the scan stops there, and only the lines before offset are indexed
+
+    Returns a dictionary (id bytes, name bytes) -> StreamIndex
+'''
+def scan_offsets(path, progress=None):
+    streams = {}
+    offset = 0
+
+    with open(path, 'rb') as f:
+        for n, line in enumerate(f, 1):
+            if progress is not None and n % PROGRESS_LINES == 0 and progress(offset, streams) is False:
+                break
+
+            parts = line.split(None, 3)
+            if len(parts) >= 3:
+                try:
+                    timestamp = float(parts[0])
+                except ValueError:
+                    offset += len(line)
+                    continue
+
+                key = (parts[1], parts[2])
+                index = streams.get(key)
+                if index is None:
+                    index = streams[key] = StreamIndex(array('q'), array('d'), array('H'))
+                index.offsets.append(offset)
+                index.timestamps.append(timestamp)
+                index.tokens.append(min(len(parts[3].split()), 0xffff) if len(parts) > 3 else 0)
+            offset += len(line)
+
+    return streams
+
+'''
+    Message columns which are parsed on the first access
+    Until then, only the offsets and timestamps of its lines in the .data file are kept (see StreamIndex)
+
+    Lines without one token per field are dropped here, as parsing would drop them,
+    so the length of the message is the same before and after it is loaded
+    (unless a line has a token which is not a number, that is only found when parsed)
+'''
+class LazyMessageColumns(cols.MessageColumns):
+    def __init__(self, name, fields, source, index):
+        super().__init__(name, fields)
+        self.source = source
+        self.offsets = index.offsets
+        self.index_timestamps = numpy.frombuffer(index.timestamps, dtype=numpy.float64)
+        self.loaded = False
+
+        valid = numpy.frombuffer(index.tokens, dtype=numpy.uint16) == len(fields)
+        if not valid.all():
+            prof.count('lines_skipped', int(len(valid) - valid.sum()))
+            self.offsets = numpy.frombuffer(index.offsets, dtype=numpy.int64)[valid]
+            self.index_timestamps = self.index_timestamps[valid]
+
+    def __len__(self):
+        if not self.loaded:
+            return len(self.offsets)
+        return super().__len__()
+
+    # Parse every line of this message, only the first time
+    def load(self):
+        if self.loaded:
+            return
+        self.loaded = True # Set first, flush is called while adding lines
+        self.stats = stats.MessageStats(self.fields) # Replaces the statistics of the index
+
+        with prof.stage('lazy_load'):
+            for line in self.source.lines(self.offsets):
+                super().add_line(line)
+            super().flush()
+        prof.count('lines_parsed', len(self.offsets))
+
+        self.offsets = None
+        self.index_timestamps = None
+
+    # New lines go after the ones already indexed
+    def add_line(self, line):
+        self.load()
+        super().add_line(line)
+
+    def flush(self):
+        self.load()
+        super().flush()
+
+    '''
+        Rows with timestamps between t0 and t1, see MessageColumns.window
+        If the message is not loaded yet, only the lines of the window are parsed (and not kept)
+    '''
+    def window(self, t0=None, t1=None, vars=None):
+        if self.loaded:
+            return super().window(t0, t1, vars)
+
+        i0, i1 = cols.search_window(self.index_timestamps, t0, t1)
+        message = cols.MessageColumns(self.name, self.fields)
+        with prof.stage('lazy_window'):
+            for line in self.source.lines(self.offsets[i0:i1]):
+                message.add_line(line)
+            message.flush()
+
+        return message.slice(0, len(message), vars)
+
+    def span(self):
+        if self.loaded:
+            return super().span()
+        if len(self.index_timestamps) == 0:
+            return None
+        return self.index_timestamps[0], self.index_timestamps[-1]
+
+    # Statistics of the rows, only of the indexed timestamps until the message is loaded
+    def statistics(self):
+        if self.loaded:
+            return super().statistics()
+        if self.stats.count != len(self.index_timestamps):
+            self.stats = stats.MessageStats(self.fields)
+            self.stats.update(self.index_timestamps)
+        return self.stats
+
+    @property
+    def nbytes(self):
+        if not self.loaded:
+            return self.offsets.itemsize * len(self.offsets) + self.index_timestamps.nbytes
+        return super().nbytes
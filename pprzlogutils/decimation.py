@@ -0,0 +1,149 @@
+"""
+pprzlogutils - A Python library for parsing and processing Paparazzi UAV log files.
+
+decimation provides min/max level-of-detail downsampling for plotting long variables.
+A pyramid of min/max indexes is precomputed once, so getting the points of any x range
+at any resolution only takes a slice of the right level.
+"""
+
+import numpy
+
+# Constants
+PYRAMID_BASE = 4 # Buckets of a level merged into one bucket of the next level
+PYRAMID_MIN_BUCKETS = 256 # Levels stop when they have fewer buckets than this
+POINTS_PER_PIXEL = 2 # Points drawn per horizontal pixel of the axes
+
+'''
+    Pyramid of min/max indexes of a 1D array
+    Level k has buckets of PYRAMID_BASE ** (k + 1) samples, and for each bucket
+    the index of its minimum and maximum value
+'''
+class MinMaxPyramid:
+    def __init__(self, y, base=PYRAMID_BASE):
+        self.base = base
+        self.size = len(y)
+        self.levels = [] # (bucket size, min indexes, max indexes)
+
+        if self.size <= base:
+            return
+
+        # First level, directly from the samples
+        y = numpy.asarray(y, dtype=numpy.float64)
+        index = numpy.arange(self.size)
+        min_index = merge_buckets(y, index, base, numpy.argmin)
+        max_index = merge_buckets(y, index, base, numpy.argmax)
+        bucket = base
+        self.levels.append((bucket, min_index, max_index))
+
+        # Next levels, from the previous level indexes
+        while len(min_index) > PYRAMID_MIN_BUCKETS:
+            min_index = merge_buckets(y, min_index, base, numpy.argmin)
+            max_index = merge_buckets(y, max_index, base, numpy.argmax)
+            bucket *= base
+            self.levels.append((bucket, min_index, max_index))
+
+    '''
+        Extend the pyramid to the samples appended to y, the first samples must be the ones it was built with
+        Only the last (incomplete) bucket of each level and the new ones are computed, not the whole pyramid
+    '''
+    def extend(self, y):
+        size = len(y)
+        if size <= self.size:
+            return
+        if not self.levels:
+            self.__init__(y, self.base)
+            return
+
+        y = numpy.asarray(y, dtype=numpy.float64)
+        base = self.base
+        levels = []
+        first = self.size // base # First bucket of the current level to compute again
+        min_index = max_index = None
+        bucket = base
+        while min_index is None or len(min_index) > PYRAMID_MIN_BUCKETS:
+            k = len(levels)
+            if k >= len(self.levels):
+                first = 0 # New level, computed whole
+
+            if min_index is None: # First level, directly from the samples
+                index = numpy.arange(first * base, size)
+                new_min = merge_buckets(y, index, base, numpy.argmin)
+                new_max = merge_buckets(y, index, base, numpy.argmax)
+            else:
+                new_min = merge_buckets(y, min_index[first * base:], base, numpy.argmin)
+                new_max = merge_buckets(y, max_index[first * base:], base, numpy.argmax)
+
+            if k < len(self.levels):
+                _, old_min, old_max = self.levels[k]
+                new_min = numpy.concatenate((old_min[:first], new_min))
+                new_max = numpy.concatenate((old_max[:first], new_max))
+
+            levels.append((bucket, new_min, new_max))
+            min_index, max_index = new_min, new_max
+            bucket *= base
+            first //= base
+
+        self.levels = levels
+        self.size = size
+
+    '''
+        Indexes of the samples to draw between i0 and i1 (excluded) with at most about max_points
+        Returns every index if they fit, otherwise the min and max of each bucket of the finest level that fits
+    '''
+    def indexes(self, i0, i1, max_points):
+        i0 = max(0, i0)
+        i1 = min(self.size, i1)
+        if i1 - i0 <= max_points or not self.levels:
+            return numpy.arange(i0, i1)
+
+        for bucket, min_index, max_index in self.levels:
+            if 2 * (i1 - i0) / bucket <= max_points:
+                break
+
+        b0 = i0 // bucket
+        b1 = -(-i1 // bucket)
+        index = numpy.concatenate(([i0], min_index[b0:b1], max_index[b0:b1], [i1 - 1]))
+        return numpy.unique(index) # Sorted, so lines are drawn left to right
+
+'''
+    Merge groups of base candidate indexes into one, keeping the one selected by arg (argmin or argmax)
+    The last group is padded repeating its last index
+'''
+def merge_buckets(y, index, base, arg):
+    pad = -len(index) % base
+    if pad:
+        index = numpy.concatenate((index, numpy.repeat(index[-1:], pad)))
+
+    groups = index.reshape(-1, base)
+    choice = arg(y[groups], axis=1)
+    return groups[numpy.arange(len(groups)), choice]
+
+'''
+    Level of detail of one plotted variable, with its full resolution data
+    x must be sorted (sample index or timestamps)
+'''
+class LevelOfDetail:
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+        self.pyramid = MinMaxPyramid(y)
+
+    def __len__(self):
+        return len(self.y)
+
+    # Use the data with new samples appended (follow mode), see MinMaxPyramid.extend
+    def extend(self, x, y):
+        self.x = x
+        self.y = y
+        self.pyramid.extend(y)
+
+    '''
+        Points to draw between xmin and xmax (None for the whole variable) with at most about max_points
+        One extra sample is kept at each side, so lines reach the edges of the axes
+    '''
+    def points(self, xmin=None, xmax=None, max_points=2000):
+        i0 = 0 if xmin is None else numpy.searchsorted(self.x, xmin, side='left') - 1
+        i1 = len(self.x) if xmax is None else numpy.searchsorted(self.x, xmax, side='right') + 1
+
+        index = self.pyramid.indexes(int(i0), int(i1), max(2, int(max_points)))
+        return self.x[index], self.y[index]
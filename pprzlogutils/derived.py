@@ -0,0 +1,309 @@
+"""
+pprzlogutils - A Python library for parsing and processing Paparazzi UAV log files.
+
+derived provides derived variables: named expressions over the message columns, evaluated with NumPy.
+They are used like the fields of a pseudo message, DERIVED, so (id, DERIVED, name) works in
+logparser.get_var, logparser.get, logparser.align, the plot and the export like (id, message, var).
+
+Expressions are Python expressions, checked and compiled once when defined:
+
+    speed = sqrt(INS.ins_xd**2 + INS.ins_yd**2)     -> variables of the current ID, MESSAGE.var
+    dx = INS[205].ins_x - INS[204].ins_x            -> variables of another ID, MESSAGE[id].var
+    speed_avg = rolling_mean(speed, 50)             -> other derived variables, by name
+    accel = diff(speed) / diff(t)                   -> t (or TIMESTAMP) are the timestamps
+
+The result has the timestamps of the first variable of the expression, the other variables
+are resampled at them (linear interpolation, see alignment). Integers are converted to float.
+
+Results are evaluated the first time they are used and saved in the vars cache of the flight,
+with the number of rows of every message they depend on. They are evaluated again only when one of them
+grows (follow mode) or when the expression of the variable, or of a derived variable it uses, is defined again.
+"""
+
+import ast
+import itertools
+import keyword
+import numpy
+
+import pprzlogutils.alignment as alignment
+import pprzlogutils.columns as cols
+import pprzlogutils.logparser as lp
+import pprzlogutils.profiling as prof
+
+# Constants
+DERIVED = 'DERIVED' # Pseudo message of the derived variables
+ALIGN_METHOD = 'linear' # Resampling of the variables which do not have the timestamps of the first one
+TIME_NAMES = ('t', cols.TIMESTAMP)
+REFERENCE_PREFIX = '_ref' # Names given to the variables in the compiled expressions
+TIME_REFERENCE = '_t'
+
+DEFINITIONS = {} # name -> Derived
+VERSIONS = itertools.count(1) # Every definition gets a new version, see state
+
+class DerivedError(ValueError):
+    pass
+
+def diff(x):
+    return numpy.diff(numpy.asarray(x, dtype=numpy.float64), prepend=numpy.nan) # Same length as x
+
+def norm(*xs):
+    return numpy.sqrt(sum(numpy.square(x) for x in xs))
+
+'''
+    Mean of the last n samples (fewer at the beginning), ignoring NaN
+    Computed with cumulative sums, so the cost does not depend on n
+'''
+def rolling_mean(x, n):
+    x = numpy.asarray(x, dtype=numpy.float64)
+    n = int(n)
+    if n < 1:
+        raise DerivedError('rolling_mean window must be at least 1, got %d' % n)
+
+    valid = ~numpy.isnan(x)
+    sums = numpy.concatenate(([0.0], numpy.cumsum(numpy.where(valid, x, 0.0))))
+    counts = numpy.concatenate(([0], numpy.cumsum(valid)))
+    end = numpy.arange(1, len(x) + 1)
+    start = numpy.maximum(end - n, 0)
+
+    total = counts[end] - counts[start]
+    return numpy.divide(sums[end] - sums[start], total, out=numpy.full(len(x), numpy.nan), where=total > 0)
+
+FUNCTIONS = {
+    'abs': numpy.abs, 'sqrt': numpy.sqrt, 'exp': numpy.exp, 'log': numpy.log, 'log10': numpy.log10,
+    'sin': numpy.sin, 'cos': numpy.cos, 'tan': numpy.tan, 'arcsin': numpy.arcsin, 'arccos': numpy.arccos,
+    'arctan': numpy.arctan, 'arctan2': numpy.arctan2, 'hypot': numpy.hypot, 'degrees': numpy.degrees,
+    'radians': numpy.radians, 'unwrap': numpy.unwrap, 'sign': numpy.sign, 'floor': numpy.floor, 'ceil': numpy.ceil,
+    'round': numpy.round, 'minimum': numpy.minimum, 'maximum': numpy.maximum, 'clip': numpy.clip, 'where': numpy.where,
+    'cumsum': numpy.cumsum, 'mean': numpy.nanmean, 'std': numpy.nanstd, 'min': numpy.nanmin, 'max': numpy.nanmax,
+    'diff': diff, 'norm': norm, 'rolling_mean': rolling_mean,
+}
+CONSTANTS = {'pi': numpy.pi, 'e': numpy.e}
+
+# Nodes allowed in expressions, besides variables (see References) and calls to FUNCTIONS
+ALLOWED_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Load, ast.operator, ast.unaryop, ast.cmpop)
+
+'''
+    Definition of a derived variable
+    refs: variables used, in order of appearance, as (id, message, var). id is None for the current ID,
+    and derived variables are (None, DERIVED, name)
+'''
+class Derived:
+    def __init__(self, name, expression):
+        self.name = name
+        self.expression = expression
+        self.code, self.refs = compile_expression(name, expression)
+        self.version = next(VERSIONS)
+
+    def __repr__(self):
+        return '%s = %s' % (self.name, self.expression)
+
+'''
+    Check an expression and replace its variables by the names _ref0, _ref1... (one per variable)
+    Anything else than numbers, operators, FUNCTIONS, CONSTANTS and variables is an error
+'''
+class References(ast.NodeTransformer):
+    def __init__(self):
+        self.refs = []
+
+    def generic_visit(self, node):
+        if not isinstance(node, ALLOWED_NODES):
+            raise DerivedError('%s is not allowed in derived variables' % type(node).__name__)
+        return super().generic_visit(node)
+
+    def visit_Constant(self, node):
+        if not isinstance(node.value, (int, float)):
+            raise DerivedError('Only numbers are allowed as constants, got %r' % (node.value,))
+        return node
+
+    # MESSAGE.var or MESSAGE[id].var
+    def visit_Attribute(self, node):
+        value = node.value
+        id = None
+        if isinstance(value, ast.Subscript):
+            index = value.slice
+            if not isinstance(index, ast.Constant) or not isinstance(index.value, int):
+                raise DerivedError('The ID of %s must be a number, as in INS[204].ins_x' % ast.unparse(node))
+            id = index.value
+            value = value.value
+
+        if not isinstance(value, ast.Name):
+            raise DerivedError('Variables are MESSAGE.var or MESSAGE[id].var, got %s' % ast.unparse(node))
+        return self.reference((id, value.id, node.attr), node)
+
+    # Derived variables, constants and the timestamps
+    def visit_Name(self, node):
+        if node.id in CONSTANTS:
+            return node
+        if node.id in TIME_NAMES:
+            return ast.copy_location(ast.Name(TIME_REFERENCE, ast.Load()), node)
+        return self.reference((None, DERIVED, node.id), node)
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS:
+            raise DerivedError('Unknown function %s, use one of %s' % (ast.unparse(node.func), ', '.join(sorted(FUNCTIONS))))
+        if node.keywords:
+            raise DerivedError('Keyword arguments are not allowed in derived variables')
+
+        node.args = [self.visit(arg) for arg in node.args]
+        return node
+
+    def reference(self, ref, node):
+        if ref not in self.refs:
+            self.refs.append(ref)
+        return ast.copy_location(ast.Name(REFERENCE_PREFIX + str(self.refs.index(ref)), ast.Load()), node)
+
+# Compile an expression, returns (code, refs), see References
+def compile_expression(name, expression):
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError as e:
+        raise DerivedError('Invalid expression for %s: %s' % (name, e.msg))
+
+    references = References()
+    tree = ast.fix_missing_locations(references.visit(tree))
+    if not references.refs:
+        raise DerivedError('%s does not use any variable' % name)
+
+    return compile(tree, '<derived %s>' % name, 'eval'), references.refs
+
+#####################################################################
+#####################################################################
+# Definitions
+#####################################################################
+#####################################################################
+
+'''
+    Define (or define again) a derived variable, see the module documentation for the expressions
+
+    Returns the Derived definition. Raises DerivedError if the expression is not valid
+'''
+def define(name, expression):
+    name = name.strip()
+    if not name.isidentifier() or keyword.iskeyword(name) or name in FUNCTIONS or name in CONSTANTS or name in TIME_NAMES:
+        raise DerivedError('Invalid name for a derived variable: %s' % name)
+
+    definition = Derived(name, expression)
+    if (None, DERIVED, name) in definition.refs:
+        raise DerivedError('%s can not use itself' % name)
+
+    DEFINITIONS[name] = definition
+    return definition
+
+def remove(name):
+    DEFINITIONS.pop(name, None)
+
+def names():
+    return sorted(DEFINITIONS.keys(), key=str.lower)
+
+# Split a definition given as text, 'name = expression'
+def parse_definition(text):
+    name, sep, expression = text.partition('=')
+    if not sep or not expression.strip():
+        raise DerivedError('Derived variables are defined as name = expression, got %s' % text)
+    return name.strip(), expression.strip()
+
+'''
+    Define the derived variables of a text file, one 'name = expression' per line
+    Empty lines and lines starting with # are skipped
+
+    Returns the list of names defined
+'''
+def load_definitions(path):
+    defined = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                defined.append(define(*parse_definition(line)).name)
+
+    return defined
+
+#####################################################################
+#####################################################################
+# Evaluation
+#####################################################################
+#####################################################################
+
+# Definition of a variable, checking there is no cycle (a uses b and b uses a)
+def get_definition(name, visiting):
+    definition = DEFINITIONS.get(name)
+    if definition is None:
+        raise DerivedError('Unknown derived variable %s' % name)
+    if name in visiting:
+        raise DerivedError('Circular definition: %s' % ' -> '.join(visiting + (name,)))
+    return definition
+
+'''
+    State of the inputs of a derived variable for an ID: its version and the rows of every message it uses
+    A cached result is valid while the state does not change
+'''
+def state(id, name, columns, visiting=()):
+    definition = get_definition(name, visiting)
+
+    parts = [definition.version]
+    for ref_id, message, var in definition.refs:
+        ref_id = id if ref_id is None else ref_id
+        if message == DERIVED:
+            parts.append(state(ref_id, var, columns, visiting + (name,)))
+            continue
+
+        try:
+            parts.append(len(columns[ref_id][message]))
+        except KeyError:
+            raise DerivedError('%s uses %s, which ID %s does not have' % (name, message, ref_id))
+
+    return tuple(parts)
+
+'''
+    Evaluate a derived variable for an ID, or take it from vars_cache if its inputs did not change
+
+    Returns the result as message columns, with the fields TIMESTAMP and name
+'''
+def evaluate(id, name, columns, vars_cache, visiting=()):
+    key = (id, DERIVED, name)
+    current = state(id, name, columns, visiting)
+    cached = vars_cache.get(key)
+    if cached is not None and cached[0] == current:
+        return cached[1]
+
+    definition = DEFINITIONS[name]
+    with prof.stage('derived'):
+        inputs = []
+        for ref_id, message, var in definition.refs:
+            ref_id = id if ref_id is None else ref_id
+            if message == DERIVED:
+                result = evaluate(ref_id, var, columns, vars_cache, visiting + (name,))
+                inputs.append((result.column(cols.TIMESTAMP), result.column(var)))
+            else:
+                timestamps = lp.get_var(ref_id, message, cols.TIMESTAMP, columns, vars_cache)
+                if var not in columns[ref_id][message].columns:
+                    raise DerivedError('%s uses %s.%s, which is not a variable of %s' % (name, message, var, message))
+                inputs.append((timestamps, lp.get_var(ref_id, message, var, columns, vars_cache)))
+
+        base = inputs[0][0]
+        namespace = dict(FUNCTIONS, **CONSTANTS)
+        namespace[TIME_REFERENCE] = base
+        for i, (timestamps, values) in enumerate(inputs):
+            namespace[REFERENCE_PREFIX + str(i)] = resample(name, timestamps, values, base)
+
+        try:
+            with numpy.errstate(all='ignore'):
+                values = eval(definition.code, {'__builtins__': {}}, namespace)
+            values = numpy.broadcast_to(numpy.asarray(values, dtype=numpy.float64), base.shape)
+        except (TypeError, ValueError) as e:
+            raise DerivedError('Could not evaluate %s: %s' % (name, e))
+
+        result = cols.MessageColumns(DERIVED, [cols.Field(name, 'double', numpy.dtype(numpy.float64), False, False)])
+        result.append_block(base, {name: values})
+
+    vars_cache[key] = (current, result)
+    return result
+
+# Values of an input as float, at the base timestamps
+def resample(name, timestamps, values, base):
+    if values.dtype == object or values.ndim != 1:
+        raise DerivedError('%s uses strings or arrays, only numbers can be used' % name)
+
+    if timestamps is base or (len(timestamps) == len(base) and numpy.array_equal(timestamps, base)):
+        return values.astype(numpy.float64, copy=False)
+    return alignment.resample(timestamps, values, base, ALIGN_METHOD)
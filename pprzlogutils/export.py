@@ -0,0 +1,178 @@
+"""
+pprzlogutils - A Python library for parsing and processing Paparazzi UAV log files.
+
+export provides non-interactive batch export of the parsed columns to binary NumPy formats.
+Every selected (id, message) is exported in a thread pool.
+
+Formats:
+
+    npy     -> output/id/message/var.npy, one real binary .npy file per variable
+    npz     -> output/id/message.npz, one file per message with every variable
+    columns -> output/id/message/var.npy plus output/manifest.json, a memory-mappable column store
+               which can be read back with cache.read_store
+    txt     -> output/id/message/var.txt, plain text (numpy.savetxt)
+
+Array variables are saved as two arrays, var.offsets and var.values (see columns.RaggedBuffer)
+
+Derived variables (see derived) are exported as the message DERIVED, each with its own timestamps:
+output/id/DERIVED/name.npy and name.TIMESTAMP.npy (name and name.TIMESTAMP in DERIVED.npz).
+They are not part of the columns format, whose messages have one timestamp column each.
+"""
+
+import numpy
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pprzlogutils.cache as cache
+import pprzlogutils.columns as cols
+import pprzlogutils.derived as derived
+import pprzlogutils.logparser as lp
+import pprzlogutils.profiling as prof
+
+# Constants
+EXPORT_FORMATS = ('npy', 'npz', 'columns', 'txt')
+EXPORT_THREADS = os.cpu_count() or 1
+
+'''
+    Select the (id, message) pairs to export
+    ids and messages are lists, None selects all of them
+'''
+def select_streams(ids=None, messages=None):
+    streams = []
+    for id in sorted(lp.DATA_COLUMNS.keys()):
+        if ids is not None and id not in ids:
+            continue
+
+        for name in sorted(lp.DATA_COLUMNS[id].keys()):
+            if messages is None or name in messages:
+                streams.append((id, name))
+
+    return streams
+
+# Fields of a message to export, vars is a list of names (None selects all of them)
+def select_fields(message, vars=None):
+    return [f for f in message.fields if vars is None or f.name in vars]
+
+'''
+    Get the arrays to save for a message: TIMESTAMP plus each field
+    Array fields give two arrays, name.offsets and name.values
+'''
+def message_arrays(message, fields):
+    arrays = {cols.TIMESTAMP: message.column(cols.TIMESTAMP)}
+    for field in fields:
+        column = message.columns[field.name]
+        if field.array:
+            arrays[field.name + '.offsets'] = column.offsets.view()
+            arrays[field.name + '.values'] = column.values.view()
+        elif field.string:
+            arrays[field.name] = column.view().astype(numpy.str_)
+        else:
+            arrays[field.name] = column.view()
+
+    return arrays
+
+'''
+    Export one message of one id to output_dir, in the given format
+
+    Returns the number of rows exported
+'''
+def export_message(id, name, output_dir, fmt='npy', vars=None):
+    message = lp.DATA_COLUMNS[id][name]
+    fields = select_fields(message, vars)
+    id_dir = os.path.join(output_dir, str(id))
+    os.makedirs(id_dir, exist_ok=True)
+
+    if fmt == 'columns':
+        return cache.write_message(os.path.join(id_dir, name), message, fields)
+
+    arrays = message_arrays(message, fields)
+    if fmt == 'npz':
+        numpy.savez(os.path.join(id_dir, name + '.npz'), **arrays)
+        return len(message)
+
+    message_dir = os.path.join(id_dir, name)
+    os.makedirs(message_dir, exist_ok=True)
+    for var, array in arrays.items():
+        if fmt == 'npy':
+            numpy.save(os.path.join(message_dir, var + '.npy'), array)
+        elif array.dtype.kind in 'biuf':
+            numpy.savetxt(os.path.join(message_dir, var + '.txt'), array)
+
+    return len(message)
+
+'''
+    Export the selected ids, messages and vars (None selects all) to output_dir without prompts
+    Messages are exported in parallel by a pool of threads, then the derived variables (see export_derived)
+
+    Returns a dictionary, streams[id][name] -> exported rows
+'''
+def export(output_dir, ids=None, messages=None, vars=None, fmt='npy', threads=EXPORT_THREADS):
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError('Unknown export format %s, use one of %s' % (fmt, ', '.join(EXPORT_FORMATS)))
+
+    os.makedirs(output_dir, exist_ok=True)
+    selected = select_streams(ids, messages)
+
+    streams = {}
+    with prof.stage('export'), ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        futures = {}
+        for id, name in selected:
+            futures[(id, name)] = executor.submit(export_message, id, name, output_dir, fmt, vars)
+
+        for (id, name), future in futures.items():
+            streams.setdefault(id, {})[name] = future.result()
+
+    if fmt == 'columns':
+        # Schema with only the exported fields, so the store can be read back
+        messages_fields = {}
+        for id, name in selected:
+            messages_fields[name] = select_fields(lp.DATA_COLUMNS[id][name], vars)
+        cache.write_manifest(output_dir, messages_fields, streams)
+    elif derived.DEFINITIONS and (messages is None or derived.DERIVED in messages):
+        export_derived(output_dir, ids, vars, fmt, streams)
+
+    return streams
+
+'''
+    Export the derived variables selected by vars (None selects all), for every selected ID where they can be evaluated
+    Exported variables are added to streams as streams[id]['DERIVED.name'] -> rows
+'''
+def export_derived(output_dir, ids=None, vars=None, fmt='npy', streams=None):
+    if streams is None:
+        streams = {}
+
+    names = [name for name in derived.names() if vars is None or name in vars]
+    with prof.stage('export'):
+        for id in sorted(lp.DATA_COLUMNS.keys()):
+            if ids is not None and id not in ids:
+                continue
+
+            arrays = {}
+            for name in names:
+                try:
+                    result = lp.message_columns(id, derived.DERIVED, name)
+                except derived.DerivedError:
+                    continue # This ID does not have the variables it uses
+                arrays[name + '.' + cols.TIMESTAMP] = result.column(cols.TIMESTAMP)
+                arrays[name] = result.column(name)
+                streams.setdefault(id, {})[derived.DERIVED + '.' + name] = len(result)
+
+            if not arrays:
+                continue
+
+            id_dir = os.path.join(output_dir, str(id))
+            os.makedirs(id_dir, exist_ok=True)
+            if fmt == 'npz':
+                numpy.savez(os.path.join(id_dir, derived.DERIVED + '.npz'), **arrays)
+                continue
+
+            message_dir = os.path.join(id_dir, derived.DERIVED)
+            os.makedirs(message_dir, exist_ok=True)
+            for var, array in arrays.items():
+                if fmt == 'npy':
+                    numpy.save(os.path.join(message_dir, var + '.npy'), array)
+                else:
+                    numpy.savetxt(os.path.join(message_dir, var + '.txt'), array)
+
+    return streams
@@ -0,0 +1,95 @@
+"""
+pprzlogutils - A Python library for parsing and processing Paparazzi UAV log files.
+
+follow provides a live tail mode for .data files still being written during a flight.
+Only the bytes appended since the last poll are parsed, and a trailing partial line
+is kept until the rest of it is written. If the file is truncated or replaced (a new flight
+with the same name), the rows parsed until then are dropped and the new file is read from the beginning.
+"""
+
+import os
+
+import pprzlogutils.columns as cols
+import pprzlogutils.profiling as prof
+
+# Constants
+FOLLOW_CHUNK_BYTES = 16 * 1024 ** 2 # Bytes read at once, bounds memory when catching up with a big file
+FOLLOW_INTERVAL_MS = 100 # Time between polls (and plot updates) in the GUI
+
+'''
+    Follow a .data file, appending the new lines to a columns dictionary (columns[id][name])
+    Call poll() periodically, the first call parses the whole file written until then
+    vars_cache (memoized arrays of the columns) is cleared when the file is read again, see restart
+'''
+class DataFollower:
+    def __init__(self, path, columns, messages_fields, vars_cache=None):
+        self.path = path
+        self.columns = columns
+        self.messages_fields = messages_fields
+        self.vars_cache = vars_cache
+        self.offset = 0 # Bytes already read
+        self.partial = b'' # Last line, if it was not completely written yet
+        self.restarts = 0 # Times the file was truncated or replaced, users of the columns must replot them
+        self._file = open(path, 'rb')
+        self._inode = os.fstat(self._file.fileno()).st_ino
+
+    '''
+        Parse the lines appended since the last call
+        If the file got smaller (truncated) or is another file (replaced), it is read again from the beginning
+
+        progress(offset) is called after each chunk read. If it returns False the poll stops there,
+        the rest is read by the next poll
+
+        Returns the number of ingested lines
+    '''
+    def poll(self, progress=None):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return 0
+
+        if stat.st_size < self.offset or stat.st_ino != self._inode:
+            self.restart()
+
+        ingested = 0
+        self._file.seek(self.offset)
+        while True:
+            chunk = self._file.read(FOLLOW_CHUNK_BYTES)
+            if not chunk:
+                break
+            self.offset += len(chunk)
+            prof.count('bytes_read', len(chunk))
+
+            # Only complete lines are parsed, the rest waits for the next chunk or poll
+            chunk = self.partial + chunk
+            end = chunk.rfind(b'\n')
+            if end < 0:
+                self.partial = chunk
+                continue
+            self.partial = chunk[end + 1:]
+
+            lines = chunk[:end].decode('utf-8', 'replace').splitlines()
+            ingested += cols.ingest_lines(lines, self.columns, self.messages_fields)
+
+            if progress is not None and progress(self.offset) is False:
+                break
+
+        return ingested
+
+    '''
+        Drop every row parsed until now and read the file again from the beginning
+        The columns dictionary is cleared in place, as the session shares it
+    '''
+    def restart(self):
+        self._file.close()
+        self._file = open(self.path, 'rb')
+        self._inode = os.fstat(self._file.fileno()).st_ino
+        self.offset = 0
+        self.partial = b''
+        self.columns.clear()
+        if self.vars_cache is not None:
+            self.vars_cache.clear()
+        self.restarts += 1
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,264 @@
+"""
+pprzlogutils - A Python library for parsing and processing Paparazzi UAV log files.
+
+loader provides SessionLoader, which loads a flight in a background thread so the GUI is usable at once.
+The loader never writes to the session: it sends what it reads to the GUI thread with signals,
+and the GUI adds it to the session (see pyplottergui.start_loading).
+
+Steps:
+
+    schema   -> message definitions of the .log file, the GUI creates the structs and fills the Messages menu
+    index    -> line offsets of the .data file, IDs are sent as they are found. Then every message can be
+                plotted, parsed the first time it is used (lazy loading)
+    messages -> without lazy loading, every message is parsed in the background, smallest first,
+                and replaces its lazy columns when done. The flight is then saved in the cache
+
+Compressed .data files can not be indexed, they are parsed from start to end and their messages sent at the end.
+In follow mode the .data file is still being written: what is there is parsed by a follow.DataFollower,
+which is then sent to the GUI. FollowPoller keeps polling it in another thread, the GUI thread only appends
+the new rows to the session and redraws when there are any.
+Cancelling keeps everything read until then: the lines indexed, or the rows parsed of compressed or followed files.
+"""
+
+import os
+import threading
+
+from itertools import islice
+
+import pprzlogutils.cache as cache
+import pprzlogutils.columns as cols
+import pprzlogutils.compression as compression
+import pprzlogutils.dataindex as dataindex
+import pprzlogutils.follow as follow
+import pprzlogutils.logparser as lp
+import pprzlogutils.profiling as prof
+import pprzlogutils.schema as schema
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+# Constants
+SCHEMA_WAIT_SECONDS = 0.05 # Time between checks for a cancel while the GUI creates the structs
+STREAM_BATCH_LINES = 100000 # Lines of a compressed file parsed between progress updates
+
+'''
+    Background loader of a session (session.LogSession) which is not in the cache
+    Connect the signals, then call start(). requestInterruption() cancels the load
+'''
+class SessionLoader(QThread):
+    schemaLoaded = pyqtSignal(object) # Registry, the GUI calls session.load_schema and sets schema_ready
+    progress = pyqtSignal(int, str) # Percent (-1 if unknown) and description of the current step
+    idsFound = pyqtSignal(object) # List of IDs found since the last time
+    indexed = pyqtSignal(object) # Index of the .data file, see dataindex.scan_offsets
+    messageLoaded = pyqtSignal(int, str, object) # id, name and columns of a message completely parsed
+    followed = pyqtSignal(object) # follow.DataFollower positioned after the lines sent, see load_followed
+    failed = pyqtSignal(str)
+
+    def __init__(self, session, use_cache=True, lazy=True, parent=None, follow=False):
+        super().__init__(parent)
+        self.session = session
+        self.use_cache = use_cache
+        self.lazy = lazy
+        self.follow = follow
+        self.schema_ready = threading.Event()
+        self.ids = set() # IDs already sent
+        self.cancelled = False
+
+    # Cancel the load. Qt clears the interruption flag when the thread ends, cancelled is kept
+    def requestInterruption(self):
+        self.cancelled = True
+        super().requestInterruption()
+
+    def run(self):
+        try:
+            self.load()
+        except Exception as e:
+            self.failed.emit('%s: %s' % (type(e).__name__, e))
+
+    def load(self):
+        session = self.session
+        self.progress.emit(-1, 'Reading message definitions of %s' % os.path.basename(session.log_path))
+        with prof.stage('schema'):
+            registry = schema.load_registry(session.log_path, schema.SCHEMA_CACHE_DIR if self.use_cache else None)
+        self.schemaLoaded.emit(registry)
+
+        # The structs are created by the GUI thread, the fields are needed to parse the messages
+        while not self.schema_ready.wait(SCHEMA_WAIT_SECONDS):
+            if self.isInterruptionRequested():
+                return
+
+        if self.follow:
+            self.load_followed()
+        elif compression.is_compressed(session.data_path):
+            self.load_stream()
+        else:
+            self.load_indexed()
+
+    # Send the IDs not sent yet, given as bytes (index) or integers (columns)
+    def find_ids(self, ids):
+        found = []
+        for id in ids:
+            try:
+                id = int(id)
+            except ValueError:
+                continue
+            if id not in self.ids:
+                self.ids.add(id)
+                found.append(id)
+
+        if found:
+            self.idsFound.emit(sorted(found))
+
+    def load_indexed(self):
+        path = self.session.data_path
+        size = max(os.path.getsize(path), 1)
+        name = os.path.basename(path)
+
+        def scan_progress(offset, streams):
+            self.find_ids(id for id, _ in streams.keys())
+            self.progress.emit(100 * offset // size, 'Indexing %s' % name)
+            return not self.isInterruptionRequested()
+
+        self.progress.emit(0, 'Indexing %s' % name)
+        with prof.stage('index_data'):
+            index = dataindex.scan_offsets(path, scan_progress)
+        prof.count('bytes_read', size)
+        self.find_ids(id for id, _ in index.keys())
+        self.indexed.emit(index)
+
+        if self.lazy or self.isInterruptionRequested():
+            return
+
+        # Parse every message in columns of its own, the GUI keeps using the lazy ones until each is sent
+        columns = {}
+        lp.index_datafile(path, columns, index, self.session.fields)
+        messages = sorted((len(m), id, name, m) for id, inner_dict in columns.items() for name, m in inner_dict.items())
+        for i, (_, id, message_name, message) in enumerate(messages):
+            if self.isInterruptionRequested():
+                return
+            self.progress.emit(100 * i // len(messages), 'Parsing %s (%d/%d)' % (message_name, i + 1, len(messages)))
+            message.load()
+            self.messageLoaded.emit(id, message_name, message)
+
+        self.save(columns)
+
+    def load_stream(self):
+        path = self.session.data_path
+        name = os.path.basename(path)
+        columns = {}
+        parsed = 0
+
+        with compression.LineReader(path) as datafile:
+            lines = iter(datafile)
+            while not self.isInterruptionRequested():
+                batch = list(islice(lines, STREAM_BATCH_LINES))
+                if not batch:
+                    break
+                with prof.stage('parse_data'):
+                    cols.ingest_lines(batch, columns, self.session.fields)
+                parsed += len(batch)
+                self.find_ids(columns.keys())
+                self.progress.emit(-1, 'Parsing %s (%d lines)' % (name, parsed))
+
+        for id, inner_dict in columns.items():
+            for message_name, message in inner_dict.items():
+                self.messageLoaded.emit(id, message_name, message)
+
+        if not self.isInterruptionRequested():
+            self.save(columns)
+
+    '''
+        Parse the .data file written until now, then send the follower to the GUI, which polls the new lines
+        The file is still growing, so it is neither indexed nor saved in the cache
+    '''
+    def load_followed(self):
+        path = self.session.data_path
+        if compression.is_compressed(path):
+            raise ValueError('%s is compressed, only plain .data files can be followed' % path)
+        size = max(os.path.getsize(path), 1)
+        name = os.path.basename(path)
+        columns = {}
+        follower = follow.DataFollower(path, columns, self.session.fields)
+
+        def poll_progress(offset):
+            self.find_ids(columns.keys())
+            self.progress.emit(min(100 * offset // size, 100), 'Parsing %s' % name)
+            return not self.isInterruptionRequested()
+
+        self.progress.emit(0, 'Parsing %s' % name)
+        with prof.stage('parse_data'):
+            follower.poll(poll_progress)
+        self.find_ids(columns.keys())
+
+        for id, inner_dict in columns.items():
+            for message_name, message in inner_dict.items():
+                self.messageLoaded.emit(id, message_name, message)
+
+        if self.isInterruptionRequested():
+            follower.close()
+        else:
+            self.followed.emit(follower)
+
+    # Save the flight in the cache, so it is memory mapped the next time
+    def save(self, columns):
+        if not self.use_cache:
+            return
+
+        self.progress.emit(-1, 'Saving %s in the cache' % self.session.name)
+        key = cache.flight_key(self.session.log_path, self.session.data_path)
+        cache.save(key, columns=columns, messages_fields=self.session.fields)
+        cache.evict(keep=key)
+
+'''
+    Background poller of a followed .data file (session.follower, see follow.DataFollower)
+    Every FOLLOW_INTERVAL_MS the new lines are parsed in this thread, into columns of their own.
+    Their rows are appended to the session by add_rows, which runs in the GUI thread,
+    and then updated is emitted. Nothing is sent if the file did not change
+'''
+class FollowPoller(QThread):
+    polled = pyqtSignal(object, bool) # New rows {id: {name: (timestamps, values, statistics)}}, True if the file was read again
+    updated = pyqtSignal(bool) # Rows added to the session, True if its rows were dropped and read again (replot everything)
+    failed = pyqtSignal(str)
+
+    def __init__(self, session, parent=None):
+        super().__init__(parent)
+        self.session = session
+        self.follower = session.follower
+        self.follower.vars_cache = None # The cache of the session is cleared in the GUI thread, see add_rows
+        self.polled.connect(self.add_rows) # Queued, this object lives in the GUI thread
+
+    def run(self):
+        follower = self.follower
+        while not self.isInterruptionRequested():
+            restarts = follower.restarts
+            follower.columns = {}
+            try:
+                follower.poll()
+            except Exception as e:
+                self.failed.emit('%s: %s' % (type(e).__name__, e))
+                return
+
+            blocks = {}
+            for id, inner_dict in follower.columns.items():
+                blocks[id] = {name: (*message.to_block(), message.stats) for name, message in inner_dict.items()}
+            restarted = follower.restarts != restarts
+            if blocks or restarted:
+                self.polled.emit(blocks, restarted)
+
+            self.msleep(follow.FOLLOW_INTERVAL_MS)
+
+    # Append the rows parsed by the last poll to the session (GUI thread)
+    def add_rows(self, blocks, restarted):
+        session = self.session
+        if restarted:
+            session.columns.clear()
+            session.vars_cache.clear()
+
+        for id, inner_dict in blocks.items():
+            messages = session.columns.setdefault(id, {})
+            for name, (timestamps, values, block_stats) in inner_dict.items():
+                message = messages.get(name)
+                if message is None:
+                    message = messages[name] = cols.MessageColumns(name, session.fields[name])
+                message.append_block(timestamps, values, block_stats)
+
+        self.updated.emit(restarted)
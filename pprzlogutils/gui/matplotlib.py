@@ -7,11 +7,23 @@ Author: Pelochus
 Date: July 2024
 """
 
+import numpy
+import pprzlogutils.alignment as alignment
+import pprzlogutils.columns as cols
+import pprzlogutils.decimation as dec
+import pprzlogutils.derived as derived
 import pprzlogutils.logparser as lp
+import pprzlogutils.memory as memory
+import pprzlogutils.profiling as prof
+import pprzlogutils.render as render
 
+from matplotlib.lines import Line2D
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
 
+# Constants
+XY_MAX_POINTS = 100000 # Points drawn per line against a variable, longer lines are strided
+
 #####################################################################
 #####################################################################
 # Matplotlib section
@@ -21,54 +33,358 @@ from matplotlib.figure import Figure
 #####################################################################
 
 class MplCanvas(FigureCanvas):
-    def __init__(self, parent=None, width=16, height=9, dpi=100):
+    def __init__(self, parent=None, width=16, height=9, dpi=100, session=None):
         fig = Figure(figsize=(width, height), dpi=dpi)
         self.axes = fig.add_subplot(111)
         self.points = False
+        self.session = session # Flight to plot (session.LogSession), None plots the current logparser data
+        self.overlays = [] # Other flights plotted on top, with the same checked variables
+        self.lines = {} # Plotted artists, (session, id, message, var) -> Line2D or PathCollection
+        self.lod = {} # Full resolution data of the lines, (session, id, message, var) -> LevelOfDetail. Kept when unchecked
+        self.pinned = {} # Columns of the plotted variables, pinned in memory (see memory.pin), key -> MessageColumns
+        self.time_range = None # (t0, t1) in seconds, only that window is read and plotted against time. None plots everything
+        self.x_var = None # (id, message, var) on the x axis, the plotted variables are resampled at its timestamps
+        self.align_method = alignment.DEFAULT_METHOD # Resampling against x_var, see alignment.ALIGN_METHODS
+        self.xy_rows = {} # Rows of x_var when each line was plotted against it
+        self.scatter_rows = {} # Rows of the array variables when they were plotted as points
+        self.plotted = None # (id, points, overlays, time_range, x_var, align_method) of the plotted artists, changing any replots everything
 
         super().__init__(fig)
         self.setParent(parent)
 
+        # Lines are decimated again when the axes width changes
+        self.mpl_connect('resize_event', lambda event: self.decimate_lines())
+
+    # Drawing is timed as a profiling stage, it is where most of the time goes for long variables
+    @prof.timed('draw')
+    def draw(self):
+        super().draw()
+
+    # Flights plotted: the main one plus the overlays
+    def sessions(self):
+        return [self.session] + [s for s in self.overlays if s is not self.session]
+
+    # Columns and memoized arrays of a flight, or of the current logparser data
+    def get_columns(self, session):
+        return lp.DATA_COLUMNS if session is None else session.columns
+
+    def get_vars_cache(self, session):
+        return lp.VARS_CACHE if session is None else session.vars_cache
+
+    # Unit of a variable (see columns.field_unit), None if unknown
+    def get_unit(self, session, message, var):
+        messages_fields = lp.MESSAGES_FIELDS if session is None else session.fields
+        for field in messages_fields.get(message, []):
+            if field.name == var:
+                return cols.field_unit(field)
+        return None
+
+    def get_var(self, session, id, message, var):
+        if session is None:
+            return lp.get_var(id, message, var)
+        return session.get_var(id, message, var)
+
+    '''
+        Data of a variable to plot, as (x, values)
+        x is the sample index, or the timestamps if there is a time range (only its window is read, see logparser.get)
+    '''
+    def get_data(self, session, id, message, var):
+        if self.time_range is None:
+            v = self.get_var(session, id, message, var)
+            return numpy.arange(len(v)), v
+
+        window = lp.get(id, message, [var], *self.time_range, self.get_columns(session), self.get_vars_cache(session))
+        return window[cols.TIMESTAMP], window[var]
+
+    '''
+        Data of a variable to plot against x_var, as (x, values)
+        The variable is resampled at the timestamps of x_var (in the time range, if any), see logparser.align
+
+        Returns None if the flight does not have x_var
+    '''
+    def get_xy(self, session, id, message, var):
+        x_id, x_message, x_name = self.x_var
+        columns = self.get_columns(session)
+        if x_message not in columns.get(x_id, {}):
+            return None
+
+        base = lp.get(x_id, x_message, [x_name], *(self.time_range or (None, None)), columns)
+        aligned = lp.align([(id, message, var)], base[cols.TIMESTAMP], method=self.align_method, columns=columns, vars_cache=self.get_vars_cache(session))
+        return base[x_name], aligned[(id, message, var)]
+
     # Plot a single variable
-    def plot_var(self, id, message, var):
-        v = lp.convert_var_to_numpy(id, message, var)
+    def plot_var(self, id, message, var, session=None):
+        key = (session, id, message, var)
+
+        label = render.var_label(message, var, self.get_unit(session, message, var))
+        if self.overlays and session is not None:
+            label = session.name + ': ' + label
+
+        if self.x_var is not None:
+            self.plot_xy(key, label)
+            return
+
+        x, v = self.get_data(*key)
+        y = render.line_values(v)
+        if y is not None: # If v not a matrix (or one value per row), x axis is time
+            # Only the decimated points are drawn, see decimate_lines
+            lod = self.get_lod(key, x, y)
+            x, y = lod.points(*self.view_xlim(), self.max_points())
 
-        if len(v[0]) == 1: # If v not a matrix, x axis is time
             if not self.points:
-                self.axes.plot(v, label=message + ' - ' + var)
+                artist, = self.axes.plot(x, y, label=label)
             else:
-                self.axes.plot(v, 'o', markersize=2, label=message + ' - ' + var)
+                artist, = self.axes.plot(x, y, 'o', markersize=2, label=label)
         else: # If var is an array, x axis is the array index
             print("Using scatter plot because selected variable is an array")
 
-            v1 = []
-            v2 = []
-            for i in range(len(v)):
-                v1.append(v[i][0])
-                v2.append(v[i][1])
-            
-            self.axes.scatter(v1, v2, s=10, label=message + ' - ' + var)
+            artist = self.axes.scatter(*render.array_points(v), s=10, label=label)
+            self.scatter_rows[key] = len(v)
+
+        self.lines[key] = artist
+        self.pin_var(key)
+
+    '''
+        Plot a variable against x_var, every sample as an (x, y) point
+        Array variables give one line per element
+    '''
+    def plot_xy(self, key, label):
+        if key[1:] == self.x_var:
+            return # Against itself
+
+        if self.get_var(*key).dtype == object:
+            print("Skipping %s, its rows have different lengths or are not numbers" % label)
+            return
+
+        data = self.get_xy(*key)
+        if data is None:
+            print("Skipping %s, the flight does not have the x axis variable" % label)
+            return
+
+        x, y = data
+
+        step = max(1, len(x) // XY_MAX_POINTS)
+        style = 'o' if self.points else '-'
+        artists = self.axes.plot(x[::step], y[::step], style, markersize=2)
+        if y.ndim == 1:
+            artists[0].set_label(label)
+        else:
+            for i, artist in enumerate(artists):
+                artist.set_label('%s[%d]' % (label, i))
+
+        self.lines[key] = artists if y.ndim > 1 else artists[0]
+        self.xy_rows[key] = len(x)
+        self.pin_var(key)
+
+    # Remove a single variable from the plot
+    def remove_var(self, id, message, var, session=None):
+        key = (session, id, message, var)
+        artist = self.lines.pop(key)
+        for a in (artist if isinstance(artist, list) else [artist]):
+            a.remove()
+
+        self.unpin_var(key)
+        if memory.BUDGET_BYTES is not None:
+            self.lod.pop(key, None) # Its data would stay in memory
 
-    # Plot every variable that is checked
+    '''
+        Keep the columns of a plotted variable in memory, the plot holds their data anyway
+        so spilling them (see memory) would not free anything
+    '''
+    def pin_var(self, key):
+        session, id, message, var = key
+        try:
+            message_columns = lp.message_columns(id, message, var, self.get_columns(session), self.get_vars_cache(session))
+        except (KeyError, derived.DerivedError):
+            return
+
+        for v in (cols.TIMESTAMP, var):
+            memory.pin(message_columns, v)
+        self.pinned[key] = message_columns
+
+    def unpin_var(self, key):
+        message_columns = self.pinned.pop(key, None)
+        if message_columns is not None:
+            for v in (cols.TIMESTAMP, key[3]):
+                memory.pin(message_columns, v, False)
+
+    '''
+        Plot every variable that is checked and not plotted yet, for every flight which has it
+        Derived variables are skipped for the flights where they can not be evaluated
+    '''
     def plot_checked(self, id, checkboxes):
-        for message in checkboxes.keys():
-            for var in checkboxes[message]:
-                if checkboxes[message][var]:
-                    self.plot_var(id, message, var)
+        for session in self.sessions():
+            available = self.get_columns(session).get(id, {})
+            for message in checkboxes.keys():
+                if message not in available and message != derived.DERIVED:
+                    continue
+                for var in checkboxes[message]:
+                    if checkboxes[message][var] and (session, id, message, var) not in self.lines:
+                        try:
+                            self.plot_var(id, message, var, session)
+                        except derived.DerivedError as e:
+                            print("Skipping %s: %s" % (var, e))
 
-    # Draw plot with new checked variables
-    def refresh_plot(self, id, checkboxes):
+    # Remove every plotted derived variable, and forget their data, so they are evaluated and plotted again
+    def remove_derived(self):
+        for key in list(self.lines.keys()):
+            if key[2] == derived.DERIVED:
+                self.remove_var(*key[1:], key[0])
+        for key in list(self.lod.keys()):
+            if key[2] == derived.DERIVED:
+                del self.lod[key]
+
+    # Remove every plotted variable that is not checked anymore, or whose flight is not plotted
+    def remove_unchecked(self, id, checkboxes):
+        sessions = self.sessions()
+        for key in list(self.lines.keys()):
+            session, _, message, var = key
+            if session not in sessions or not checkboxes.get(message, {}).get(var, False):
+                self.remove_var(*key[1:], session)
+
+    # Label the y axis with the unit of the plotted variables, if all of them have the same one
+    def set_ylabel(self):
+        units = {self.get_unit(session, message, var) for session, _, message, var in self.lines}
+        self.axes.set_ylabel(units.pop() if len(units) == 1 and None not in units else '')
+
+    # Clear the axes and set up the grid
+    def clear_plot(self):
         self.axes.clear()
+        for key in list(self.pinned.keys()):
+            self.unpin_var(key)
+        self.lines = {}
+        self.xy_rows = {}
+        self.scatter_rows = {}
 
-        self.axes.grid(True)
-        self.axes.minorticks_on()
-        self.axes.tick_params(which='both', direction='in', top=True, right=True)
-        self.axes.grid(True, which='both', linewidth=0.4)
-        self.axes.grid(True, which='major', linewidth=1.2)
+        # Clearing the axes removes its callbacks, connect again
+        self.axes.callbacks.connect('xlim_changed', lambda axes: self.decimate_lines())
+
+        render.style_axes(self.axes)
+
+    # Forget the plotted lines and their data, the next refresh plots everything again (follow mode, the file was read again)
+    def reset_plot(self):
+        self.lod = {}
+        self.plotted = None
+
+    '''
+        Draw plot with new checked variables
+        Only the variables checked or unchecked since the last refresh are added or removed,
+        unless the ID, the points/lines mode, the overlays or the time range changed
+    '''
+    @prof.timed('refresh_plot')
+    def refresh_plot(self, id, checkboxes):
+        plotted = (id, self.points, bool(self.overlays), self.time_range, self.x_var, self.align_method)
+        if self.plotted != plotted:
+            if self.plotted is not None and self.plotted[3] != self.time_range:
+                self.lod = {} # Built for another window
+            self.clear_plot()
+            self.plotted = plotted
+            if self.x_var is not None:
+                x_unit = self.get_unit(self.session, *self.x_var[1:])
+                self.axes.set_xlabel('%s - %s (ID %s)%s' % (self.x_var[1], self.x_var[2], self.x_var[0], ' [%s]' % x_unit if x_unit else ''))
+            elif self.time_range is not None:
+                self.axes.set_xlabel('Time (s)')
+        else:
+            self.remove_unchecked(id, checkboxes)
 
         self.plot_checked(id, checkboxes)
-        self.axes.legend(loc='center left', bbox_to_anchor=(1, 0.5))
-        self.draw()
+        self.set_ylabel()
+
+        self.axes.relim()
+        self.axes.autoscale_view()
+        if self.lines:
+            self.axes.legend(loc='center left', bbox_to_anchor=(1, 0.5))
+        elif self.axes.get_legend():
+            self.axes.get_legend().remove()
+        self.draw_idle()
+
+    '''
+        Update the plotted artists with the new data of their variables (follow mode)
+        Axes are not cleared, only the artists whose variable got new samples are changed.
+        Their level of detail is extended with the new samples, and only the current x limits are decimated
+    '''
+    def update_plot(self):
+        if self.x_var is not None:
+            self.update_xy()
+            return
+
+        updated = False
+        for key, artist in self.lines.items():
+            x, v = self.get_data(*key)
+
+            if isinstance(artist, Line2D):
+                if len(v) != len(self.lod[key]):
+                    lod = self.get_lod(key, x, render.line_values(v))
+                    artist.set_data(*lod.points(*self.view_xlim(), self.max_points()))
+                    updated = True
+            elif len(v) != self.scatter_rows.get(key):
+                artist.set_offsets(numpy.column_stack(render.array_points(v)))
+                self.scatter_rows[key] = len(v)
+                updated = True
+
+        if updated:
+            self.axes.relim()
+            self.axes.autoscale_view()
+            self.draw_idle()
+
+    # Update the lines plotted against x_var, when x_var got new samples (follow mode)
+    def update_xy(self):
+        updated = False
+        for key, artist in self.lines.items():
+            data = self.get_xy(*key)
+            if data is None or len(data[0]) == self.xy_rows.get(key):
+                continue
+
+            x, y = data
+            step = max(1, len(x) // XY_MAX_POINTS)
+            y = y[::step].reshape(len(x[::step]), -1)
+            for i, line in enumerate(artist if isinstance(artist, list) else [artist]):
+                line.set_data(x[::step], y[:, i])
+            self.xy_rows[key] = len(x)
+            updated = True
+
+        if updated:
+            self.axes.relim()
+            self.axes.autoscale_view()
+            self.draw_idle()
+
+    '''
+        Level of detail of a variable, extended with the new samples when it grows (follow mode)
+        Built again only if the variable has fewer samples than before
+    '''
+    def get_lod(self, key, x, v):
+        lod = self.lod.get(key)
+        if lod is None or len(v) < len(lod):
+            lod = self.lod[key] = dec.LevelOfDetail(x, v)
+        elif len(v) > len(lod):
+            lod.extend(x, v)
+        return lod
+
+    # Current x limits, or None if nothing is plotted yet (autoscale)
+    def view_xlim(self):
+        if not self.lines or self.axes.get_autoscalex_on():
+            return None, None
+        return self.axes.get_xlim()
+
+    # Maximum number of points drawn per line, depends on the axes width in pixels
+    def max_points(self):
+        return dec.POINTS_PER_PIXEL * self.axes.bbox.width
+
+    '''
+        Decimate every line again for the current x limits and axes width
+        Zooming in takes points from the full resolution data, so every sample is shown eventually
+    '''
+    @prof.timed('decimate')
+    def decimate_lines(self):
+        if self.x_var is not None:
+            return # Lines against a variable are not sorted by x, they are not decimated
+
+        xmin, xmax = self.axes.get_xlim()
+        for key, artist in self.lines.items():
+            if key in self.lod and isinstance(artist, Line2D):
+                artist.set_data(*self.lod[key].points(xmin, xmax, self.max_points()))
+
+        self.draw_idle()
 
     # Searchbox for messages in dimensional_plot function
     def search_messages(self, text, ordered_keys):
@@ -8,23 +8,47 @@ Date: July 2024
 """
 
 import webbrowser
+import pprzlogutils.alignment as alignment
+import pprzlogutils.derived as derived
 import pprzlogutils.logparser as lp
+import pprzlogutils.memory as memory
+import pprzlogutils.profiling as prof
+import pprzlogutils.session as sess
+import pprzlogutils.statistics as stats
+import pprzlogutils.gui.loader as loader
 import pprzlogutils.gui.matplotlib as mpl
+import pprzlogutils.gui.variables as variables
 
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QIcon, QKeySequence
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtGui import QFontDatabase, QIcon, QKeySequence
 from PyQt5.QtWidgets import (
     QAction,
     QActionGroup,
     QCheckBox,
+    QDockWidget,
+    QDoubleSpinBox,
     QHBoxLayout,
+    QInputDialog,
+    QLabel,
+    QLineEdit,
     QMainWindow,
+    QMessageBox,
+    QPlainTextEdit,
+    QProgressBar,
     QPushButton,
+    QTableWidget,
+    QTableWidgetItem,
+    QTreeView,
     QVBoxLayout,
     QWidget,
-    QWidgetAction,
 )
 
+# Constants
+PERFORMANCE_INTERVAL_MS = 500 # Time between updates of the performance panel and status bar
+SUMMARY_COLUMNS = ('Message', 'Variable', 'Rows', 'Rate (Hz)', 'First (s)', 'Last (s)', 'Gaps', 'Max gap (s)', 'Dropped', 'Min', 'Max', 'Mean', 'Std')
+
+FOLLOW_POLLERS = {} # follow.DataFollower -> loader.FollowPoller, shared by the windows of a followed flight
+
 #####################################################################
 #####################################################################
 # Main GUI class, using PyQt5
@@ -32,19 +56,35 @@ from PyQt5.QtWidgets import (
 #####################################################################
 
 class pyplottergui(QMainWindow):
-    def __init__(self, log, data):
-        super().__init__()
-
-        self.log_path = log
-        self.data_path = data
+    '''
+        Open one flight (log and data paths), several flights (list of (log path, data path))
+        or several flights already loaded (sessions, see session.LogSession)
+        The first flight is plotted, the others can be selected or overlaid from the Flights menu
 
-        # Parse log file and create structure
-        lp.make_messages_xml(self.log_path.read())
-        lp.create_structs(lp.TELEMETRY_OUTPUT_FILENAME)
-        lp.create_structs(lp.DATALINK_OUTPUT_FILENAME)
+        A flight which is not in the cache is loaded in the background (see loader.SessionLoader),
+        the window is shown at once and the menus are filled as the files are read
+    '''
+    def __init__(self, log=None, data=None, use_cache=True, rebuild_cache=False, lazy=True, follow=False, sessions=None, flights=None):
+        super().__init__()
 
-        # Parse data file and fill structure
-        lp.parse_datafile(self.data_path)
+        self.loader = None
+        loading = [] # Sessions loaded in the background, one after the other
+        if sessions is None:
+            sessions = [sess.LogSession(log_path, data_path) for log_path, data_path in flights or [(log, data)]]
+            for session in sessions:
+                if follow:
+                    # Data file is still being written, the loader parses what is there, then it is polled for new lines
+                    loading.append(session)
+                elif not (use_cache and not rebuild_cache and session.load_cached()):
+                    # If this flight was opened before, it is loaded from the cache, otherwise see start_loading
+                    loading.append(session)
+
+        self.sessions = sessions
+        self.session = sessions[0]
+        self.session.activate()
+        self.log_path = self.session.log_path
+        self.data_path = self.session.data_path
+        self.windows = [] # New windows opened from this one, kept so they are not garbage collected
 
         # Main window config
         self.setWindowTitle('pprz-py-plotter')
@@ -61,13 +101,17 @@ class pyplottergui(QMainWindow):
         # File menu
         fileMenu = self.menubar.addMenu('File')
         
-        # TODO: Fix open_new_window, then uncomment this
-        '''
         newWindowAction = QAction('New Window', self)
-        newWindowAction.setStatusTip('Open a new window')
+        newWindowAction.setShortcut('Ctrl+N')
+        newWindowAction.setStatusTip('Open a new window with the same flights')
         newWindowAction.triggered.connect(self.open_new_window)
         fileMenu.addAction(newWindowAction)
-        '''
+
+        exportAction = QAction('Export checked variables', self)
+        exportAction.setShortcut('Ctrl+E')
+        exportAction.setStatusTip('Save the checked variables of the current ID in the output folder')
+        exportAction.triggered.connect(self.export_checked)
+        fileMenu.addAction(exportAction)
 
         exitAction = QAction('Exit', self)
         exitAction.setShortcut('Ctrl+Q')
@@ -75,12 +119,19 @@ class pyplottergui(QMainWindow):
         exitAction.triggered.connect(self.close)
         fileMenu.addAction(exitAction)
 
+        # Flight selection menu, only with more than one flight
+        if len(self.sessions) > 1:
+            self.flights_menu()
+
         # ID selection menu
         self.id_menu()
 
-        # Messages menu, see function below
+        # Messages menu and variable browser, see function below
         self.messages_menu()
 
+        # X axis menu, plot against a variable instead of the sample index or time
+        self.x_axis_menu()
+
         # Help menu
         helpMenu = self.menubar.addMenu('Help')
 
@@ -89,11 +140,17 @@ class pyplottergui(QMainWindow):
         aboutAction.triggered.connect(self.open_about_url)
         helpMenu.addAction(aboutAction)
 
+        performanceAction = QAction('Performance', self)
+        performanceAction.setShortcut('F8')
+        performanceAction.setStatusTip('Show the time and memory used by each stage of parsing and plotting')
+        performanceAction.triggered.connect(self.show_performance)
+        helpMenu.addAction(performanceAction)
+
         # Show matplotlib canvas in the center of the window
         centralWidget = QWidget()
         self.setCentralWidget(centralWidget)
         layout = QVBoxLayout(centralWidget)
-        self.canvas = mpl.MplCanvas(self, width=16, height=10, dpi=100)
+        self.canvas = mpl.MplCanvas(self, width=16, height=10, dpi=100, session=self.session)
         layout.addWidget(self.canvas)
 
         # Add clear all checks button
@@ -114,142 +171,289 @@ class pyplottergui(QMainWindow):
         pointsButton.setToolTip('Select between points or lines plots (F6)')
         pointsButton.clicked.connect(lambda: self.points_lines())
 
+        # Time range selector, only the window between both times is read and plotted
+        self.fromSpin = QDoubleSpinBox(self)
+        self.toSpin = QDoubleSpinBox(self)
+        for spin in (self.fromSpin, self.toSpin):
+            spin.setDecimals(3)
+            spin.setSuffix(' s')
+            spin.setRange(0, 0)
+
+        rangeButton = QPushButton('Set Range', self)
+        rangeButton.setShortcut(QKeySequence(Qt.Key_F7))
+        rangeButton.setToolTip('Plot only the selected time range, against time (F7)')
+        rangeButton.clicked.connect(lambda: self.set_time_range(self.fromSpin.value(), self.toSpin.value()))
+
+        fullButton = QPushButton('Full Range', self)
+        fullButton.setToolTip('Plot every sample again')
+        fullButton.clicked.connect(lambda: self.set_time_range(None, None))
+
         # Add to layout
         buttonLayout = QHBoxLayout()
+        buttonLayout.addWidget(QLabel('Time range:', self))
+        buttonLayout.addWidget(self.fromSpin)
+        buttonLayout.addWidget(self.toSpin)
+        buttonLayout.addWidget(rangeButton)
+        buttonLayout.addWidget(fullButton)
         buttonLayout.addStretch(1)
         buttonLayout.addWidget(clearButton)
         buttonLayout.addWidget(refreshButton)
         buttonLayout.addWidget(pointsButton)
         layout.addLayout(buttonLayout)
 
+        # Follow mode, poll the data file and update the plot at a bounded rate
+        if self.session.follower:
+            self.start_following()
+
+        # Performance panel and status bar, updated only while profiling is enabled
+        self.performance_panel()
+
+        # Summary of the messages, hidden until Messages > Summary
+        self.summary_panel()
+
+        # Parse log file and create structure, then index data file (lazy) or parse it, in the background
+        if loading:
+            self.start_loading(loading, use_cache, lazy, follow)
+
         self.show()
 
-    # TODO: Broken, for now launch one new window manually
-    '''
+    # Open a new window with the same flights, they are shared and not parsed again
     def open_new_window(self):
-        new_window = pyplottergui(self.log_path, self.data_path)
-        new_window.show()
-    '''
+        new_window = pyplottergui(sessions=self.sessions)
+        new_window.switch_flight(self.session)
+        self.windows.append(new_window)
 
     def open_about_url(self):
         webbrowser.open('https://github.com/Swarm-Systems-Lab/pprz-py-plotter')
 
+    '''
+        Flights select menu
+        Choose the flight to plot, and the flights to overlay on top of it (same ID and variables)
+    '''
+    def flights_menu(self):
+        flightsMenu = self.menubar.addMenu('Flights')
+        flightsGroup = QActionGroup(self)
+        self.flight_actions = {}
+
+        for session in self.sessions:
+            action = QAction(session.name, self)
+            action.setCheckable(True)
+            action.setChecked(session is self.session)
+            action.triggered.connect(lambda checked, s=session: self.switch_flight(s))
+            flightsGroup.addAction(action)
+            flightsMenu.addAction(action)
+            self.flight_actions[session] = action
+
+        overlayMenu = flightsMenu.addMenu('Overlay')
+        overlayMenu.setStatusTip('Plot the checked variables of other flights too')
+        for session in self.sessions:
+            action = QAction(session.name, self)
+            action.setCheckable(True)
+            action.triggered.connect(lambda checked, s=session: self.toggle_overlay(checked, s))
+            overlayMenu.addAction(action)
+
     '''
         ID select menu
         Choose an UAV ID to plot
         If you want to plot more than one ID, open a new window
     '''
     def id_menu(self):
-        idMenu = self.menubar.addMenu('IDs')
-        idGroup = QActionGroup(self)
-
-        ids = []
-        num_id = []
-        found_ids = sorted(lp.DATA_DICT.keys())
-
-        for id in found_ids: 
-            num_id.append(id) # Save number for later
-            ids.append(QAction('ID ' + str(id), self))
-            
-        for i in range(0, len(ids)):
-            ids[i].setCheckable(True)
-            ids[i].setChecked(False)
-            ids[i].triggered.connect(lambda checked, ni=num_id[i]: self.handle_id_checkbox(checked, ni))
-                                     
-            idGroup.addAction(ids[i])
-            idMenu.addAction(ids[i])
+        self.idMenu = self.menubar.addMenu('IDs')
+        self.idGroup = QActionGroup(self)
+        self.id_actions = {}
+
+        self.update_id_menu()
+
+    '''
+        Add the IDs found since the menu was created (follow mode, background loading)
+        IDs found by the loader before their data is indexed are shown disabled
+    '''
+    def update_id_menu(self, found_ids=None):
+        if found_ids is None:
+            found_ids = self.session.ids()
+
+        for id in found_ids:
+            if id in self.id_actions:
+                continue
+
+            action = QAction('ID ' + str(id), self)
+            action.setCheckable(True)
+            action.setChecked(False)
+            action.triggered.connect(lambda checked, ni=id: self.handle_id_checkbox(checked, ni))
+
+            self.idGroup.addAction(action)
+            self.idMenu.addAction(action)
+            self.id_actions[id] = action
+
+        for id, action in self.id_actions.items():
+            action.setEnabled(id in self.session.columns)
     
     '''
-        Messages select menu. 
-        Select a message and its variables to plot
+        Messages menu and variable browser, docked at the left
+        Select the variables to plot in a tree of messages, filtered by the text typed above it (Ctrl+F)
     '''
     def messages_menu(self):
+        self.variables = variables.VariableModel(self)
+
+        self.variablesFilter = QLineEdit(self)
+        self.variablesFilter.setPlaceholderText('Filter messages and variables')
+        self.variablesFilter.setClearButtonEnabled(True)
+        self.variablesFilter.textChanged.connect(self.variables.set_filter)
+
+        availableCheck = QCheckBox('Only messages of the selected ID', self)
+        availableCheck.toggled.connect(lambda checked: self.variables.set_available(self.available_messages(), checked))
+
+        self.variablesView = QTreeView(self)
+        self.variablesView.setModel(self.variables)
+        self.variablesView.setHeaderHidden(True)
+        self.variablesView.setUniformRowHeights(True)
+
+        browser = QWidget(self)
+        browserLayout = QVBoxLayout(browser)
+        browserLayout.setContentsMargins(0, 0, 0, 0)
+        browserLayout.addWidget(self.variablesFilter)
+        browserLayout.addWidget(availableCheck)
+        browserLayout.addWidget(self.variablesView)
+
+        self.variablesDock = QDockWidget('Variables', self)
+        self.variablesDock.setWidget(browser)
+        self.addDockWidget(Qt.LeftDockWidgetArea, self.variablesDock)
+
         msgMenu = self.menubar.addMenu('Messages')
+        browserAction = self.variablesDock.toggleViewAction()
+        browserAction.setStatusTip('Show or hide the variable browser')
+        msgMenu.addAction(browserAction)
+
+        findAction = QAction('Find variable', self)
+        findAction.setShortcut('Ctrl+F')
+        findAction.setStatusTip('Filter the messages and variables by name')
+        findAction.triggered.connect(self.find_variable)
+        msgMenu.addAction(findAction)
+
+        derivedAction = QAction('New derived variable...', self)
+        derivedAction.setShortcut('Ctrl+D')
+        derivedAction.setStatusTip('Define a variable computed from others, for example speed = sqrt(INS.ins_xd**2 + INS.ins_yd**2)')
+        derivedAction.triggered.connect(self.new_derived)
+        msgMenu.addAction(derivedAction)
+
+        summaryAction = QAction('Summary', self)
+        summaryAction.setShortcut('Ctrl+I')
+        summaryAction.setStatusTip('Show the rows, rate, gaps and statistics of every message of the selected ID')
+        summaryAction.triggered.connect(self.show_summary)
+        msgMenu.addAction(summaryAction)
+
+        self.fill_variables()
+
+    # Show the messages of the current flight in the variable browser, every variable unchecked
+    def fill_variables(self):
+        self.messages_types = self.session.types
+        self.checkboxes = self.variables.set_schema(self.session.types, self.session.fields)
+        self.fill_derived()
+
+    # Show the derived variables as the variables of the DERIVED message, their expressions as tooltips
+    def fill_derived(self):
+        tooltips = {name: derived.DEFINITIONS[name].expression for name in derived.names()}
+        self.variables.set_message(derived.DERIVED, derived.names(), tooltips)
+
+    # Messages of the current ID, plus the derived variables, which every ID can have
+    def available_messages(self):
+        messages = self.session.messages(self.current_id)
+        if derived.DEFINITIONS:
+            messages.append(derived.DERIVED)
+        return messages
 
-        # Better added in groups, so the menu is not too long
-        # Recommended to be edited with Copilot!
-        msg_a_b = msgMenu.addMenu('A-B')
-        msg_a_b.setStatusTip('Messages A to B included')
-
-        msg_c_d = msgMenu.addMenu('C-D')
-        msg_c_d.setStatusTip('Messages C to D included')
-
-        msg_e_f = msgMenu.addMenu('E-F')
-        msg_e_f.setStatusTip('Messages E to F included')
-
-        msg_g_h = msgMenu.addMenu('G-H')
-        msg_g_h.setStatusTip('Messages G to H included')
-
-        msg_i_j = msgMenu.addMenu('I-J')
-        msg_i_j.setStatusTip('Messages I to J included')
-
-        msg_k_l = msgMenu.addMenu('K-L')
-        msg_k_l.setStatusTip('Messages K to L included')
-
-        msg_m_n = msgMenu.addMenu('M-N')
-        msg_m_n.setStatusTip('Messages M to N included')
-
-        msg_o_p = msgMenu.addMenu('O-P')
-        msg_o_p.setStatusTip('Messages O to P included')
-
-        msg_q_r = msgMenu.addMenu('Q-R')
-        msg_q_r.setStatusTip('Messages Q to R included')
-
-        msg_s_t = msgMenu.addMenu('S-T')
-        msg_s_t.setStatusTip('Messages S to T included')
-
-        msg_u_v = msgMenu.addMenu('U-V')
-        msg_u_v.setStatusTip('Messages U to V included')
-
-        msg_w_x = msgMenu.addMenu('W-X')
-        msg_w_x.setStatusTip('Messages W to X included')
-
-        msg_y_z = msgMenu.addMenu('Y-Z')
-        msg_y_z.setStatusTip('Messages Y to Z included')
-
-        msg_submenus = []
-        ordered_keys = sorted(lp.MESSAGES_TYPES.keys(), key=str.lower) # Alphabetical order
-        for message in ordered_keys:
-            # Create inner dict
-            self.checkboxes[message] = {}
-
-            if message[0] in 'AB':
-                msg_submenus.append(msg_a_b.addMenu(message))
-            elif message[0] in 'CD':
-                msg_submenus.append(msg_c_d.addMenu(message))
-            elif message[0] in 'EF':
-                msg_submenus.append(msg_e_f.addMenu(message))
-            elif message[0] in 'GH':
-                msg_submenus.append(msg_g_h.addMenu(message))
-            elif message[0] in 'IJ':
-                msg_submenus.append(msg_i_j.addMenu(message))
-            elif message[0] in 'KL':
-                msg_submenus.append(msg_k_l.addMenu(message))
-            elif message[0] in 'MN':
-                msg_submenus.append(msg_m_n.addMenu(message))
-            elif message[0] in 'OP':
-                msg_submenus.append(msg_o_p.addMenu(message))
-            elif message[0] in 'QR':
-                msg_submenus.append(msg_q_r.addMenu(message))
-            elif message[0] in 'ST':
-                msg_submenus.append(msg_s_t.addMenu(message))
-            elif message[0] in 'UV':
-                msg_submenus.append(msg_u_v.addMenu(message))
-            elif message[0] in 'WX':
-                msg_submenus.append(msg_w_x.addMenu(message))
-            else:
-                msg_submenus.append(msg_y_z.addMenu(message))
- 
-            # Add the variables to the submenu as checkboxes
-            for var in lp.MESSAGES_TYPES[message]._fields:
-                checkBox = QCheckBox(var, msg_submenus[-1])
-                checkableAction = QWidgetAction(msg_submenus[-1])
-                checkableAction.setDefaultWidget(checkBox)
-                checkBox.stateChanged.connect(lambda state, m=message, v=var: self.handle_checkbox(state, m, v))
-                
-                msg_submenus[-1].addAction(checkableAction)
-                self.checkboxes[message][var] = False # Initialize all to false
+    '''
+        Ask for a derived variable, as name = expression (see derived)
+        Defining a name again replaces it, and every plotted derived variable is evaluated again
+    '''
+    def new_derived(self):
+        text, ok = QInputDialog.getText(self, 'New derived variable', 'name = expression, for example speed = sqrt(INS.ins_xd**2 + INS.ins_yd**2)')
+        if not ok or not text.strip():
+            return
+
+        try:
+            derived.define(*derived.parse_definition(text))
+        except derived.DerivedError as e:
+            QMessageBox.warning(self, 'Warning!', str(e))
+            return
+
+        self.canvas.remove_derived()
+        self.fill_derived()
+        if self.current_id is not None:
+            self.variables.set_available(self.available_messages())
+            self.canvas.refresh_plot(self.current_id, self.checkboxes)
+
+    def find_variable(self):
+        self.variablesDock.show()
+        self.variablesFilter.setFocus()
+        self.variablesFilter.selectAll()
 
+    '''
+        X axis select menu
+        Plot the checked variables against another variable (for example a trajectory, ins_x against ins_y)
+        Variables are resampled at the timestamps of the x axis variable, with the chosen interpolation
+    '''
+    def x_axis_menu(self):
+        xMenu = self.menubar.addMenu('X-axis')
+        self.xGroup = QActionGroup(self)
+
+        self.xIndexAction = QAction('Sample index / time', self)
+        self.xIndexAction.setCheckable(True)
+        self.xIndexAction.setChecked(True)
+        self.xIndexAction.triggered.connect(lambda: self.set_x_var(None))
+        self.xGroup.addAction(self.xIndexAction)
+        xMenu.addAction(self.xIndexAction)
+
+        # Filled with the checked variables every time it is opened
+        self.xVarMenu = xMenu.addMenu('Variable')
+        self.xVarMenu.setStatusTip('Plot against one of the checked variables')
+        self.xVarMenu.aboutToShow.connect(self.update_x_var_menu)
+
+        xMenu.addSeparator()
+        methodMenu = xMenu.addMenu('Interpolation')
+        methodGroup = QActionGroup(self)
+        for method in alignment.ALIGN_METHODS:
+            action = QAction(method.capitalize(), self)
+            action.setCheckable(True)
+            action.setChecked(method == alignment.DEFAULT_METHOD)
+            action.triggered.connect(lambda checked, m=method: self.set_align_method(m))
+            methodGroup.addAction(action)
+            methodMenu.addAction(action)
+
+    def update_x_var_menu(self):
+        self.xVarMenu.clear()
+        if self.current_id is None:
+            self.xVarMenu.addAction('Select an ID first').setEnabled(False)
+            return
+
+        for message in sorted(self.checkboxes.keys(), key=str.lower):
+            fields = {f.name: f for f in self.session.fields.get(message, [])}
+            for var, checked in self.checkboxes[message].items():
+                field = fields.get(var)
+                if not checked or field is None or field.array or field.string:
+                    continue # Only scalar numbers, TIMESTAMP is the default axis already
+
+                action = QAction(message + ' - ' + var, self)
+                action.setCheckable(True)
+                action.setChecked(self.canvas.x_var == (self.current_id, message, var))
+                action.triggered.connect(lambda checked, m=message, v=var: self.set_x_var((self.current_id, m, v)))
+                self.xGroup.addAction(action)
+                self.xVarMenu.addAction(action)
+
+        if not self.xVarMenu.actions():
+            self.xVarMenu.addAction('Check a number variable first').setEnabled(False)
+
+    # Plot against a variable (id, message, var), None plots against the sample index or time
+    def set_x_var(self, x_var):
+        self.canvas.x_var = x_var
+        self.xIndexAction.setChecked(x_var is None)
+        if self.current_id is not None:
+            self.canvas.refresh_plot(self.current_id, self.checkboxes)
+
+    def set_align_method(self, method):
+        self.canvas.align_method = method
+        if self.current_id is not None:
+            self.canvas.refresh_plot(self.current_id, self.checkboxes)
 
     #####################################################################
     #####################################################################
@@ -262,46 +466,333 @@ class pyplottergui(QMainWindow):
     def handle_id_checkbox(self, idchecked, id):
         if idchecked:
             self.current_id = id            
-            for msg_name in lp.DATA_DICT[self.current_id].keys():
-                for submenu in self.menubar.actions():
-                    if submenu.text() == 'Messages':
-                        for action in submenu.menu().actions(): # A-B, C-D... submenus
-                            for subaction in action.menu().actions(): # Messages names submenu
-                                if isinstance(subaction, QAction):
-                                    if subaction.text() == msg_name:
-                                        font = subaction.font()
-                                        font.setUnderline(True) # Underline messages available for that ID
-                                        subaction.setFont(font)
+            self.update_time_range()
+            self.variables.set_available(self.available_messages()) # Underline messages available for that ID
+            self.update_summary()
             self.update()
         else:
             pass
 
-    # Handle checkboxes (message/variable menu)
-    def handle_checkbox(self, checked, message, var):
-        if checked:
-            self.checkboxes[message][var] = True
+    # Limit the time range selector to the timestamps of the current ID
+    def update_time_range(self):
+        span = self.session.time_span(self.current_id) if self.current_id is not None else None
+        if span is None:
+            span = (0, 0)
+
+        for spin in (self.fromSpin, self.toSpin):
+            spin.setRange(float(span[0]), float(span[1]))
+        if self.canvas.time_range is None:
+            self.fromSpin.setValue(float(span[0]))
+            self.toSpin.setValue(float(span[1]))
+
+    # Plot only the rows between t0 and t1 (seconds), None plots every sample
+    def set_time_range(self, t0, t1):
+        if t0 is None or t1 is None:
+            self.canvas.time_range = None
         else:
-            self.checkboxes[message][var] = False
-    
+            self.canvas.time_range = (min(t0, t1), max(t0, t1))
+
+        if self.current_id is not None:
+            self.canvas.refresh_plot(self.current_id, self.checkboxes)
+
     # Clear all checkboxes, interface and data
     def clear_checkboxes(self):
-        # Clear boolean array
-        for message in self.checkboxes.keys():
-            for var in self.checkboxes[message]:
-                self.checkboxes[message][var] = False
-
-        # Clear checkboxes in the Messages menu
-        for action in self.menubar.actions():
-            if action.text() == 'Messages':
-                for submenu in action.menu().actions(): # A-B, C-D... submenus
-                    for subaction in submenu.menu().actions(): # Messages names submenu
-                        for checkbox in subaction.menu().actions(): # Actual checkbox
-                            if isinstance(checkbox, QWidgetAction):
-                                checkbox.defaultWidget().setChecked(False)
-                                
+        self.variables.clear_checks()
         self.update()
         self.canvas.refresh_plot(self.current_id, self.checkboxes)
 
+    '''
+        Plot another flight. The ID menu is rebuilt, and the messages menu too
+        if the flight has different message definitions (another Paparazzi version)
+    '''
+    def switch_flight(self, session):
+        self.session = session
+        self.session.activate()
+        self.log_path = session.log_path
+        self.data_path = session.data_path
+        if session in getattr(self, 'flight_actions', {}):
+            self.flight_actions[session].setChecked(True)
+
+        for action in self.id_actions.values():
+            self.idGroup.removeAction(action)
+            self.idMenu.removeAction(action)
+        self.id_actions = {}
+        self.update_id_menu()
+
+        if self.current_id not in session.columns:
+            self.current_id = None
+        elif self.current_id in self.id_actions:
+            self.id_actions[self.current_id].setChecked(True)
+        self.update_time_range()
+
+        if session.types is not self.messages_types:
+            self.fill_variables()
+
+        self.canvas.session = session
+        if self.current_id is not None:
+            self.canvas.refresh_plot(self.current_id, self.checkboxes)
+
+    # Add or remove a flight from the plot overlays
+    def toggle_overlay(self, checked, session):
+        if checked and session not in self.canvas.overlays:
+            self.canvas.overlays.append(session)
+        elif not checked and session in self.canvas.overlays:
+            self.canvas.overlays.remove(session)
+
+        if self.current_id is not None:
+            self.canvas.refresh_plot(self.current_id, self.checkboxes)
+
+    '''
+        Poll the data file of the session in the background (see loader.FollowPoller)
+        Windows sharing the flight share its poller, the first one starts it and stops it when closed
+    '''
+    def start_following(self):
+        follower = self.session.follower
+        self.follow_poller = FOLLOW_POLLERS.get(follower)
+        if self.follow_poller is None:
+            self.follow_poller = FOLLOW_POLLERS[follower] = loader.FollowPoller(self.session, self)
+            self.follow_poller.failed.connect(lambda error: QMessageBox.warning(self, 'Warning!', 'Error following the flight:\n' + error))
+            self.follow_poller.start()
+        self.follow_poller.updated.connect(self.follow_update)
+
+    # Update the plotted lines with the rows of the last poll, only called when there are new rows
+    # If the data file was truncated or replaced, its rows were dropped and read again, so everything is plotted again
+    def follow_update(self, restarted):
+        if len(self.session.columns) != len(self.id_actions):
+            self.update_id_menu()
+        if self.current_id is not None:
+            self.update_time_range()
+
+        if restarted:
+            self.canvas.reset_plot()
+            if self.current_id is not None:
+                self.canvas.refresh_plot(self.current_id, self.checkboxes)
+        else:
+            self.canvas.update_plot()
+
+        if self.summaryDock.isVisible():
+            self.update_summary()
+
+    #####################################################################
+    #####################################################################
+    # Background loading, see loader.SessionLoader
+    #####################################################################
+    #####################################################################
+
+    '''
+        Load the flights (sessions) in a background thread, with a progress bar and a cancel button in the status bar
+        Flights are loaded one after the other, the plotted one first
+        The loader only reads the files, everything it sends is added to its session here, in the GUI thread
+    '''
+    def start_loading(self, sessions, use_cache, lazy, follow=False):
+        self.progressBar = QProgressBar(self)
+        self.progressBar.setMaximumWidth(200)
+        self.cancelButton = QPushButton('Cancel', self)
+        self.cancelButton.setToolTip('Stop loading, keeping what was read until now')
+        self.cancelButton.clicked.connect(self.cancel_loading)
+        self.statusBar().addPermanentWidget(self.progressBar)
+        self.statusBar().addPermanentWidget(self.cancelButton)
+
+        self.pending_loads = list(sessions)
+        self.load_options = (use_cache, lazy, follow)
+        self.load_next()
+
+    # Start the loader of the next flight
+    def load_next(self):
+        use_cache, lazy, follow = self.load_options
+        self.loader = loader.SessionLoader(self.pending_loads.pop(0), use_cache, lazy, self, follow)
+        self.loader.schemaLoaded.connect(self.schema_loaded)
+        self.loader.progress.connect(self.loading_progress)
+        self.loader.idsFound.connect(self.ids_found)
+        self.loader.indexed.connect(self.data_indexed)
+        self.loader.messageLoaded.connect(self.message_loaded)
+        self.loader.followed.connect(self.file_followed)
+        self.loader.failed.connect(lambda error, name=self.loader.session.name: QMessageBox.warning(self, 'Warning!', 'Error loading %s:\n%s' % (name, error)))
+        self.loader.finished.connect(self.loading_finished)
+        self.loader.start()
+
+    # Create the structs and fill the variable browser, then let the loader parse the data
+    def schema_loaded(self, registry):
+        session = self.loader.session
+        session.load_schema(registry)
+        self.session.activate() # Loading the schema activated the loaded flight, which may not be the plotted one
+        self.loader.schema_ready.set()
+
+        if session is self.session:
+            self.fill_variables()
+
+    # IDs found by the loader are added to the menu if they belong to the plotted flight
+    def ids_found(self, ids):
+        if self.loader.session is self.session:
+            self.update_id_menu(ids)
+
+    # Every message can be plotted from now on, lazy messages are parsed on their first use
+    def data_indexed(self, index):
+        session = self.loader.session
+        lp.index_datafile(session.data_path, session.columns, index, session.fields)
+        self.session_changed(session)
+
+    # Use a message parsed by the loader, unless it was parsed here already (plotted before the loader got to it)
+    def message_loaded(self, id, name, message):
+        session = self.loader.session
+        inner_dict = session.columns.setdefault(id, {})
+        current = inner_dict.get(name)
+        if current is None or not getattr(current, 'loaded', True):
+            inner_dict[name] = message
+            self.session_changed(session)
+
+    # Follow mode, the messages read by the loader were already sent, keep polling the file from where it stopped
+    def file_followed(self, follower):
+        self.loader.session.follower = follower
+        self.start_following()
+
+    # Update the menus and the plot if the flight is plotted or overlaid
+    def session_changed(self, session):
+        if session is self.session:
+            self.data_changed()
+        elif session in self.canvas.overlays and self.current_id is not None:
+            self.canvas.refresh_plot(self.current_id, self.checkboxes)
+
+    # Enable the new IDs, and plot the checked variables which were not available yet
+    def data_changed(self):
+        self.update_id_menu()
+        if self.current_id is not None:
+            self.handle_id_checkbox(True, self.current_id)
+            self.canvas.refresh_plot(self.current_id, self.checkboxes)
+
+    def loading_progress(self, percent, text):
+        if percent < 0:
+            self.progressBar.setRange(0, 0) # Busy indicator, the total is unknown
+        else:
+            self.progressBar.setRange(0, 100)
+            self.progressBar.setValue(percent)
+        self.statusBar().showMessage(text)
+
+    # Cancel the current load and the flights not loaded yet
+    def cancel_loading(self):
+        self.pending_loads = []
+        self.loader.requestInterruption()
+        self.cancelButton.setEnabled(False)
+        self.statusBar().showMessage('Cancelling...')
+
+    def loading_finished(self):
+        if self.pending_loads and not self.loader.cancelled:
+            self.load_next()
+            return
+
+        self.progressBar.hide()
+        self.cancelButton.hide()
+        self.statusBar().showMessage('Loading cancelled' if self.loader.cancelled else 'Loaded %s' % ', '.join(s.name for s in self.sessions), 5000)
+
+    # Stop the loader and the follow poller started by this window before closing, they would keep the application running
+    def closeEvent(self, event):
+        if self.loader is not None and self.loader.isRunning():
+            self.loader.requestInterruption()
+            self.loader.wait()
+
+        poller = getattr(self, 'follow_poller', None)
+        if poller is not None and poller.parent() is self:
+            poller.requestInterruption()
+            poller.wait()
+            FOLLOW_POLLERS.pop(self.session.follower, None)
+        super().closeEvent(event)
+
+    '''
+        Performance panel, docked at the right and hidden until Help > Performance
+        Shows every profiling stage and counter, the status bar shows the last plot timings
+    '''
+    def performance_panel(self):
+        self.performanceDock = QDockWidget('Performance', self)
+        self.performanceText = QPlainTextEdit(self.performanceDock)
+        self.performanceText.setReadOnly(True)
+        self.performanceText.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        self.performanceDock.setWidget(self.performanceText)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.performanceDock)
+        self.performanceDock.hide()
+
+        self.performanceTimer = QTimer(self)
+        self.performanceTimer.timeout.connect(self.update_performance)
+        if prof.ENABLED:
+            self.performanceTimer.start(PERFORMANCE_INTERVAL_MS)
+
+    # Show the performance panel, profiling is enabled from now on if it was not
+    def show_performance(self):
+        prof.enable()
+        self.performanceDock.show()
+        self.performanceTimer.start(PERFORMANCE_INTERVAL_MS)
+        self.update_performance()
+
+    def update_performance(self):
+        timings = []
+        for name in ('refresh_plot', 'decimate', 'draw'):
+            timer = prof.STAGES.get(name)
+            if timer is not None:
+                timings.append('%s %.0f ms' % (name, timer.last * 1000))
+        columns_mb = memory.stats()['resident_bytes'] / 1024 ** 2
+        self.statusBar().showMessage(' | '.join(timings + ['%.0f MB (columns %.0f MB)' % (prof.rss_mb(), columns_mb)]))
+
+        if self.performanceDock.isVisible():
+            self.performanceText.setPlainText('\n'.join(prof.summary() + memory.summary()))
+
+    '''
+        Summary panel, docked at the bottom and hidden until Messages > Summary
+        One row per message of the current ID with its rows, rate, span and gaps, followed by the statistics of its fields
+        Lazy messages not parsed yet only have the statistics of their timestamps
+    '''
+    def summary_panel(self):
+        self.summaryDock = QDockWidget('Summary', self)
+        self.summaryTable = QTableWidget(0, len(SUMMARY_COLUMNS), self.summaryDock)
+        self.summaryTable.setHorizontalHeaderLabels(SUMMARY_COLUMNS)
+        self.summaryTable.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.summaryTable.verticalHeader().hide()
+        self.summaryDock.setWidget(self.summaryTable)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.summaryDock)
+        self.summaryDock.hide()
+
+    def show_summary(self):
+        self.summaryDock.show()
+        self.update_summary()
+
+    # Fill the summary table with the messages of the current ID, only while it is shown
+    def update_summary(self):
+        if not self.summaryDock.isVisible():
+            return
+
+        rows = []
+        if self.current_id is not None:
+            for _, message, s in self.session.summary([self.current_id]):
+                rows.append((message, '', str(s.count), stats.format_number(s.rate, '%.2f'), stats.format_number(s.first, '%.3f'),
+                             stats.format_number(s.last, '%.3f'), str(s.gaps), stats.format_number(s.max_gap if s.gaps else None, '%.3f'),
+                             str(s.dropped), '', '', '', ''))
+                for var, f in s.fields.items():
+                    if f.count:
+                        rows.append(('', var, str(f.count), '', '', '', '', '', '', stats.format_number(f.min), stats.format_number(f.max),
+                                     stats.format_number(f.mean), stats.format_number(f.std)))
+
+        self.summaryTable.setRowCount(len(rows))
+        for i, row in enumerate(rows):
+            for j, text in enumerate(row):
+                self.summaryTable.setItem(i, j, QTableWidgetItem(text))
+        self.summaryTable.resizeColumnsToContents()
+
+    # Save every checked variable of the current ID to the output folder
+    def export_checked(self):
+        if self.current_id is None:
+            return
+
+        self.session.activate()
+        for message in self.checkboxes.keys():
+            for var in self.checkboxes[message]:
+                if not self.checkboxes[message][var]:
+                    continue
+                if message in self.session.columns[self.current_id]:
+                    lp.export_var(self.current_id, message, var)
+                elif message == derived.DERIVED:
+                    try:
+                        lp.export_var(self.current_id, message, var)
+                    except derived.DerivedError as e:
+                        print("Skipping %s: %s" % (var, e))
+
     # Handle showing plot or line based plots
     def points_lines(self):
         if self.canvas.points:
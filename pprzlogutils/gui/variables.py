@@ -0,0 +1,242 @@
+"""
+pprzlogutils - A Python library for parsing and processing Paparazzi UAV log files.
+
+variables provides the variable browser of the GUI: a tree of messages and their variables with checkboxes,
+shown with a QTreeView. It is a model over the schema, so no widget is created per message or variable,
+and rows are only created when the view shows them (messages are fetched in batches, variables
+when a message is expanded).
+
+The checked state is kept in a dictionary, checkboxes[message][var] -> bool, which is what the canvas plots.
+Messages available for the current ID are underlined. The text filter keeps the messages whose name or any
+of their variables contain the text, narrowing the previous result while the text grows.
+Messages which are not in the schema (the derived variables, see derived) are added with set_message.
+"""
+
+import pprzlogutils.columns as cols
+
+from PyQt5.QtCore import QAbstractItemModel, QModelIndex, Qt
+from PyQt5.QtGui import QFont
+
+# Constants
+FETCH_ROWS = 200 # Messages added to the view at once, see fetchMore
+MESSAGE_ID = 0 # Internal id of message rows, variables use the row of their message + 1
+
+'''
+    Tree model: messages (top level rows) and their variables (checkable children)
+    Call set_schema with the message structs of a flight (session.types) before using it
+'''
+class VariableModel(QAbstractItemModel):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.checkboxes = {}
+        self.fields = {} # message -> {var: columns.Field}, for the tooltips
+        self.tooltips = {} # message -> {var: text}, tooltips of the messages added with set_message
+        self.messages = [] # Every message, alphabetical order
+        self.vars = {} # message -> variable names
+        self.lower = {} # message -> (lowercase name, lowercase variable names), for the filter
+        self.available = set() # Messages of the current ID
+        self.only_available = False
+        self.text = ''
+        self.visible = [] # Messages which pass the filter
+        self.fetched = 0 # Visible messages already added to the view
+        self.children = {} # message -> variables which pass the filter, computed when first shown
+        self.underline = QFont()
+        self.underline.setUnderline(True) # Messages available for the current ID
+
+    '''
+        Use the message definitions of a flight, types: message -> named tuple (see logparser.MESSAGES_TYPES)
+        Every variable starts unchecked. Returns the new checkboxes dictionary
+    '''
+    def set_schema(self, types, fields=None):
+        self.beginResetModel()
+        self.messages = sorted(types.keys(), key=str.lower) # Alphabetical order
+        self.vars = {message: list(types[message]._fields) for message in self.messages}
+        self.lower = {message: (message.lower(), [v.lower() for v in self.vars[message]]) for message in self.messages}
+        self.fields = {message: {f.name: f for f in fields.get(message, [])} for message in self.messages} if fields else {}
+        self.checkboxes = {message: dict.fromkeys(self.vars[message], False) for message in self.messages}
+        self.tooltips = {}
+        self.filter_messages(self.messages)
+        self.endResetModel()
+
+        return self.checkboxes
+
+    '''
+        Add a message which is not in the schema, or change its variables (an empty list removes it)
+        Variables which were already there keep their checked state
+    '''
+    def set_message(self, message, vars, tooltips=None):
+        self.beginResetModel()
+        old = self.checkboxes.pop(message, {})
+        if message in self.vars:
+            self.messages.remove(message)
+            del self.vars[message], self.lower[message]
+
+        if vars:
+            self.messages.append(message)
+            self.messages.sort(key=str.lower)
+            self.vars[message] = list(vars)
+            self.lower[message] = (message.lower(), [v.lower() for v in vars])
+            self.checkboxes[message] = {v: old.get(v, False) for v in vars}
+            self.tooltips[message] = tooltips or {}
+
+        self.filter_messages(self.messages)
+        self.endResetModel()
+
+    #####################################################################
+    # Filter
+    #####################################################################
+
+    def matches(self, message):
+        if self.only_available and message not in self.available:
+            return False
+        name, names = self.lower[message]
+        return self.text in name or any(self.text in v for v in names)
+
+    # Keep the messages of candidates which pass the filter, the view is reset by the caller
+    def filter_messages(self, candidates):
+        self.visible = [m for m in candidates if self.matches(m)]
+        self.fetched = min(FETCH_ROWS, len(self.visible))
+        self.children = {}
+
+    '''
+        Show only the messages whose name or variables contain text (case insensitive)
+        If text extends the previous one, only the messages shown now are checked again
+    '''
+    def set_filter(self, text):
+        text = text.strip().lower()
+        if text == self.text:
+            return
+
+        narrowing = text.startswith(self.text)
+        self.beginResetModel()
+        self.text = text
+        self.filter_messages(self.visible if narrowing else self.messages)
+        self.endResetModel()
+
+    # Messages of the current ID (underlined), with only_available the others are hidden
+    def set_available(self, messages, only_available=None):
+        self.available = set(messages)
+        if only_available is not None:
+            self.only_available = only_available
+
+        if self.only_available or only_available is not None:
+            self.beginResetModel()
+            self.filter_messages(self.messages)
+            self.endResetModel()
+        elif self.fetched:
+            self.dataChanged.emit(self.index(0, 0), self.index(self.fetched - 1, 0), [Qt.FontRole])
+
+    # Variables of a visible message: all of them if its name matches the filter, otherwise only the matching ones
+    def message_vars(self, message):
+        children = self.children.get(message)
+        if children is None:
+            name, names = self.lower[message]
+            if self.text in name:
+                children = self.vars[message]
+            else:
+                children = [v for v, lower in zip(self.vars[message], names) if self.text in lower]
+            self.children[message] = children
+
+        return children
+
+    # Uncheck every variable
+    def clear_checks(self):
+        for message in self.checkboxes:
+            for var in self.checkboxes[message]:
+                self.checkboxes[message][var] = False
+
+        # Only the variables already shown need to be repainted
+        for row, message in enumerate(self.visible[:self.fetched]):
+            children = self.children.get(message)
+            if children:
+                parent = self.index(row, 0)
+                self.dataChanged.emit(self.index(0, 0, parent), self.index(len(children) - 1, 0, parent), [Qt.CheckStateRole])
+
+    #####################################################################
+    # QAbstractItemModel
+    #####################################################################
+
+    def index(self, row, column, parent=QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QModelIndex()
+        if not parent.isValid():
+            return self.createIndex(row, column, MESSAGE_ID)
+        return self.createIndex(row, column, parent.row() + 1)
+
+    def parent(self, index):
+        if not index.isValid() or index.internalId() == MESSAGE_ID:
+            return QModelIndex()
+        return self.createIndex(index.internalId() - 1, 0, MESSAGE_ID)
+
+    def rowCount(self, parent=QModelIndex()):
+        if not parent.isValid():
+            return self.fetched
+        if parent.internalId() == MESSAGE_ID and parent.column() == 0:
+            return len(self.message_vars(self.visible[parent.row()]))
+        return 0
+
+    def columnCount(self, parent=QModelIndex()):
+        return 1
+
+    def hasChildren(self, parent=QModelIndex()):
+        if not parent.isValid():
+            return bool(self.visible)
+        return parent.internalId() == MESSAGE_ID
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and self.fetched < len(self.visible)
+
+    def fetchMore(self, parent):
+        if parent.isValid():
+            return
+        count = min(FETCH_ROWS, len(self.visible) - self.fetched)
+        self.beginInsertRows(QModelIndex(), self.fetched, self.fetched + count - 1)
+        self.fetched += count
+        self.endInsertRows()
+
+    # (message, var) of an index, var is None for message rows
+    def item(self, index):
+        if index.internalId() == MESSAGE_ID:
+            return self.visible[index.row()], None
+        message = self.visible[index.internalId() - 1]
+        return message, self.message_vars(message)[index.row()]
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        message, var = self.item(index)
+        if role == Qt.DisplayRole:
+            return message if var is None else var
+        if role == Qt.CheckStateRole and var is not None:
+            return Qt.Checked if self.checkboxes[message][var] else Qt.Unchecked
+        if role == Qt.FontRole and var is None and message in self.available:
+            return self.underline
+        if role == Qt.ToolTipRole and var is not None:
+            if message in self.tooltips:
+                return self.tooltips[message].get(var)
+            field = self.fields.get(message, {}).get(var)
+            if field is None:
+                return None
+            unit = cols.field_unit(field)
+            return field.type if unit is None else '%s, %s' % (field.type, unit)
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if role != Qt.CheckStateRole or not index.isValid():
+            return False
+
+        message, var = self.item(index)
+        if var is None:
+            return False
+
+        self.checkboxes[message][var] = value == Qt.Checked
+        self.dataChanged.emit(index, index, [Qt.CheckStateRole])
+        return True
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        if index.internalId() == MESSAGE_ID:
+            return Qt.ItemIsEnabled
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsUserCheckable
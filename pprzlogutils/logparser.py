@@ -11,132 +11,262 @@ Date: July 2024
 import numpy
 import os
 
+import pprzlogutils.alignment as alignment
+import pprzlogutils.columns as cols
+import pprzlogutils.compression as compression
+import pprzlogutils.dataindex as dataindex
+import pprzlogutils.derived as derived
+import pprzlogutils.follow as follow
+import pprzlogutils.memory as memory
+import pprzlogutils.parallel as parallel
+import pprzlogutils.profiling as prof
+import pprzlogutils.schema as schema
+import pprzlogutils.statistics as stats
+
 from collections import namedtuple
-from lxml import etree
 
 # Constants
-MESSAGES_BLOCK = 'protocol/msg_class'
 TELEMETRY_OUTPUT_FILENAME = 'telemetry_messages.xml'
 DATALINK_OUTPUT_FILENAME = 'datalink_messages.xml'
+MESSAGES_CLASSES = { # Message classes used, with their NAME and ID
+    TELEMETRY_OUTPUT_FILENAME: ('telemetry', '1'),
+    DATALINK_OUTPUT_FILENAME: ('datalink', '2'),
+}
 DATA_OUTPUT_FILENAME = 'data_log.txt'
 OUTPUT_DIR = './output'
 TMP_DIR = './tmp'
+CONVERT_UNITS = False # Convert fields with an ALT_UNIT_COEF to their ALT_UNIT when parsed, see set_convert_units
 
+MESSAGES_REGISTRY = {} # Message definitions of the .log file, see schema
 MESSAGES_TYPES = {} # Data structures (named tuples) for each message
-DATA_DICT = {} # Data dictionary, with up to N (number of UAVs, IDs) MESSAGE_TYPES
+MESSAGES_FIELDS = {} # Typed field definitions (columns.Field) for each message
+DATA_COLUMNS = {} # Typed columns, DATA_COLUMNS[id][name] -> columns.MessageColumns
+DATA_DICT = cols.DataDictView(DATA_COLUMNS, MESSAGES_TYPES) # Compatibility view, with up to N (number of UAVs, IDs) MESSAGE_TYPES
+VARS_CACHE = {} # Memoized variables, (id, message, var) -> numpy array
 
 '''
-    Clean and format the XML, removing comments and recovering from errors
+    Make a session (see session.LogSession) the current one
+    The globals above are bound to the schema and data of the session,
+    so every function of this module reads and writes that session
 '''
-def clean_and_format_xml(xml):
-    parser = etree.XMLParser(remove_comments=True, recover=True, remove_blank_text=True)
-    root = etree.fromstring(xml, parser)
+def activate(session):
+    global MESSAGES_REGISTRY, MESSAGES_TYPES, MESSAGES_FIELDS, DATA_COLUMNS, DATA_DICT, VARS_CACHE
 
-    formatted_xml = etree.tostring(root, pretty_print=True, encoding='unicode')
-    
-    return formatted_xml
+    MESSAGES_REGISTRY = session.registry
+    MESSAGES_TYPES = session.types
+    MESSAGES_FIELDS = session.fields
+    DATA_COLUMNS = session.columns
+    DATA_DICT = session.data_dict
+    VARS_CACHE = session.vars_cache
 
 '''
-    Simplify the .log file to a file which only contains the telemetry block
-    This file will make easier to extract the vars for each message
+    Read the message definitions of the .log file (its contents, as a string) into MESSAGES_REGISTRY
+    Only the protocol block is parsed, and registries are cached by its hash (see schema)
 '''
 def make_messages_xml(logfile):
-    parser = etree.XMLParser(remove_comments=True, recover=True)
-    root = etree.fromstring(logfile, parser)
-
-    # Find msg_class NAME = telemetry and ID = 1
-    telemetry_xml = ''
-    for msg_class in root.findall(MESSAGES_BLOCK):
-        if msg_class.get('NAME') == 'telemetry' and msg_class.get('ID') == '1':
-            telemetry_xml = etree.tostring(msg_class, encoding='unicode')
-        elif msg_class.get('NAME') == 'datalink' and msg_class.get('ID') == '2':
-            datalink_xml = etree.tostring(msg_class, encoding='unicode')
-
-    telemetry_xml = clean_and_format_xml(telemetry_xml)
-    datalink_xml = clean_and_format_xml(datalink_xml)
-        
-    # Save the msg_class block in a file
-    output_file = os.path.join(TMP_DIR, TELEMETRY_OUTPUT_FILENAME)
-    if telemetry_xml:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(telemetry_xml)
-        
-    # Save the msg_class block in a file
-    output_file = os.path.join(TMP_DIR, DATALINK_OUTPUT_FILENAME)
-    if datalink_xml:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(datalink_xml)
-
-'''
-    Create data structures for each message
-    
+    if isinstance(logfile, str):
+        logfile = logfile.encode('utf-8')
+
+    MESSAGES_REGISTRY.clear()
+    MESSAGES_REGISTRY.update(schema.registry_from_bytes(logfile))
+
+'''
+    Create data structures for each message of a class (telemetry or datalink)
+    Fields keep their unit attributes, and are converted to their alt_unit if CONVERT_UNITS is set
+
     Examples:
     INS(timestamp, x, y, z, vx, vy, vz, ax, ay, az)
     GVF(timestamp, error, traj, s, ke, p)
 '''
 def create_structs(messages_type):
-    with open(os.path.join(TMP_DIR, messages_type), 'r', encoding='utf-8') as f:
-        parser = etree.XMLParser(remove_comments=True, recover=True)
-        root = etree.fromstring(f.read(), parser)
+    class_name, class_id = MESSAGES_CLASSES[messages_type]
+
+    msg_class = MESSAGES_REGISTRY.get(class_name)
+    if msg_class is None or msg_class['id'] != class_id:
+        return
 
-        for msg in root.findall('message'):
-            msg_name = msg.get('NAME')
-            # msg_id = msg.get('ID')
-            msg_vars = msg.findall('field')
+    for msg_name, msg in msg_class['messages'].items():
+        typed_fields = []
+        for var in msg['fields']:
+            typed_fields.append(cols.make_field(var['name'], var['type'], var.get('unit'), var.get('alt_unit'),
+                                                var.get('alt_unit_coef'), CONVERT_UNITS))
 
-            # Create a named tuple for each message
-            fields = ['TIMESTAMP'] # Caps to differentiate from a possible timestamp field inside the message
-            for var in msg_vars:
-                # Fix for some messages with a field named 'class'
-                if var.get('NAME') != 'class':
-                    fields.append(var.get('NAME'))
+        register_message(msg_name, typed_fields)
+
+'''
+    Convert fixed point fields to real units when parsing (ins_x in m instead of 1/2^8 m)
+    Only fields with an ALT_UNIT_COEF in the messages XML are converted, they are stored as float64
+    Applies to the flights parsed afterwards, cached flights are saved with and without conversion separately
+'''
+def set_convert_units(enabled=True):
+    global CONVERT_UNITS
+    CONVERT_UNITS = bool(enabled)
+
+'''
+    Create and save globally the named tuple and the typed fields of a message
+'''
+def register_message(msg_name, typed_fields):
+    # Create a named tuple for each message
+    fields = [cols.TIMESTAMP] # Caps to differentiate from a possible timestamp field inside the message
+    for var in typed_fields:
+        # Fix for some messages with a field named 'class'
+        if var.name != 'class':
+            fields.append(var.name)
 
-            # Create and save globally the named tuple
-            MESSAGES_TYPES[msg_name] = namedtuple(msg_name, fields)
+    # Typed fields keep every var, so the tokens of each line stay aligned
+    MESSAGES_TYPES[msg_name] = namedtuple(msg_name, fields)
+    MESSAGES_FIELDS[msg_name] = typed_fields
 
 '''
-    Parse the datafile, saving the data in the DATA_DICT dictionary
+    Parse the datafile, saving the data as typed NumPy columns in DATA_COLUMNS
     Proposed data structure:
 
-    DATA_DICT[id] = inner_dict[name][n].(timestamp, var1, var2...)
+    DATA_COLUMNS[id] = inner_dict[name] -> MessageColumns(TIMESTAMP, var1, var2...)
 
     (Suppose INS freq = 0.1 s, 10 Hz)
     Example for id = 2, field INS:
 
-    DATA_DICT[2] -> inner_dict[INS][0] -> (0.1, x, y, z, vx, vy, vz, ax, ay, az)
+    DATA_COLUMNS[2] -> inner_dict[INS].column('TIMESTAMP') -> [0.1, 0.2, ... 1.2]
+    DATA_COLUMNS[2] -> inner_dict[INS].column('ins_x') -> [x0, x1, ... x11]
+
+    The old layout is still available through DATA_DICT:
+
     DATA_DICT[2] -> inner_dict[INS][1] -> (0.2, x, y, z, vx, vy, vz, ax, ay, az)
-    ...
-    DATA_DICT[2] -> inner_dict[INS][11] -> (1.2, x, y, z, vx, vy, vz, ax, ay, az)
-'''
-def parse_datafile(datafile, verbose=False):
-    for line in datafile:
-        # Split by spaces
-        parts = line.split()
-        
-        # Extract data
-        timestamp = float(parts[0])
-        id = int(parts[1])
-        name = parts[2]
-        data = parts[3:]
-
-        # Create the inner data dictionary for the id
-        if id not in DATA_DICT:
-            DATA_DICT[id] = {}
-        
-        # Create the inner array for the inner dict
-        if name not in DATA_DICT[id]:
-            DATA_DICT[id][name] = []
-        
-        # Save using the id and name. Previously check if name is saved (if it's a telemetry message)
-        if name in MESSAGES_TYPES:
-            linedata = MESSAGES_TYPES[name](timestamp, *data)
-            DATA_DICT[id][name].append(linedata)
-
-            if verbose:
-                output_file = os.path.join(TMP_DIR, DATA_OUTPUT_FILENAME)
-                with open(output_file, 'a', encoding='utf-8') as f:
-                    f.write(str(linedata))
-                    f.write('\n')
+
+    With workers > 1 the file is parsed by that many processes (see parallel.parse_parallel)
+    This needs a datafile opened from a path, otherwise it is parsed in this process
+
+    With verbose = True the rows parsed by this call are appended to TMP_DIR/DATA_OUTPUT_FILENAME
+'''
+def parse_datafile(datafile, verbose=False, workers=1):
+    path = getattr(datafile, 'name', None)
+    if verbose:
+        parsed = {(id, name): len(message) for id, inner_dict in DATA_COLUMNS.items() for name, message in inner_dict.items()}
+
+    with prof.stage('parse_data'):
+        if workers > 1 and isinstance(path, str) and os.path.isfile(path):
+            parallel.parse_parallel(path, DATA_COLUMNS, MESSAGES_FIELDS, workers)
+        else:
+            ingest_lines(datafile, DATA_COLUMNS)
+
+    if isinstance(path, str) and os.path.isfile(path):
+        prof.count('bytes_read', os.path.getsize(path))
+
+    if verbose:
+        os.makedirs(TMP_DIR, exist_ok=True)
+        output_file = os.path.join(TMP_DIR, DATA_OUTPUT_FILENAME)
+        with open(output_file, 'a', encoding='utf-8') as f:
+            for id in DATA_DICT:
+                for name in DATA_DICT[id]:
+                    rows = DATA_DICT[id][name]
+                    for linedata in rows[parsed.get((id, name), 0):]: # Only the rows of this call
+                        f.write(str(linedata))
+                        f.write('\n')
+
+'''
+    Ingest the lines of a datafile into a columns dictionary (see parse_datafile)
+    Only lines of known messages with the expected number of fields are saved
+
+    Returns the number of ingested lines
+'''
+def ingest_lines(lines, columns):
+    return cols.ingest_lines(lines, columns, MESSAGES_FIELDS)
+
+'''
+    Index the datafile instead of parsing it (lazy loading)
+    Only the byte offsets and timestamps of the lines are saved for each id and message in DATA_COLUMNS,
+    the payload of a message is parsed the first time one of its columns is used
+
+    An index already scanned (see dataindex.scan_offsets) can be given, to skip the scan
+
+    Returns the memory mapped dataindex.DataFile, which must stay open while the columns are used
+'''
+def index_datafile(data_path, columns=None, index=None, messages_fields=None):
+    if columns is None:
+        columns = DATA_COLUMNS
+    if messages_fields is None:
+        messages_fields = MESSAGES_FIELDS
+    if index is None:
+        with prof.stage('index_data'):
+            index = dataindex.scan_offsets(data_path)
+        prof.count('bytes_read', os.path.getsize(data_path))
+
+    source = dataindex.DataFile(data_path)
+    for (id, name), stream_index in index.items():
+        name = name.decode('utf-8', 'replace')
+
+        # Save only telemetry messages, and lines with a valid id
+        if name not in messages_fields:
+            continue
+        try:
+            id = int(id)
+        except ValueError:
+            continue
+
+        if id not in columns:
+            columns[id] = {}
+        columns[id][name] = dataindex.LazyMessageColumns(name, messages_fields[name], source, stream_index)
+
+    return source
+
+'''
+    Follow a datafile which is still being written (live tail)
+    Call poll() on the returned follow.DataFollower to parse the new lines into DATA_COLUMNS,
+    the first call parses everything written until then
+'''
+def follow_datafile(data_path, columns=None, vars_cache=None):
+    if compression.is_compressed(data_path):
+        raise ValueError('%s is compressed, only plain .data files can be followed' % data_path)
+    if columns is None:
+        columns = DATA_COLUMNS
+    if vars_cache is None:
+        vars_cache = VARS_CACHE
+
+    return follow.DataFollower(data_path, columns, MESSAGES_FIELDS, vars_cache)
+
+'''
+    Parse a .log file given its path, creating the structs for telemetry and datalink messages
+    With use_cache = True the registry is read from (or saved in) the schema cache, see schema
+'''
+def parse_structs(log_path, use_cache=False):
+    with prof.stage('schema'):
+        load_schema(schema.load_registry(log_path, schema.SCHEMA_CACHE_DIR if use_cache else None))
+
+'''
+    Use a registry already read (see schema.load_registry), creating the structs for telemetry and datalink messages
+'''
+def load_schema(registry):
+    MESSAGES_REGISTRY.clear()
+    MESSAGES_REGISTRY.update(registry)
+
+    create_structs(TELEMETRY_OUTPUT_FILENAME)
+    create_structs(DATALINK_OUTPUT_FILENAME)
+
+'''
+    Parse a .log and a .data file, given their paths
+    Creates the structs for telemetry and datalink messages and fills DATA_COLUMNS
+    With lazy = True the datafile is only indexed, see index_datafile
+    With workers > 1 the datafile is parsed in parallel, see parse_datafile
+
+    Compressed files (see compression) are decompressed by a background thread while they are parsed,
+    they are always parsed whole and in this process (lazy and workers are ignored)
+    With use_cache = True the message definitions are cached, see parse_structs
+'''
+def parse_files(log_path, data_path, verbose=False, lazy=False, workers=1, use_cache=False):
+    parse_structs(log_path, use_cache)
+
+    if compression.is_compressed(data_path):
+        with compression.LineReader(data_path) as datafile:
+            parse_datafile(datafile, verbose)
+        prof.count('bytes_read', os.path.getsize(data_path))
+        return
+
+    if lazy:
+        index_datafile(data_path)
+        return
+
+    with open(data_path, 'r', encoding='utf-8') as datafile:
+        parse_datafile(datafile, verbose, workers)
 
 #####################################################################
 #####################################################################
@@ -150,7 +280,6 @@ def parse_datafile(datafile, verbose=False):
 '''
     Convert a certain message (for example, position messages) to a numpy array
     Only for a certain ID. Convert the array of messages
-    This will assume float values only
 
     Returns the numpy arrays returned by var_to_numpy in a single numpy array
 '''
@@ -160,28 +289,144 @@ def convert_message_to_numpy(id, message):
 
 '''
     Convert a certain variable (say, x position from position messages) to a numpy array
-    This will assume float values only
+    Values are already typed columns, scalar vars return a 1D array and array vars a matrix
+    (or an object array of rows if their length changes)
+    The array is also saved as text in OUTPUT_DIR, see export_var
 
     Returns the numpy array too
 '''
 def convert_var_to_numpy(id, message, var):
-    array = []
-    for i in range(len(DATA_DICT[id][message])):
-        attr = getattr(DATA_DICT[id][message][i], var) # Get the var
-        
-        v = None 
-        if isinstance(attr, float):
-            v = float(attr)
-        else:
-            v = [float(x) for x in attr.split(',')] # If string, split attr by commas        
-        
-        array.append(v) # Append to the array
+    nparray = get_var(id, message, var)
+    export_var(id, message, var, nparray)
+
+    return nparray
+
+'''
+    Get the numpy array of a certain variable, without saving anything to disk
+    Arrays are memoized in VARS_CACHE, until new rows of the message are parsed (follow mode)
+    With a memory budget (see memory) they are not, so the columns not used anymore can be spilled
+    Other columns and cache dictionaries (of a session) can be given
+    Derived variables are read as (id, derived.DERIVED, name), see derived
+'''
+def get_var(id, message, var, columns=None, vars_cache=None):
+    if columns is None:
+        columns = DATA_COLUMNS
+    if vars_cache is None:
+        vars_cache = VARS_CACHE
+
+    if message == derived.DERIVED:
+        return derived.evaluate(id, var, columns, vars_cache).column(var)
+
+    message_columns = columns[id][message]
+    if memory.BUDGET_BYTES is not None:
+        return message_columns.column(var)
+    key = (id, message, var)
+
+    nparray = vars_cache.get(key)
+    if nparray is None or len(nparray) != len(message_columns):
+        with prof.stage('get_var'):
+            nparray = vars_cache[key] = message_columns.column(var)
+
+    return nparray
+
+'''
+    Get the rows of a message with timestamps between t0 and t1 (seconds, both included)
+    fields is a list of variable names (None for all of them), t0 or t1 None is no limit at that side
+
+    The window is found with a binary search on the timestamps, and nothing else is read:
+    a lazy message that was not used yet only parses the lines of the window (see dataindex)
+
+    Returns a dictionary, {TIMESTAMP: timestamps, var: values...}
+    Derived variables have their own timestamps, so only one can be read at a time: get(id, derived.DERIVED, [name])
+
+    Example:
+    get(204, 'INS', ['ins_x', 'ins_y'], 100.0, 130.0)['ins_x'] -> ins_x between 100 and 130 s
+'''
+def get(id, message, fields=None, t0=None, t1=None, columns=None, vars_cache=None):
+    if columns is None:
+        columns = DATA_COLUMNS
+
+    if message == derived.DERIVED:
+        if fields is None or len(fields) != 1:
+            raise ValueError('Derived variables are read one at a time, got %s' % fields)
+        return message_columns(id, message, fields[0], columns, vars_cache).window(t0, t1, fields)
+
+    return columns[id][message].window(t0, t1, fields)
 
-    nparray = numpy.array(array)
+'''
+    Columns of a message, or the evaluated columns of a derived variable (message is derived.DERIVED)
+'''
+def message_columns(id, message, var=None, columns=None, vars_cache=None):
+    if columns is None:
+        columns = DATA_COLUMNS
+    if vars_cache is None:
+        vars_cache = VARS_CACHE
+
+    if message == derived.DERIVED:
+        return derived.evaluate(id, var, columns, vars_cache)
+    return columns[id][message]
+
+'''
+    Resample variables of any messages and IDs onto a common timebase, see alignment
+    streams: list of (id, message, var)
+    timebase: array of timestamps, or (id, message) to use the timestamps of that message
+              None resamples at a fixed rate (Hz) over the time every stream has samples
+    method: nearest, previous (zero-order hold) or linear
+
+    Returns a dictionary, {TIMESTAMP: timebase, (id, message, var): values...}
+
+    Example:
+    align([(204, 'GPS_INT', 'ecef_x'), (204, 'INS', 'ins_vx')], timebase=(204, 'INS'), method='previous')
+'''
+def align(streams, timebase=None, rate=None, method=alignment.DEFAULT_METHOD, columns=None, vars_cache=None):
+    if isinstance(timebase, tuple):
+        timebase = get_var(timebase[0], timebase[1], cols.TIMESTAMP, columns, vars_cache)
+
+    data = [(message_columns(id, message, var, columns, vars_cache).column(cols.TIMESTAMP), get_var(id, message, var, columns, vars_cache))
+            for id, message, var in streams]
+    timebase, values = alignment.align_streams(data, timebase, rate, method)
+
+    aligned = {cols.TIMESTAMP: timebase}
+    for stream, v in zip(streams, values):
+        aligned[tuple(stream)] = v
+    return aligned
+
+'''
+    First and last timestamps of an ID, over all its messages
+
+    Returns (first, last), or None if the ID has no rows
+'''
+def time_span(id, columns=None):
+    if columns is None:
+        columns = DATA_COLUMNS
+
+    spans = [s for s in (m.span() for m in columns.get(id, {}).values()) if s is not None]
+    if not spans:
+        return None
+    return min(s[0] for s in spans), max(s[1] for s in spans)
+
+'''
+    Rows, rate, time span, gaps and field statistics of every message (or of the given IDs and messages)
+    They are computed while parsing, lazy messages not parsed yet only have the statistics of their timestamps
+
+    Returns a list of (id, message, statistics.MessageStats), see statistics.summarize
+'''
+def summary(ids=None, messages=None, columns=None):
+    if columns is None:
+        columns = DATA_COLUMNS
+    return stats.summarize(columns, ids, messages)
+
+'''
+    Save a variable to OUTPUT_DIR/message/var.npy, as text for later processing
+    Only numeric variables are saved
+'''
+def export_var(id, message, var, nparray=None):
+    if nparray is None:
+        nparray = get_var(id, message, var)
 
     message_dir = OUTPUT_DIR + '/' + message
     os.makedirs(message_dir, exist_ok=True)
     filename = os.path.join(message_dir, var + '.npy')
-    numpy.savetxt(filename, nparray) # Save to txt for later processing
-
-    return nparray
\ No newline at end of file
+    if nparray.dtype.kind in 'biuf':
+        with prof.stage('savetxt'):
+            numpy.savetxt(filename, nparray) # Save to txt for later processing
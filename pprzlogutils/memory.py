@@ -0,0 +1,260 @@
+"""
+pprzlogutils - A Python library for parsing and processing Paparazzi UAV log files.
+
+memory provides a memory budget for the parsed columns, so flights larger than the RAM can be browsed.
+Every column in memory (see columns.MessageColumns) is tracked in least recently used order.
+When they take more than the budget, the least recently used ones are spilled: written to a .npy file
+and memory mapped, so their memory is freed and they are still readable. Using a spilled column
+(column, window, row...) copies it back to memory, spilling others if needed.
+
+Plotted columns are pinned (see pin) and never spilled, as the plot keeps their data anyway.
+Memory mapped columns of cached flights are not counted, the OS already frees them when needed.
+Columns of strings can not be memory mapped and are not counted either.
+
+Without a budget (the default) nothing is spilled, but the resident size is still tracked.
+Stats: resident and spilled bytes, hits (column in memory when used), misses (spilled when used) and spills.
+
+Example:
+memory.set_budget(2 * 1024 ** 3) -> keep at most 2 GB of columns in memory
+"""
+
+import atexit
+import numpy
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+
+from collections import OrderedDict
+
+# Constants
+TIMESTAMP = 'TIMESTAMP' # Same as columns.TIMESTAMP
+SPILL_PREFIX = 'pprz-spill-'
+
+BUDGET_BYTES = None # Maximum bytes of columns in memory, None for no limit, see set_budget
+SPILL_DIR = None # Folder of the spill files, created on the first spill (a temporary folder by default)
+
+ENTRIES = OrderedDict() # (id(message), var) -> Entry, least recently used first
+STATS = {'resident_bytes': 0, 'spilled_bytes': 0, 'hits': 0, 'misses': 0, 'spills': 0}
+LOCK = threading.RLock() # The GUI loader parses in another thread
+FILES = iter(range(1, 2 ** 63)) # Numbers of the spill files
+
+'''
+    One tracked column of a message (var, or TIMESTAMP)
+    The message is referenced weakly, its columns are forgotten when it is freed
+'''
+class Entry:
+    def __init__(self, message, var, key):
+        self.message = weakref.ref(message, lambda ref: forget(key))
+        self.var = var
+        self.nbytes = 0 # Bytes in memory
+        self.spilled = 0 # Bytes in spill files
+        self.paths = []
+        self.pins = 0
+
+'''
+    Set the memory budget in bytes (None removes it), spilling columns at once if they take more
+    spill_dir is the folder of the spill files, by default a temporary folder removed at exit
+    Worker processes forked afterwards (see parallel) have the same budget and folder
+'''
+def set_budget(max_bytes, spill_dir=None):
+    global BUDGET_BYTES, SPILL_DIR
+    with LOCK:
+        BUDGET_BYTES = max_bytes
+        if spill_dir is not None:
+            SPILL_DIR = spill_dir
+            os.makedirs(spill_dir, exist_ok=True)
+        elif SPILL_DIR is None and max_bytes is not None:
+            SPILL_DIR = tempfile.mkdtemp(prefix=SPILL_PREFIX)
+            atexit.register(shutil.rmtree, SPILL_DIR, True)
+        enforce()
+
+# New spill file, named after the process as forked workers share the folder
+def spill_path():
+    return os.path.join(SPILL_DIR, '%d-%d.npy' % (os.getpid(), next(FILES)))
+
+# Buffers (columns.ColumnBuffer) of a column, or None if it can not be tracked (strings, unknown vars)
+def column_buffers(message, var):
+    if var == TIMESTAMP:
+        return [message.timestamps]
+
+    buffer = message.columns.get(var)
+    if buffer is None or buffer.dtype == object:
+        return None
+    if hasattr(buffer, 'offsets'): # Array field, see columns.RaggedBuffer
+        return [buffer.offsets, buffer.values]
+    return [buffer]
+
+# Bytes in memory of a buffer, memory mapped ones (spilled or cached) take none
+def buffer_bytes(buffer):
+    data = buffer._data
+    return 0 if isinstance(data, numpy.memmap) else data.nbytes
+
+def message_vars(message):
+    return [TIMESTAMP] + list(message.columns.keys())
+
+'''
+    Track the columns of a message, after they changed (new rows, sorted)
+    They become the most recently used, and other columns are spilled if the budget is exceeded
+'''
+def track(message, vars=None):
+    with LOCK:
+        keys = []
+        for var in message_vars(message) if vars is None else vars:
+            buffers = column_buffers(message, var)
+            if buffers is None:
+                continue
+
+            key = (id(message), var)
+            entry = ENTRIES.get(key)
+            if entry is None:
+                entry = ENTRIES[key] = Entry(message, var, key)
+            else:
+                ENTRIES.move_to_end(key)
+
+            nbytes = sum(buffer_bytes(b) for b in buffers)
+            STATS['resident_bytes'] += nbytes - entry.nbytes
+            entry.nbytes = nbytes
+            if entry.spilled and nbytes:
+                remove_spill(entry) # Grown back into memory by an append
+            keys.append(key)
+
+        enforce(keys)
+
+'''
+    Mark columns of a message as used (vars None for all of them)
+    Spilled columns are copied back to memory first
+'''
+def touch(message, vars=None):
+    with LOCK:
+        keys = []
+        for var in message_vars(message) if vars is None else vars:
+            key = (id(message), var)
+            entry = ENTRIES.get(key)
+            if entry is None:
+                continue # Not tracked: memory mapped from the cache, or strings
+
+            ENTRIES.move_to_end(key)
+            if entry.spilled:
+                STATS['misses'] += 1
+                fault_in(entry, message)
+            else:
+                STATS['hits'] += 1
+            keys.append(key)
+
+        if keys and BUDGET_BYTES is not None and STATS['resident_bytes'] > BUDGET_BYTES:
+            enforce(keys)
+
+'''
+    Pin (or unpin) a column, pinned columns are never spilled
+    Pins are counted, every pin needs an unpin
+'''
+def pin(message, var, pinned=True):
+    with LOCK:
+        entry = ENTRIES.get((id(message), var))
+        if entry is None:
+            return
+
+        entry.pins = max(0, entry.pins + (1 if pinned else -1))
+        if pinned and entry.spilled:
+            fault_in(entry, message)
+        elif not pinned:
+            enforce()
+
+'''
+    Spill the least recently used columns until the resident bytes are within the budget
+    Pinned columns and the ones in keep (being used right now) are not spilled
+'''
+def enforce(keep=()):
+    if BUDGET_BYTES is None:
+        return
+
+    with LOCK:
+        for key, entry in list(ENTRIES.items()):
+            if STATS['resident_bytes'] <= BUDGET_BYTES:
+                break
+            if entry.pins or not entry.nbytes or key in keep:
+                continue
+
+            message = entry.message()
+            if message is not None:
+                spill(entry, message)
+
+# Write the buffers of a column to spill files and memory map them
+def spill(entry, message):
+    buffers = column_buffers(message, entry.var)
+    if buffers is None or any(len(b) == 0 for b in buffers):
+        return # Empty arrays can not be memory mapped
+
+    for buffer in buffers:
+        if isinstance(buffer._data, numpy.memmap):
+            continue
+        path = spill_path()
+        numpy.save(path, buffer.view())
+        buffer._data = numpy.load(path, mmap_mode='r')
+        entry.paths.append(path)
+        entry.spilled += buffer.nbytes
+
+    STATS['resident_bytes'] -= entry.nbytes
+    STATS['spilled_bytes'] += entry.spilled
+    STATS['spills'] += 1
+    entry.nbytes = 0
+
+# Copy a spilled column back to memory
+def fault_in(entry, message):
+    buffers = column_buffers(message, entry.var)
+    if buffers is None:
+        return
+
+    for buffer in buffers:
+        if isinstance(buffer._data, numpy.memmap):
+            buffer._data = numpy.array(buffer._data)
+
+    entry.nbytes = sum(buffer_bytes(b) for b in buffers)
+    STATS['resident_bytes'] += entry.nbytes
+    remove_spill(entry)
+
+def remove_spill(entry):
+    STATS['spilled_bytes'] -= entry.spilled
+    entry.spilled = 0
+    for path in entry.paths:
+        try:
+            os.remove(path) # Views of the old memory map keep working, the data stays until they are freed
+        except OSError:
+            pass # Still mapped (Windows), removed with the folder at exit
+    entry.paths = []
+
+# Forget the columns of a freed message
+def forget(key):
+    with LOCK:
+        entry = ENTRIES.pop(key, None)
+        if entry is not None:
+            STATS['resident_bytes'] -= entry.nbytes
+            remove_spill(entry)
+
+'''
+    Current state of the columns
+
+    Returns a dictionary, {'budget_bytes', 'resident_bytes', 'spilled_bytes', 'columns', 'spilled_columns', 'hits', 'misses', 'spills'}
+'''
+def stats():
+    with LOCK:
+        result = dict(STATS)
+        result['budget_bytes'] = BUDGET_BYTES
+        result['columns'] = len(ENTRIES)
+        result['spilled_columns'] = sum(1 for entry in ENTRIES.values() if entry.spilled)
+    return result
+
+# One line per stat, as profiling.summary
+def summary():
+    s = stats()
+    mb = 1024 ** 2
+    budget = 'none' if s['budget_bytes'] is None else '%.1f MB' % (s['budget_bytes'] / mb)
+    used = s['hits'] + s['misses']
+    return [
+        '%-16s %.1f MB (budget %s)' % ('columns_resident', s['resident_bytes'] / mb, budget),
+        '%-16s %.1f MB in %d of %d columns' % ('columns_spilled', s['spilled_bytes'] / mb, s['spilled_columns'], s['columns']),
+        '%-16s %d hits, %d misses (%.1f %% hits), %d spills' % ('column_uses', s['hits'], s['misses'],
+                                                              100.0 * s['hits'] / used if used else 100.0, s['spills']),
+    ]
@@ -0,0 +1,104 @@
+"""
+pprzlogutils - A Python library for parsing and processing Paparazzi UAV log files.
+
+parallel provides multi-process parsing of large .data files.
+The file is split in newline-aligned byte ranges, each range is parsed in a worker process
+and the columns returned by the workers are merged in file order, so the rows are the same as parsing it
+in one process. Files smaller than PARALLEL_MIN_BYTES are parsed in this process, starting the workers
+would take longer than parsing them.
+"""
+
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+
+import pprzlogutils.columns as cols
+import pprzlogutils.profiling as prof
+
+# Constants
+RANGES_PER_WORKER = 4 # More ranges than workers, so a slow range does not leave the others idle
+MAX_RANGE_BYTES = 64 * 1024 ** 2 # Bytes read at once by a worker
+PARALLEL_MIN_BYTES = 16 * 1024 ** 2 # Smaller files are parsed without workers
+
+'''
+    Split a file in byte ranges of similar size, every range starting at the beginning of a line
+
+    Returns a list of (start, end) offsets
+'''
+def split_ranges(path, parts):
+    size = os.path.getsize(path)
+    parts = max(1, min(parts, size))
+
+    bounds = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, parts):
+            offset = size * i // parts
+            if offset <= bounds[-1]:
+                continue
+
+            # Move to the start of the next line
+            f.seek(offset - 1)
+            f.readline()
+            offset = f.tell()
+
+            if bounds[-1] < offset < size:
+                bounds.append(offset)
+    bounds.append(size)
+
+    return list(zip(bounds[:-1], bounds[1:]))
+
+'''
+    Worker: parse the lines between start and end of the datafile
+
+    Returns {id: {name: (timestamps, values, statistics)}}, see MessageColumns.to_block and statistics
+'''
+def parse_range(path, start, end, messages_fields):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode('utf-8', 'replace')
+
+    columns = {}
+    cols.ingest_lines(text.splitlines(), columns, messages_fields)
+
+    blocks = {}
+    for id, inner_dict in columns.items():
+        blocks[id] = {}
+        for name, message in inner_dict.items():
+            blocks[id][name] = (*message.to_block(), message.stats) # Statistics are merged, not computed again
+    return blocks
+
+'''
+    Parse a datafile with several worker processes, filling the columns dictionary
+    Ranges are merged in file order, as ingest_lines keeps them
+
+    Returns the number of ingested lines
+'''
+def parse_parallel(path, columns, messages_fields, workers):
+    if workers < 2 or os.path.getsize(path) < PARALLEL_MIN_BYTES:
+        with open(path, 'r', encoding='utf-8', errors='replace') as datafile:
+            return cols.ingest_lines(datafile, columns, messages_fields)
+
+    parts = max(workers * RANGES_PER_WORKER, os.path.getsize(path) // MAX_RANGE_BYTES + 1)
+    ranges = split_ranges(path, parts)
+
+    ingested = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(parse_range, path, start, end, messages_fields) for start, end in ranges]
+
+        # Results are appended in the order of the ranges, not as they finish
+        for future in futures:
+            for id, inner_dict in future.result().items():
+                if id not in columns:
+                    columns[id] = {}
+
+                for name, (timestamps, values, block_stats) in inner_dict.items():
+                    message = columns[id].get(name)
+                    if message is None:
+                        message = columns[id][name] = cols.MessageColumns(name, messages_fields[name])
+
+                    message.append_block(timestamps, values, block_stats)
+                    ingested += len(timestamps)
+
+    # Workers are separate processes, only the merged lines are counted here
+    prof.count('lines_parsed', ingested)
+    return ingested
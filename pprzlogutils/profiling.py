@@ -0,0 +1,230 @@
+"""
+pprzlogutils - A Python library for parsing and processing Paparazzi UAV log files.
+
+profiling provides named stage timers, counters and memory snapshots for the parse and plot pipeline.
+It is disabled by default: stage() then returns a shared empty context and count() returns at once,
+so instrumented code costs close to nothing.
+
+Stages (calls, total and last time, resident memory before and after):
+
+    schema         -> message definitions from the .log file
+    parse_data     -> .data file parsed to columns
+    to_numpy       -> pending lines split and converted to NumPy (inside parse_data)
+    statistics     -> statistics of the appended rows, see statistics (inside to_numpy)
+    index_data     -> .data file indexed (lazy loading)
+    lazy_load      -> a lazy message parsed on first use
+    lazy_window    -> only a time window of a lazy message parsed, see logparser.get
+    cache_load     -> flight memory mapped from the cache
+    cache_save     -> flight saved in the cache
+    get_var        -> numpy array of a variable built from its column
+    derived        -> a derived variable evaluated, see derived
+    savetxt        -> variable saved as text
+    export         -> batch export
+    refresh_plot   -> checked variables added to or removed from the plot
+    decimate       -> plotted lines decimated again after a zoom or resize
+    draw           -> matplotlib drawing of the figure
+
+Counters: lines_parsed, lines_skipped, unknown_messages, bytes_read, bytes_decompressed, rows_converted
+
+The report also has the state of the memory budget of the columns, see memory.stats
+"""
+
+import cProfile
+import functools
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+
+from contextlib import nullcontext
+
+import pprzlogutils.memory as memory
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+# Constants
+PSTATS_EXTENSIONS = ('.pstats', '.prof')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+ENABLED = False
+STAGES = {} # name -> Stage
+COUNTERS = {} # name -> value
+PROFILER = None # cProfile.Profile, only if enabled with pstats
+
+NULL_STAGE = nullcontext() # Returned by stage() when disabled
+LOCK = threading.Lock() # Stages and counters are updated by the loader threads too
+
+'''
+    Current resident memory of this process in MB
+    Read from /proc on Linux, other systems give the peak (ru_maxrss) instead
+'''
+def rss_mb():
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE / 1024 ** 2
+    except (OSError, IndexError, ValueError):
+        pass
+
+    if resource is None:
+        return 0.0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 ** 2 if sys.platform == 'darwin' else rss / 1024
+
+'''
+    Timer of a named stage, used as a context manager
+    Nested calls of the same stage (recursion) are only timed once
+    Each thread has its own nesting depth and start time, so calls running at once in
+    several threads (e.g. the GUI loader and the main thread) are all timed
+'''
+class Stage:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.last = 0.0 # Seconds of the last call
+        self.rss_before = 0.0 # Resident memory in MB before and after the last call
+        self.rss_after = 0.0
+        self.rss_delta_max = 0.0 # Largest memory growth of a single call
+        self._local = threading.local() # depth, start and rss of the call running in each thread
+
+    def __enter__(self):
+        local = self._local
+        depth = getattr(local, 'depth', 0) + 1
+        local.depth = depth
+        if depth == 1:
+            local.rss = rss_mb()
+            local.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        local = self._local
+        local.depth -= 1
+        if local.depth == 0:
+            last = time.perf_counter() - local.start
+            rss_after = rss_mb()
+            with LOCK:
+                self.last = last
+                self.seconds += last
+                self.calls += 1
+                self.rss_before = local.rss
+                self.rss_after = rss_after
+                self.rss_delta_max = max(self.rss_delta_max, rss_after - local.rss)
+        return False
+
+    def to_dict(self):
+        return {'calls': self.calls, 'seconds': self.seconds, 'last': self.last, 'rss_before_mb': self.rss_before,
+                'rss_after_mb': self.rss_after, 'rss_delta_max_mb': self.rss_delta_max}
+
+# Context manager timing a stage, does nothing if profiling is disabled
+def stage(name):
+    if not ENABLED:
+        return NULL_STAGE
+
+    timer = STAGES.get(name)
+    if timer is None:
+        with LOCK:
+            timer = STAGES.setdefault(name, Stage(name))
+    return timer
+
+# Add n to a counter, does nothing if profiling is disabled
+def count(name, n=1):
+    if ENABLED:
+        with LOCK:
+            COUNTERS[name] = COUNTERS.get(name, 0) + n
+
+# Decorator timing every call of a function as a stage
+def timed(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+'''
+    Enable profiling. With use_cprofile every Python call is profiled too (see save_pstats),
+    which is much slower than the stage timers alone
+'''
+def enable(use_cprofile=False):
+    global ENABLED, PROFILER
+    ENABLED = True
+
+    if use_cprofile and PROFILER is None:
+        PROFILER = cProfile.Profile()
+        PROFILER.enable()
+
+def disable():
+    global ENABLED, PROFILER
+    ENABLED = False
+
+    if PROFILER is not None:
+        PROFILER.disable()
+
+# Remove every stage timer and counter
+def reset():
+    with LOCK:
+        STAGES.clear()
+        COUNTERS.clear()
+
+'''
+    Report of every stage and counter
+
+    Returns a dictionary, {'stages': {name: {...}}, 'counters': {name: value}, 'rss_mb': current memory}
+'''
+def report():
+    with LOCK:
+        stages = {name: timer.to_dict() for name, timer in STAGES.items()}
+        counters = dict(COUNTERS)
+    return {
+        'stages': stages,
+        'counters': counters,
+        'rss_mb': rss_mb(),
+        'memory': memory.stats(),
+    }
+
+# One line per stage and counter, slowest stages first
+def summary():
+    with LOCK:
+        timers = list(STAGES.values())
+        counters = dict(COUNTERS)
+
+    lines = []
+    for timer in sorted(timers, key=lambda t: t.seconds, reverse=True):
+        lines.append('%-16s %6d calls %10.3f s  (last %.3f s, mem %+.1f MB)' % (timer.name, timer.calls, timer.seconds,
+                     timer.last, timer.rss_after - timer.rss_before))
+    for name, value in sorted(counters.items()):
+        lines.append('%-16s %d' % (name, value))
+
+    return lines
+
+'''
+    Save the report as JSON, or the cProfile stats if path ends with .pstats or .prof
+    (the JSON report is saved next to it, with a .json extension)
+'''
+def save(path):
+    root, ext = os.path.splitext(path)
+    if ext in PSTATS_EXTENSIONS:
+        save_pstats(path)
+        path = root + '.json'
+
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report(), f, indent=2)
+
+    return path
+
+# Save the cProfile stats, which can be read with pstats or snakeviz
+def save_pstats(path):
+    if PROFILER is None:
+        raise ValueError('cProfile is not enabled, use enable(use_cprofile=True)')
+
+    PROFILER.disable()
+    pstats.Stats(PROFILER).dump_stats(path)
+    PROFILER.enable()
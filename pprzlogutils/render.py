@@ -0,0 +1,410 @@
+"""
+pprzlogutils - A Python library for parsing and processing Paparazzi UAV log files.
+
+render provides headless rendering of plots to image files, without Qt (Matplotlib Agg backend, no display needed),
+for reports of many flights. Figures are rendered by a pool of processes, one task per flight (or per flight and ID),
+and every worker draws all its figures on a single Figure, reusing its axes and line artists.
+Lines are decimated to the pixels of the figure (see decimation) before drawing.
+
+Figures are described by a plot spec, a JSON file (see load_spec) or the same dictionary:
+
+    {
+        "ids": [204, 205],                                  -> optional, every ID of each flight by default
+        "format": "png",                                    -> png (default) or pdf
+        "derived": {"speed": "sqrt(INS.ins_xd**2 + INS.ins_yd**2)"},   -> optional, see derived
+        "figures": [
+            {"name": "position", "vars": ["INS.ins_x", "INS.ins_y"], "t0": 40, "t1": 70},
+            {"name": "gps", "vars": ["GPS_INT"]},           -> a message alone is every number variable of it
+            {"name": "speed", "vars": ["DERIVED.speed"]}
+        ]
+    }
+
+Variables are plotted against time, t0 and t1 (seconds, optional) limit the window read (see logparser.get).
+Figures with none of their variables in an ID are skipped for that ID.
+
+Output folder:
+
+    index.html                       -> links to every flight
+    flight/index.html                -> the figures of every ID of the flight
+    flight/id/figure.png
+"""
+
+import html
+import json
+import numpy
+import os
+import re
+
+from concurrent.futures import ProcessPoolExecutor
+
+import pprzlogutils.columns as cols
+import pprzlogutils.decimation as dec
+import pprzlogutils.derived as derived
+import pprzlogutils.logparser as lp
+import pprzlogutils.profiling as prof
+import pprzlogutils.session as sess
+
+from matplotlib import rcParams
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+# Constants
+RENDER_FORMATS = ('png', 'pdf')
+RENDER_WORKERS = os.cpu_count() or 1
+FIGURE_SIZE = (12, 6, 100) # Width and height in inches, dots per inch
+INDEX_FILENAME = 'index.html'
+
+RENDERER = None # FigureRenderer of this process, created by its first task
+WORKER_SESSION = None # Last flight loaded by this process, reused by the next task of the same flight
+
+#####################################################################
+#####################################################################
+# Plotting helpers, shared with the GUI (see gui/matplotlib)
+#####################################################################
+#####################################################################
+
+# Grid and ticks of the plots
+def style_axes(axes):
+    axes.grid(True)
+    axes.minorticks_on()
+    axes.tick_params(which='both', direction='in', top=True, right=True)
+    axes.grid(True, which='both', linewidth=0.4)
+    axes.grid(True, which='major', linewidth=1.2)
+
+'''
+    Values of a variable plotted as a line against time: 1D numbers, or array fields with one value per row
+    (returned as 1D). Returns None for other array variables, which are plotted as points (see array_points)
+'''
+def line_values(v):
+    if v.dtype == object:
+        return None
+    if v.ndim == 1:
+        return v
+    if v.ndim == 2 and v.shape[1] == 1:
+        return v[:, 0]
+    return None
+
+# First two values of each row of an array variable, used as (x, y) points. Rows with less than two values are skipped
+def array_points(v):
+    v1 = []
+    v2 = []
+    for row in v:
+        if len(row) >= 2:
+            v1.append(row[0])
+            v2.append(row[1])
+
+    return v1, v2
+
+# Label of a plotted variable, with its unit if known
+def var_label(message, var, unit=None):
+    label = message + ' - ' + var
+    if unit:
+        label += ' [%s]' % unit
+    return label
+
+#####################################################################
+#####################################################################
+# Plot spec
+#####################################################################
+#####################################################################
+
+# Figure name usable as a filename
+def figure_filename(name):
+    return re.sub(r'[^\w.-]+', '_', name).strip('._') or 'figure'
+
+'''
+    Check and complete a plot spec (see the module documentation)
+    Missing options get their defaults, every figure gets a unique filename
+
+    Returns the spec. Raises ValueError if it is not valid
+'''
+def check_spec(spec):
+    figures = spec.get('figures')
+    if not figures:
+        raise ValueError('The plot spec has no figures')
+
+    fmt = spec.get('format', RENDER_FORMATS[0])
+    if fmt not in RENDER_FORMATS:
+        raise ValueError('Unknown format %s, use one of %s' % (fmt, ', '.join(RENDER_FORMATS)))
+
+    checked = []
+    filenames = set()
+    for i, figure in enumerate(figures):
+        vars = figure.get('vars')
+        if isinstance(vars, str):
+            vars = [vars]
+        if not vars:
+            raise ValueError('Figure %s has no variables' % figure.get('name', i + 1))
+
+        name = str(figure.get('name') or vars[0])
+        filename = figure_filename(name)
+        while filename in filenames:
+            filename += '_'
+        filenames.add(filename)
+
+        t0, t1 = figure.get('t0'), figure.get('t1')
+        checked.append({'name': name, 'filename': filename, 'vars': [str(v) for v in vars],
+                        't0': None if t0 is None else float(t0), 't1': None if t1 is None else float(t1)})
+
+    ids = spec.get('ids')
+    return {'figures': checked, 'ids': None if ids is None else [int(id) for id in ids],
+            'format': fmt, 'derived': dict(spec.get('derived') or {})}
+
+# Read a plot spec from a JSON file, see check_spec
+def load_spec(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return check_spec(json.load(f))
+
+'''
+    Plot spec from lists of variables and messages (as the options of pprz-py-plotter-render)
+    vars are plotted together in one figure, and each message in a figure of its own
+'''
+def make_spec(vars=None, messages=None, ids=None, t0=None, t1=None, fmt=RENDER_FORMATS[0], derived_definitions=None):
+    figures = []
+    if vars:
+        figures.append({'name': 'vars', 'vars': vars, 't0': t0, 't1': t1})
+    for message in messages or []:
+        figures.append({'name': message, 'vars': [message], 't0': t0, 't1': t1})
+
+    return check_spec({'figures': figures, 'ids': ids, 'format': fmt, 'derived': derived_definitions})
+
+#####################################################################
+#####################################################################
+# Rendering
+#####################################################################
+#####################################################################
+
+'''
+    Draws figures of a flight to files, reusing a single Figure
+    Line and scatter artists are kept between figures, only their data, labels and visibility change
+'''
+class FigureRenderer:
+    def __init__(self, width=FIGURE_SIZE[0], height=FIGURE_SIZE[1], dpi=FIGURE_SIZE[2]):
+        self.figure = Figure(figsize=(width, height), dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_subplot(111)
+        self.colors = rcParams['axes.prop_cycle'].by_key()['color']
+        self.lines = [] # Line2D pool
+        self.scatters = [] # PathCollection pool, for array variables
+        style_axes(self.axes)
+
+    # Maximum number of points drawn per line, depends on the axes width in pixels
+    def max_points(self):
+        return dec.POINTS_PER_PIXEL * self.axes.bbox.width
+
+    def line(self, i):
+        while len(self.lines) <= i:
+            self.lines.append(self.axes.plot([], [], color=self.colors[len(self.lines) % len(self.colors)])[0])
+        return self.lines[i]
+
+    def scatter(self, i):
+        while len(self.scatters) <= i:
+            self.scatters.append(self.axes.scatter([], [], s=10))
+        return self.scatters[i]
+
+    # Variables of a figure in a flight and ID, as (message, var). Messages alone are every number variable of them
+    def figure_vars(self, session, id, figure):
+        available = session.columns.get(id, {})
+        vars = []
+        for item in figure['vars']:
+            message, _, var = item.partition('.')
+            if message == derived.DERIVED:
+                if var:
+                    vars.append((message, var))
+            elif message in available:
+                if var:
+                    vars.append((message, var))
+                else:
+                    vars.extend((message, f.name) for f in session.fields.get(message, []) if not f.string)
+        return vars
+
+    # Field of a variable (see columns.Field), None for derived variables
+    def get_field(self, session, message, var):
+        for field in session.fields.get(message, []):
+            if field.name == var:
+                return field
+        return None
+
+    '''
+        Draw a figure of a flight and ID and save it to path
+
+        Returns the number of variables drawn, nothing is saved if there were none
+    '''
+    def render(self, session, id, figure, path, fmt=RENDER_FORMATS[0]):
+        axes = self.axes
+        lines = scatters = 0
+        artists = []
+        units = set()
+        offsets = []
+
+        for message, var in self.figure_vars(session, id, figure):
+            try:
+                window = lp.get(id, message, [var], figure['t0'], figure['t1'], session.columns, session.vars_cache)
+            except (KeyError, derived.DerivedError) as e:
+                print("Skipping %s.%s of ID %s in %s: %s" % (message, var, id, session.name, e))
+                continue
+
+            x, v = window[cols.TIMESTAMP], window[var]
+            field = self.get_field(session, message, var)
+            if not len(v) or (field is not None and field.string):
+                continue
+
+            y = line_values(v)
+            if y is None: # Array variable, its first two values as points, as the GUI does
+                points = numpy.column_stack(array_points(v))
+                if not len(points):
+                    continue
+
+            unit = None if field is None else cols.field_unit(field)
+            units.add(unit)
+            if y is not None:
+                with prof.stage('decimate'):
+                    artist = self.line(lines)
+                    artist.set_data(*dec.LevelOfDetail(x, y).points(max_points=self.max_points()))
+                lines += 1
+            else:
+                artist = self.scatter(scatters)
+                artist.set_offsets(points)
+                artist.set_facecolor(self.colors[(lines + scatters) % len(self.colors)])
+                offsets.extend(points)
+                scatters += 1
+
+            artist.set_label(var_label(message, var, unit))
+            artist.set_visible(True)
+            artists.append(artist)
+
+        if not artists:
+            return 0
+
+        for artist in self.lines[lines:] + self.scatters[scatters:]:
+            artist.set_visible(False)
+            artist.set_label('_hidden')
+
+        axes.set_title('%s - ID %s - %s' % (session.name, id, figure['name']))
+        axes.set_xlabel('Time (s)')
+        axes.set_ylabel(units.pop() if len(units) == 1 and None not in units else '')
+        axes.relim(visible_only=True)
+        if offsets:
+            axes.update_datalim(offsets) # relim does not include scatters
+        axes.autoscale_view()
+        axes.legend(handles=artists, loc='center left', bbox_to_anchor=(1, 0.5))
+
+        with prof.stage('draw'):
+            self.figure.savefig(path, format=fmt, bbox_inches='tight')
+        return len(artists)
+
+# Define the derived variables of a spec in this process, the ones already defined with the same expression are kept
+def define_derived(definitions):
+    for name, expression in definitions.items():
+        definition = derived.DEFINITIONS.get(name)
+        if definition is None or definition.expression != expression:
+            derived.define(name, expression)
+
+'''
+    Worker: render the figures of a flight, for the given IDs (None for all of them)
+    Files are saved in flight_dir/id/, flights are loaded lazily so only the windows plotted are parsed
+
+    Returns {id: {'span': (first, last), 'figures': [(figure name, file relative to flight_dir)]}}
+'''
+def render_flight(log_path, data_path, ids, spec, flight_dir, size=FIGURE_SIZE, use_cache=True):
+    global RENDERER, WORKER_SESSION
+    if RENDERER is None or RENDERER.figure.get_size_inches().tolist() != list(size[:2]) or RENDERER.figure.dpi != size[2]:
+        RENDERER = FigureRenderer(*size)
+
+    session = WORKER_SESSION
+    if session is None or (session.log_path, session.data_path) != (log_path, data_path):
+        session = WORKER_SESSION = sess.LogSession(log_path, data_path).load(use_cache, lazy=True)
+    define_derived(spec['derived'])
+
+    results = {}
+    for id in session.ids() if ids is None else ids:
+        if id not in session.columns:
+            continue
+
+        figures = []
+        os.makedirs(os.path.join(flight_dir, str(id)), exist_ok=True)
+        for figure in spec['figures']:
+            filename = os.path.join(str(id), '%s.%s' % (figure['filename'], spec['format']))
+            if RENDERER.render(session, id, figure, os.path.join(flight_dir, filename), spec['format']):
+                figures.append((figure['name'], filename))
+        results[id] = {'span': session.time_span(id), 'figures': figures}
+
+    return results
+
+'''
+    Render the figures of a plot spec for every flight, with a pool of processes
+    flights: list of (log path, data path), see session.find_flights
+
+    Every flight gets a folder (named as the flight) in output_dir with its index.html, and output_dir
+    an index.html linking them. With the IDs in the spec, each ID of each flight is a task of its own.
+
+    Returns a list of (flight name, results of render_flight)
+'''
+def render_flights(flights, spec, output_dir, workers=RENDER_WORKERS, size=FIGURE_SIZE, use_cache=True):
+    tasks = []
+    for log_path, data_path in flights:
+        name = sess.LogSession(log_path, data_path).name
+        for ids in [None] if spec['ids'] is None else [[id] for id in spec['ids']]:
+            tasks.append((name, (log_path, data_path, ids, spec, os.path.join(output_dir, name), size, use_cache)))
+
+    results = {}
+    if workers <= 1 or len(tasks) <= 1:
+        for name, task in tasks:
+            results.setdefault(name, {}).update(render_flight(*task))
+    else:
+        # Workers parse with the same unit conversion as this process
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=lp.set_convert_units, initargs=(lp.CONVERT_UNITS,)) as executor:
+            futures = [(name, executor.submit(render_flight, *task)) for name, task in tasks]
+            for name, future in futures:
+                results.setdefault(name, {}).update(future.result())
+
+    flights_results = []
+    for name in dict.fromkeys(name for name, _ in tasks): # Flight order
+        write_flight_index(os.path.join(output_dir, name), name, results[name], spec['format'])
+        flights_results.append((name, results[name]))
+    write_index(output_dir, flights_results)
+    return flights_results
+
+#####################################################################
+#####################################################################
+# Index pages
+#####################################################################
+#####################################################################
+
+def write_page(path, title, body):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>%s</title>\n</head>\n<body>\n<h1>%s</h1>\n%s</body>\n</html>\n'
+                % (html.escape(title), html.escape(title), ''.join(body)))
+
+# Index of a flight: the figures of every ID, shown as images (png) or linked (pdf)
+def write_flight_index(flight_dir, name, results, fmt):
+    os.makedirs(flight_dir, exist_ok=True)
+    body = []
+    for id in sorted(results):
+        span = results[id]['span']
+        body.append('<h2>ID %s</h2>\n' % id)
+        if span is not None:
+            body.append('<p>%.1f s to %.1f s</p>\n' % span)
+        if not results[id]['figures']:
+            body.append('<p>No figures, none of their variables are in this ID</p>\n')
+
+        for figure, filename in results[id]['figures']:
+            src = html.escape(filename.replace(os.sep, '/'))
+            if fmt == 'png':
+                body.append('<figure><img src="%s" alt="%s"><figcaption>%s</figcaption></figure>\n' % (src, html.escape(figure), html.escape(figure)))
+            else:
+                body.append('<p><a href="%s">%s</a></p>\n' % (src, html.escape(figure)))
+
+    write_page(os.path.join(flight_dir, INDEX_FILENAME), name, body)
+
+# Index of the output folder, one link per flight
+def write_index(output_dir, flights_results):
+    os.makedirs(output_dir, exist_ok=True)
+    body = ['<ul>\n']
+    for name, results in flights_results:
+        count = sum(len(r['figures']) for r in results.values())
+        body.append('<li><a href="%s/%s">%s</a> (%d IDs, %d figures)</li>\n'
+                    % (html.escape(name), INDEX_FILENAME, html.escape(name), len(results), count))
+    body.append('</ul>\n')
+
+    write_page(os.path.join(output_dir, INDEX_FILENAME), 'Flights', body)
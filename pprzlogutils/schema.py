@@ -0,0 +1,157 @@
+"""
+pprzlogutils - A Python library for parsing and processing Paparazzi UAV log files.
+
+schema provides the message definitions (registry) found in the protocol block of a .log file.
+Only the protocol block is parsed, with iterparse, skipping the airframe and flight plan config.
+Registries are cached by a hash of the protocol block, as the same Paparazzi version
+writes the same messages in every flight.
+
+Registry structure:
+
+    REGISTRY[msg_class] = {'id': '1', 'messages': {name: {'id': '198', 'fields': [field, ...]}}}
+    field = {'name': 'ins_x', 'type': 'int32', 'unit': None, 'alt_unit': 'm', 'alt_unit_coef': '0.0039063'}
+"""
+
+import hashlib
+import io
+import json
+import mmap
+import os
+
+from lxml import etree
+
+import pprzlogutils.compression as compression
+
+# Constants
+SCHEMA_VERSION = 1
+SCHEMA_CACHE_DIR = './cache/schemas'
+PROTOCOL_START = b'<protocol'
+PROTOCOL_END = b'</protocol>'
+FIELD_ATTRIBUTES = {'name': 'NAME', 'type': 'TYPE', 'unit': 'UNIT', 'alt_unit': 'ALT_UNIT', 'alt_unit_coef': 'ALT_UNIT_COEF'}
+
+REGISTRIES = {} # Registries already loaded, by hash of the protocol block
+
+'''
+    Find the protocol block of a .log file (bytes), without parsing the XML before it
+
+    Returns the bytes of the block, or None if it is not found
+'''
+def find_protocol(data):
+    start = data.find(PROTOCOL_START)
+    if start < 0:
+        return None
+
+    end = data.find(PROTOCOL_END, start)
+    if end < 0:
+        return None
+
+    return data[start:end + len(PROTOCOL_END)]
+
+'''
+    Build the registry from an XML source (file object), with iterparse
+    Elements outside of the protocol block are freed as soon as they end,
+    and parsing stops at the end of the protocol block
+'''
+def extract_registry(source):
+    registry = {}
+    msg_class = None
+
+    context = etree.iterparse(source, events=('start', 'end'), remove_comments=True, recover=True)
+    for event, elem in context:
+        if event == 'start':
+            if elem.tag == 'msg_class':
+                msg_class = registry[elem.get('NAME')] = {'id': elem.get('ID'), 'messages': {}}
+            continue
+
+        if elem.tag == 'message' and msg_class is not None:
+            fields = []
+            for var in elem.findall('field'):
+                fields.append({k: var.get(attr) for k, attr in FIELD_ATTRIBUTES.items()})
+            msg_class['messages'][elem.get('NAME')] = {'id': elem.get('ID'), 'fields': fields}
+            elem.clear()
+        elif elem.tag == 'msg_class':
+            msg_class = None
+            elem.clear()
+        elif elem.tag == 'protocol':
+            break
+        elif msg_class is None:
+            # Config (airframe, flight plan...), not needed
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+    return registry
+
+def protocol_hash(protocol):
+    digest = hashlib.blake2b(protocol, digest_size=16)
+    digest.update(b'%d' % SCHEMA_VERSION)
+    return digest.hexdigest()
+
+'''
+    Get the registry of a .log file contents (bytes), from the cache if possible
+    cache_dir is the folder of the cached registries (e.g. SCHEMA_CACHE_DIR), None to not read nor write them.
+    Registries already loaded by this process are always reused
+'''
+def registry_from_bytes(data, cache_dir=None):
+    protocol = find_protocol(data)
+    if protocol is None:
+        # No protocol markers found, parse the whole file (still stopping at the protocol end)
+        return extract_registry(io.BytesIO(bytes(data)))
+
+    key = protocol_hash(protocol)
+    if key in REGISTRIES:
+        return REGISTRIES[key]
+
+    if cache_dir is None:
+        REGISTRIES[key] = extract_registry(io.BytesIO(protocol))
+        return REGISTRIES[key]
+
+    path = os.path.join(cache_dir, key + '.json')
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            REGISTRIES[key] = json.load(f)
+        return REGISTRIES[key]
+    except (OSError, ValueError):
+        pass
+
+    registry = REGISTRIES[key] = extract_registry(io.BytesIO(protocol))
+    save_registry(registry, path)
+    return registry
+
+# Save a registry in the cache. The cache is optional, the registry is still used if it can not be written
+def save_registry(registry, path):
+    tmp_path = path + '.tmp-%d' % os.getpid()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(registry, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+'''
+    Get the registry of a .log file, given its path. The file is memory mapped, not read
+    Compressed files (.log.gz...) are decompressed chunk by chunk, keeping only the protocol block
+    See registry_from_bytes for cache_dir
+'''
+def load_registry(log_path, cache_dir=None):
+    if compression.is_compressed(log_path):
+        protocol = compression.read_block(log_path, PROTOCOL_START, PROTOCOL_END)
+        if protocol is None:
+            with compression.open_compressed(log_path) as f:
+                return extract_registry(f)
+        return registry_from_bytes(protocol, cache_dir)
+
+    with open(log_path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # Empty file
+            return {}
+
+        try:
+            return registry_from_bytes(data, cache_dir)
+        finally:
+            data.close()
@@ -0,0 +1,277 @@
+"""
+pprzlogutils - A Python library for parsing and processing Paparazzi UAV log files.
+
+session provides LogSession, the schema and data of one flight (one .log and one .data file),
+and a loader which opens every flight of a folder concurrently with a process pool.
+
+Every flight owns its columns, while flights with the same message definitions
+(same Paparazzi version) share a single schema (registry, named tuples and fields).
+logparser functions work on the current session, see logparser.activate.
+"""
+
+import hashlib
+import json
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+
+import pprzlogutils.alignment as alignment
+import pprzlogutils.cache as cache
+import pprzlogutils.columns as cols
+import pprzlogutils.compression as compression
+import pprzlogutils.dataindex as dataindex
+import pprzlogutils.logparser as lp
+
+# Constants
+LOAD_WORKERS = os.cpu_count() or 1
+
+SCHEMAS = {} # Shared schemas, hash of the fields -> (registry, types, fields)
+
+'''
+    Schema and data of one flight
+'''
+class LogSession:
+    def __init__(self, log_path, data_path, name=None):
+        self.log_path = log_path
+        self.data_path = data_path
+        self.name = name or os.path.splitext(compression.strip_extension(os.path.basename(data_path)))[0]
+        self.cached = False # Loaded from the cache
+        self.follower = None # follow.DataFollower, in follow mode
+        self.reset()
+
+    def __repr__(self):
+        return 'LogSession(%s)' % self.name
+
+    # Empty schema and data
+    def reset(self):
+        self.registry = {}
+        self.types = {}
+        self.fields = {}
+        self.columns = {}
+        self.data_dict = cols.DataDictView(self.columns, self.types)
+        self.vars_cache = {}
+
+    '''
+        Load the flight, from the cache if possible (see cache.load_or_parse)
+        The session is the current logparser session afterwards
+    '''
+    def load(self, use_cache=True, rebuild=False, lazy=False, workers=1):
+        self.reset()
+        lp.activate(self)
+
+        self.cached = cache.load_or_parse(self.log_path, self.data_path, use_cache, rebuild, lazy, workers)
+        self.share_schema()
+        return self
+
+    # Load the flight only if it is in the cache, returns True if it was
+    def load_cached(self):
+        self.reset()
+        lp.activate(self)
+
+        self.cached = cache.load(cache.flight_key(self.log_path, self.data_path))
+        if self.cached:
+            self.share_schema()
+        return self.cached
+
+    '''
+        Use a registry already read (see schema.load_registry), without data yet
+        The data is added afterwards, for example by the background loader of the GUI
+    '''
+    def load_schema(self, registry):
+        self.reset()
+        lp.activate(self)
+
+        lp.load_schema(registry)
+        self.share_schema()
+        return self
+
+    '''
+        Load the flight from an index already scanned in another process (lazy loading)
+        With use_cache = True the message definitions are cached, see logparser.parse_structs
+    '''
+    def load_index(self, index, use_cache=False):
+        self.reset()
+        lp.activate(self)
+
+        lp.parse_structs(self.log_path, use_cache)
+        lp.index_datafile(self.data_path, index=index)
+        self.share_schema()
+        return self
+
+    '''
+        Load the flight from blocks parsed in another process (see MessageColumns.to_block)
+    '''
+    def load_blocks(self, blocks):
+        self.reset()
+        lp.activate(self)
+
+        lp.parse_structs(self.log_path)
+        for id, inner_dict in blocks.items():
+            self.columns[id] = {}
+            for name, (timestamps, values) in inner_dict.items():
+                message = self.columns[id][name] = cols.MessageColumns(name, self.fields[name])
+                message.append_block(timestamps, values)
+        self.share_schema()
+        return self
+
+    '''
+        Start following the .data file while it is being written (see follow.DataFollower)
+        Call poll() on the returned follower to read the new lines
+    '''
+    def follow(self):
+        self.reset()
+        lp.activate(self)
+
+        lp.parse_structs(self.log_path)
+        self.share_schema()
+        self.follower = lp.follow_datafile(self.data_path)
+        return self.follower
+
+    '''
+        Use the schema of a previously loaded flight with the same message definitions, if there is one
+        Columns are pointed to the shared fields, so the duplicated schema is freed
+    '''
+    def share_schema(self):
+        key = schema_key(self.fields)
+        shared = SCHEMAS.get(key)
+
+        if shared is None:
+            SCHEMAS[key] = (self.registry, self.types, self.fields)
+        else:
+            # Keep the registry if the shared one was loaded from the cache, which has none
+            if not shared[0] and self.registry:
+                shared[0].update(self.registry)
+
+            self.registry, self.types, self.fields = shared
+            for inner_dict in self.columns.values():
+                for message in inner_dict.values():
+                    message.fields = self.fields.get(message.name, message.fields)
+            self.data_dict = cols.DataDictView(self.columns, self.types)
+
+        lp.activate(self)
+
+    # Make this session the current logparser session
+    def activate(self):
+        lp.activate(self)
+
+    # Memoized numpy array of a variable, see logparser.get_var
+    def get_var(self, id, message, var):
+        return lp.get_var(id, message, var, self.columns, self.vars_cache)
+
+    # Rows of a message between t0 and t1, see logparser.get
+    def get(self, id, message, fields=None, t0=None, t1=None):
+        return lp.get(id, message, fields, t0, t1, self.columns, self.vars_cache)
+
+    # Variables resampled onto a common timebase, see logparser.align
+    def align(self, streams, timebase=None, rate=None, method=alignment.DEFAULT_METHOD):
+        return lp.align(streams, timebase, rate, method, self.columns, self.vars_cache)
+
+    def time_span(self, id):
+        return lp.time_span(id, self.columns)
+
+    # Statistics of the messages, see logparser.summary
+    def summary(self, ids=None, messages=None):
+        return lp.summary(ids, messages, self.columns)
+
+    def ids(self):
+        return sorted(self.columns.keys())
+
+    def messages(self, id):
+        return sorted(self.columns.get(id, {}).keys())
+
+# Hash of the message definitions, flights with the same hash share their schema
+def schema_key(fields):
+    definitions = sorted((name, [cols.field_attributes(f) for f in message]) for name, message in fields.items())
+    return hashlib.blake2b(json.dumps(definitions).encode(), digest_size=16).hexdigest()
+
+#####################################################################
+#####################################################################
+# Loading many flights
+#####################################################################
+#####################################################################
+
+'''
+    Find the flights of a folder: every .log file with a .data file with the same name
+    Both can be compressed (see compression), sample.log.gz with sample.data.xz is a flight too
+
+    Returns a list of (log path, data path), sorted by name
+'''
+def find_flights(folder):
+    logs = {}
+    datas = {}
+    for file in sorted(os.listdir(folder)):
+        # Compressed files (sample.data.gz) too, plain files are sorted first so they are preferred
+        name, ext = os.path.splitext(compression.strip_extension(file))
+        if ext == '.log':
+            logs.setdefault(name, file)
+        elif ext == '.data':
+            datas.setdefault(name, file)
+
+    return [(os.path.join(folder, logs[name]), os.path.join(folder, datas[name])) for name in sorted(logs) if name in datas]
+
+# Worker: parse a flight and save it in the cache, the parent then memory maps it
+def prepare_cached(log_path, data_path, rebuild):
+    LogSession(log_path, data_path).load(use_cache=True, rebuild=rebuild)
+
+# Worker: parse a flight and return its columns as blocks (without cache)
+def parse_blocks(log_path, data_path):
+    session = LogSession(log_path, data_path).load(use_cache=False)
+
+    blocks = {}
+    for id, inner_dict in session.columns.items():
+        blocks[id] = {name: message.to_block() for name, message in inner_dict.items()}
+    return blocks
+
+'''
+    Load every flight of a folder (see find_flights) concurrently, with a pool of processes
+
+    Depending on the options, workers do the heavy part and the results come back cheaply:
+    - use_cache, not lazy: workers save the flights in the cache, which is then memory mapped
+    - lazy: workers scan the line offsets and timestamps of the .data files (flights already cached are just mapped),
+      compressed .data files can not be indexed and are loaded as if lazy was False
+    - no cache, not lazy: workers parse the flights and return their columns as compact arrays
+
+    Returns a list of LogSession, one per flight
+'''
+def load_directory(folder, use_cache=True, rebuild=False, lazy=False, workers=LOAD_WORKERS):
+    flights = find_flights(folder)
+    sessions = [LogSession(log_path, data_path) for log_path, data_path in flights]
+    if not sessions:
+        return sessions
+
+    # Workers parse with the same unit conversion as this process
+    with ProcessPoolExecutor(max_workers=max(1, min(workers, len(sessions))), initializer=lp.set_convert_units, initargs=(lp.CONVERT_UNITS,)) as executor:
+        if lazy:
+            pending = []
+            for session in sessions:
+                # Flights already cached do not need the index
+                if use_cache and not rebuild and session.load_cached():
+                    continue
+                # Compressed flights can not be indexed, they are parsed (and cached) instead
+                if compression.is_compressed(session.data_path):
+                    if use_cache:
+                        pending.append((session, executor.submit(prepare_cached, session.log_path, session.data_path, rebuild)))
+                    else:
+                        pending.append((session, executor.submit(parse_blocks, session.log_path, session.data_path)))
+                    continue
+                pending.append((session, executor.submit(dataindex.scan_offsets, session.data_path)))
+
+            for session, future in pending:
+                if not compression.is_compressed(session.data_path):
+                    session.load_index(future.result(), use_cache)
+                elif use_cache:
+                    future.result()
+                    session.load(use_cache=True)
+                else:
+                    session.load_blocks(future.result())
+        elif use_cache:
+            futures = [executor.submit(prepare_cached, s.log_path, s.data_path, rebuild) for s in sessions]
+            for session, future in zip(sessions, futures):
+                future.result()
+                session.load(use_cache=True)
+        else:
+            futures = [executor.submit(parse_blocks, s.log_path, s.data_path) for s in sessions]
+            for session, future in zip(sessions, futures):
+                session.load_blocks(future.result())
+
+    return sessions
@@ -0,0 +1,226 @@
+"""
+pprzlogutils - A Python library for parsing and processing Paparazzi UAV log files.
+
+statistics provides the summary of the messages, computed while they are parsed: rows, rate, time span and gaps
+of each (id, message), and minimum, maximum, mean and standard deviation of each number field.
+
+Every block of rows appended to a message (see columns.MessageColumns.append_block) updates its MessageStats,
+so the summary is ready when the parse ends, without converting any variable again. Means and variances
+are merged block by block (Welford's update generalized by Chan to blocks), the same way blocks parsed
+by other processes are merged (see parallel).
+
+Gaps are intervals between rows longer than GAP_FACTOR times the period of the message,
+the median interval of the last block of rows, so they work for messages of any rate.
+The rows dropped in a gap are estimated from its length and the period.
+
+Columns loaded from the cache get their statistics on the first use (one pass over them).
+Lazy messages not parsed yet only have the statistics of their timestamps, from the index (see dataindex).
+
+Example:
+statistics.summarize(lp.DATA_COLUMNS) -> [(204, 'INS', MessageStats), ...]
+"""
+
+import math
+import numpy
+
+# Constants
+GAP_FACTOR = 5.0 # Intervals longer than GAP_FACTOR periods are gaps
+MIN_PERIOD_INTERVALS = 8 # Intervals of a block needed to estimate the period again
+
+'''
+    Count, minimum, maximum, mean and variance of the values of a field
+    Array fields count every value of every row
+'''
+class FieldStats:
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0 # Sum of the squared differences to the mean
+        self.min = None
+        self.max = None
+
+    # Add a block of values, NaN and infinite values are not counted
+    def update(self, values):
+        if values.dtype.kind == 'f':
+            finite = numpy.isfinite(values)
+            if not finite.all():
+                values = values[finite]
+        if not len(values):
+            return
+
+        mean = values.mean(dtype=numpy.float64)
+        m2 = numpy.square(values - mean).sum()
+        self.merge(len(values), mean, m2, values.min(), values.max())
+
+    # Merge the statistics of other values (Chan et al. parallel variance)
+    def merge(self, count, mean, m2, vmin, vmax):
+        if not count:
+            return
+
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.min = float(vmin) if self.min is None else min(self.min, float(vmin))
+        self.max = float(vmax) if self.max is None else max(self.max, float(vmax))
+
+    # Population standard deviation, NaN without values
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / self.count) if self.count else math.nan
+
+    def as_dict(self):
+        return {'count': self.count, 'min': self.min, 'max': self.max,
+                'mean': float(self.mean) if self.count else None, 'std': self.std if self.count else None}
+
+'''
+    Statistics of the rows of a message (timestamps) and of its number fields (see FieldStats)
+    Timestamps are expected in file order, as the rows are appended
+'''
+class MessageStats:
+    def __init__(self, fields=()):
+        self.count = 0
+        self.first = None
+        self.last = None
+        self.period = None # Median interval between rows, see the module documentation
+        self.gaps = 0
+        self.gap_seconds = 0.0
+        self.max_gap = 0.0
+        self.dropped = 0 # Rows estimated to be missing in the gaps
+        self.approximate = False # Merged from blocks too short to estimate their period, see merge
+        self.fields = {field.name: FieldStats() for field in fields if not field.string}
+
+    def __repr__(self):
+        return 'MessageStats(%d rows, %d gaps)' % (self.count, self.gaps)
+
+    '''
+        Add a block of rows, values as given to MessageColumns.append_block (None for timestamps only)
+    '''
+    def update(self, timestamps, values=None):
+        if not len(timestamps):
+            return
+
+        if self.count:
+            intervals = numpy.diff(timestamps, prepend=self.last)
+        else:
+            intervals = numpy.diff(timestamps)
+            self.first = float(timestamps[0])
+
+        positive = intervals[intervals > 0]
+        if len(positive) >= MIN_PERIOD_INTERVALS or (self.period is None and len(positive)):
+            self.period = float(numpy.median(positive))
+        self.add_gaps(intervals)
+
+        self.count += len(timestamps)
+        self.last = float(timestamps[-1])
+
+        if values:
+            for name, field_stats in self.fields.items():
+                v = values.get(name)
+                if v is not None:
+                    field_stats.update(v[1] if isinstance(v, tuple) else v) # Array fields are (lengths, flat values)
+
+    def add_gaps(self, intervals):
+        if not self.period:
+            return
+
+        gaps = intervals[intervals > GAP_FACTOR * self.period]
+        if len(gaps):
+            self.gaps += len(gaps)
+            self.gap_seconds += float(gaps.sum())
+            self.max_gap = max(self.max_gap, float(gaps.max()))
+            self.dropped += int(numpy.rint(gaps / self.period).sum()) - len(gaps)
+
+    '''
+        Merge the statistics of the rows that follow (the next range of the file, see parallel)
+        The interval between both is checked for a gap too. If either has too few rows to estimate
+        the period, the gaps are approximate, and should be computed again with all the rows
+    '''
+    def merge(self, other):
+        if not other.count:
+            return
+
+        if self.count:
+            if min(self.count, other.count) <= MIN_PERIOD_INTERVALS:
+                self.approximate = True
+            self.period = self.period or other.period
+            self.add_gaps(numpy.array([other.first - self.last]))
+        else:
+            self.first = other.first
+
+        self.period = other.period or self.period
+        self.count += other.count
+        self.last = other.last
+        self.gaps += other.gaps
+        self.gap_seconds += other.gap_seconds
+        self.max_gap = max(self.max_gap, other.max_gap)
+        self.dropped += other.dropped
+        self.approximate = self.approximate or other.approximate
+
+        for name, field_stats in other.fields.items():
+            self.fields.setdefault(name, FieldStats()).merge(field_stats.count, field_stats.mean, field_stats.m2,
+                                                             field_stats.min, field_stats.max)
+
+    # Rows per second, None with less than two rows
+    @property
+    def rate(self):
+        if self.count < 2 or self.last <= self.first:
+            return None
+        return (self.count - 1) / (self.last - self.first)
+
+    def as_dict(self):
+        return {'rows': self.count, 'rate': self.rate, 'first': self.first, 'last': self.last, 'period': self.period,
+                'gaps': self.gaps, 'gap_seconds': self.gap_seconds, 'max_gap': self.max_gap, 'dropped': self.dropped,
+                'fields': {name: s.as_dict() for name, s in self.fields.items() if s.count}}
+
+#####################################################################
+#####################################################################
+# Summary
+#####################################################################
+#####################################################################
+
+'''
+    Statistics of every message of the columns (columns[id][name] -> MessageColumns), or of the given IDs and messages
+
+    Returns a list of (id, message, MessageStats), sorted by ID and message
+'''
+def summarize(columns, ids=None, messages=None):
+    summary = []
+    for id in sorted(columns.keys()) if ids is None else ids:
+        inner_dict = columns.get(id, {})
+        for name in sorted(inner_dict.keys()) if messages is None else messages:
+            if name in inner_dict:
+                summary.append((id, name, inner_dict[name].statistics()))
+    return summary
+
+# Summary as a JSON serializable list
+def summary_dicts(summary):
+    return [dict(id=id, message=name, **message_stats.as_dict()) for id, name, message_stats in summary]
+
+def format_number(value, spec='%.6g'):
+    return '-' if value is None or value != value else spec % value
+
+'''
+    Summary as lines of text, a table of the messages of each ID
+    With fields, every message is followed by the statistics of its number fields
+'''
+def format_summary(summary, fields=True):
+    lines = []
+    current = None
+    for id, name, s in summary:
+        if id != current:
+            current = id
+            if lines:
+                lines.append('')
+            lines.append('ID %s' % id)
+            lines.append('%-24s %10s %10s %10s %10s %6s %10s %8s' % ('message', 'rows', 'rate Hz', 'first s', 'last s', 'gaps', 'max gap s', 'dropped'))
+
+        lines.append('%-24s %10d %10s %10s %10s %6d %10s %8d' % (name, s.count, format_number(s.rate, '%.2f'), format_number(s.first, '%.3f'),
+                                                                format_number(s.last, '%.3f'), s.gaps, format_number(s.max_gap if s.gaps else None, '%.3f'), s.dropped))
+        if fields:
+            for field, f in s.fields.items():
+                if f.count:
+                    lines.append('    %-20s min %-12s max %-12s mean %-12s std %s' % (field, format_number(f.min), format_number(f.max),
+                                                                                   format_number(f.mean), format_number(f.std)))
+    return lines
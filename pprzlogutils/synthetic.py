@@ -0,0 +1,202 @@
+"""
+pprzlogutils - A Python library for parsing and processing Paparazzi UAV log files.
+
+synthetic provides a generator of synthetic flights (.log and .data files) of any size, for benchmarks.
+The message definitions are taken from a real .log file, and the message mix (rates, array lengths
+and strings) from its .data file. Values are random walks, so plots look like real signals.
+
+Files are written in chunks of simulated time, so tens of GB can be generated with little memory.
+"""
+
+import numpy
+import os
+import re
+import shutil
+
+from itertools import repeat
+
+import pprzlogutils.columns as cols
+import pprzlogutils.logparser as lp
+
+# Constants
+SAMPLE_LOG = './logs/sample.log'
+SAMPLE_DATA = './logs/sample.data'
+CHUNK_SECONDS = 10.0 # Simulated time generated at once
+ARRAY_LENGTH = 4 # Length of variable arrays not found in the sample
+STRING_VALUE = 'synthetic' # Value of strings not found in the sample
+SIZE_UNITS = {'': 1, 'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+
+# Size given as text (500MB, 10GB...) -> bytes
+def parse_size(text):
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMGT]?B?)\s*', text.upper())
+    if match is None:
+        raise ValueError('Invalid size %s, use for example 500MB or 10GB' % text)
+
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+'''
+    Get the message mix of a real flight
+    The rate of each message is its number of rows over the flight duration (of its ID)
+
+    Returns (ids, mix), mix[name] = (rate in Hz, first row of the message)
+'''
+def sample_mix(log_path=SAMPLE_LOG, data_path=SAMPLE_DATA):
+    lp.parse_files(log_path, data_path)
+
+    mix = {}
+    for id, inner_dict in lp.DATA_COLUMNS.items():
+        first = min(m.column(cols.TIMESTAMP)[0] for m in inner_dict.values())
+        last = max(m.column(cols.TIMESTAMP)[-1] for m in inner_dict.values())
+        duration = max(last - first, 1.0)
+
+        for name, message in inner_dict.items():
+            rate = len(message) / duration
+            if name not in mix or mix[name][0] < rate:
+                mix[name] = (rate, message.row(0))
+
+    return sorted(lp.DATA_COLUMNS.keys()), mix
+
+# Length of an array field: fixed by its type (float[3]), else as in the sample row
+def array_length(field, sample):
+    match = re.search(r'\[(\d+)\]', field.type)
+    if match:
+        return int(match.group(1))
+    if sample is not None:
+        return len(sample)
+    return ARRAY_LENGTH
+
+'''
+    Random walk of n values for a field, starting after the last value generated (state)
+    Integers are kept inside the range of their type
+'''
+def random_walk(rng, field, state, n, width=None):
+    shape = (n,) if width is None else (n, width)
+    start = state if state is not None else numpy.zeros(shape[1:])
+
+    if field.dtype.kind == 'f':
+        values = start + numpy.cumsum(rng.normal(0.0, 0.05, shape), axis=0)
+        return values.astype(field.dtype)
+
+    info = numpy.iinfo(field.dtype)
+    low, high = max(info.min, -10 ** 6), min(info.max, 10 ** 6)
+    values = start + numpy.cumsum(rng.integers(-2, 3, shape), axis=0)
+    return numpy.clip(values, low, high).astype(field.dtype)
+
+'''
+    Generator of synthetic flights
+    ids: aircraft IDs, mix: see sample_mix (rates can be scaled with rate_scale)
+'''
+class FlightGenerator:
+    def __init__(self, ids, mix, messages_fields, rate_scale=1.0, seed=0):
+        self.ids = ids
+        self.mix = {name: (rate * rate_scale, row) for name, (rate, row) in mix.items() if name in messages_fields}
+        self.messages_fields = messages_fields
+        self.rng = numpy.random.default_rng(seed)
+        self.state = {} # Last value of each (id, message, field), so walks continue between chunks
+        self.time = 0.0
+        self.next_sample = {} # Time of the next row of each (id, message)
+
+    '''
+        Generate the lines of the next chunk of simulated time, sorted by timestamp
+
+        Returns a list of lines (without newline)
+    '''
+    def chunk(self, seconds=CHUNK_SECONDS):
+        end = self.time + seconds
+        timestamps = []
+        lines = []
+
+        for id in self.ids:
+            for name, (rate, row) in self.mix.items():
+                if rate <= 0:
+                    continue
+
+                # Each aircraft and message starts with a different phase, like real logs
+                start = self.next_sample.get((id, name), self.time + self.rng.random() / rate)
+                n = int(numpy.ceil((end - start) * rate)) if start < end else 0
+                if n == 0:
+                    continue
+
+                ts = start + numpy.arange(n) / rate
+                self.next_sample[(id, name)] = start + n / rate
+                timestamps.append(ts)
+                lines.extend(self.message_lines(id, name, ts, row))
+
+        self.time = end
+        if not lines:
+            return []
+
+        order = numpy.argsort(numpy.concatenate(timestamps), kind='stable')
+        return [lines[i] for i in order]
+
+    # Lines of one message of one aircraft, at the given timestamps
+    def message_lines(self, id, name, ts, row):
+        n = len(ts)
+        tokens = [numpy.round(ts, 3).astype(str), repeat('%d %s' % (id, name))]
+
+        for k, field in enumerate(self.messages_fields[name]):
+            sample = row[k + 1] if row is not None else None
+            key = (id, name, field.name)
+
+            if field.string:
+                value = str(sample) if sample is not None else STRING_VALUE
+                tokens.append(repeat(value.replace(' ', '_') or STRING_VALUE))
+            elif field.array:
+                values = random_walk(self.rng, field, self.state.get(key), n, array_length(field, sample))
+                self.state[key] = values[-1]
+                tokens.append([','.join(r) for r in values.astype(str)])
+            else:
+                values = random_walk(self.rng, field, self.state.get(key), n)
+                self.state[key] = values[-1]
+                tokens.append(values.astype(str))
+
+        return [' '.join(r) for r in zip(*tokens)]
+
+'''
+    Write a synthetic flight of about size bytes to output_dir (name.log and name.data)
+    The .log is a copy of the sample .log, so it has the same message definitions
+
+    messages: {name: rate in Hz or None} to choose the message mix (None keeps the sample mix)
+
+    Returns a dictionary with the paths and the number of lines and bytes written
+'''
+def generate(output_dir, size, ids=None, messages=None, rate_scale=1.0, seed=0,
+             log_path=SAMPLE_LOG, data_path=SAMPLE_DATA, name='synthetic'):
+    sample_ids, mix = sample_mix(log_path, data_path)
+
+    if messages:
+        selected = {}
+        for message, rate in messages.items():
+            if message not in lp.MESSAGES_FIELDS:
+                raise ValueError('Unknown message %s' % message)
+            sample_rate, row = mix.get(message, (1.0, None))
+            selected[message] = (sample_rate if rate is None else rate, row)
+        mix = selected
+
+    generator = FlightGenerator(ids or sample_ids, mix, lp.MESSAGES_FIELDS, rate_scale, seed)
+
+    os.makedirs(output_dir, exist_ok=True)
+    out_log = os.path.join(output_dir, name + '.log')
+    out_data = os.path.join(output_dir, name + '.data')
+    shutil.copyfile(log_path, out_log)
+
+    # Written with another name first, so an interrupted run does not leave a truncated flight
+    tmp_data = out_data + '.tmp'
+    written = 0
+    lines = 0
+    with open(tmp_data, 'w', encoding='utf-8') as f:
+        while written < size:
+            chunk = generator.chunk()
+            if not chunk:
+                if not generator.mix:
+                    break
+                continue
+
+            text = '\n'.join(chunk) + '\n'
+            f.write(text)
+            written += len(text)
+            lines += len(chunk)
+    os.replace(tmp_data, out_data)
+
+    return {'log': out_log, 'data': out_data, 'lines': lines, 'bytes': written,
+            'ids': list(generator.ids), 'messages': len(generator.mix), 'seconds': generator.time}
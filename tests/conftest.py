@@ -0,0 +1,38 @@
+"""
+Shared fixtures of the pprzlogutils tests.
+Every test runs in its own temporary directory, so the caches and outputs
+written to ./cache, ./tmp or ./output never end up in the repository.
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pprzlogutils.logparser as lp
+import pprzlogutils.session as session
+
+SAMPLE_LOG = os.path.join(ROOT, 'logs', 'sample.log')
+SAMPLE_DATA = os.path.join(ROOT, 'logs', 'sample.data')
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+@pytest.fixture(autouse=True)
+def no_convert_units():
+    lp.set_convert_units(False)
+    yield
+    lp.set_convert_units(False)
+
+# Load a flight without the cache, as the current logparser session
+def load_flight(log_path=SAMPLE_LOG, data_path=SAMPLE_DATA, lazy=False, workers=1):
+    return session.LogSession(log_path, data_path).load(use_cache=False, lazy=lazy, workers=workers)
+
+# Every row of every message, {(id, name): (timestamps, values)}, see MessageColumns.to_block
+def flight_blocks(flight):
+    return {(id, name): message.to_block() for id, inner_dict in flight.columns.items()
+            for name, message in inner_dict.items()}
@@ -0,0 +1,57 @@
+import numpy
+import pytest
+
+import pprzlogutils.alignment as alignment
+
+T = numpy.array([0.0, 1.0, 2.0, 4.0])
+X = numpy.array([0, 10, 20, 40], dtype=numpy.int32)
+TARGET = numpy.array([-1.0, 0.4, 0.6, 1.0, 3.0, 5.0])
+
+def test_nearest_keeps_the_dtype():
+    values = alignment.resample(T, X, TARGET, 'nearest')
+    assert values.dtype == numpy.int32
+    assert values.tolist() == [0, 0, 10, 10, 20, 40] # Ties take the previous sample
+
+def test_previous_is_nan_before_the_first_sample():
+    values = alignment.resample(T, X, TARGET, 'previous')
+    numpy.testing.assert_array_equal(values, [numpy.nan, 0, 0, 10, 20, 40])
+
+def test_linear_is_nan_outside_of_the_stream():
+    values = alignment.resample(T, X, TARGET, 'linear')
+    numpy.testing.assert_allclose(values, [numpy.nan, 4, 6, 10, 30, numpy.nan])
+
+def test_linear_array_fields_row_by_row():
+    x = numpy.array([[0.0, 0.0], [10.0, -10.0]])
+    values = alignment.resample([0.0, 1.0], x, [0.25, 0.5], 'linear')
+    numpy.testing.assert_allclose(values, [[2.5, -2.5], [5.0, -5.0]])
+
+def test_object_arrays():
+    x = numpy.array(['a', 'b', 'c', 'd'], dtype=object)
+    assert alignment.resample(T, x, [-1.0, 1.5], 'previous').tolist() == [None, 'b']
+    with pytest.raises(ValueError):
+        alignment.resample(T, x, [1.5], 'linear')
+
+def test_errors():
+    with pytest.raises(ValueError):
+        alignment.resample(T, X, TARGET, 'cubic')
+    with pytest.raises(ValueError):
+        alignment.resample(T, X[:2], TARGET)
+    with pytest.raises(ValueError):
+        alignment.align_streams([(T, X)])
+
+def test_empty_stream():
+    values = alignment.resample([], numpy.array([], dtype=numpy.int32), [0.0, 1.0], 'nearest')
+    assert numpy.isnan(values).all()
+
+def test_fixed_timebase_uses_the_overlap():
+    timebase = alignment.fixed_timebase([numpy.array([0.0, 10.0]), numpy.array([2.0, 5.0])], 2)
+    numpy.testing.assert_allclose(timebase, numpy.arange(2.0, 5.5, 0.5))
+
+    timebase = alignment.fixed_timebase([numpy.array([0.0, 1.0]), numpy.array([2.0, 3.0])], 1)
+    numpy.testing.assert_allclose(timebase, [0.0, 1.0, 2.0, 3.0])
+
+def test_align_streams():
+    timebase, values = alignment.align_streams([(T, X), ([0.0, 4.0], numpy.array([0.0, 4.0]))], rate=1, method='linear')
+    numpy.testing.assert_allclose(timebase, [0, 1, 2, 3, 4])
+    numpy.testing.assert_allclose(values[0], [0, 10, 20, 30, 40])
+    numpy.testing.assert_allclose(values[1], [0, 1, 2, 3, 4])
@@ -0,0 +1,106 @@
+import os
+import shutil
+import time
+
+import numpy
+
+import pprzlogutils.cache as cache
+import pprzlogutils.logparser as lp
+import pprzlogutils.session as session
+
+from conftest import SAMPLE_DATA, SAMPLE_LOG, flight_blocks
+
+def copy_flight(tmp_path):
+    log_path = shutil.copy(SAMPLE_LOG, tmp_path / 'flight.log')
+    data_path = shutil.copy(SAMPLE_DATA, tmp_path / 'flight.data')
+    return str(log_path), str(data_path)
+
+def test_key_is_stable(tmp_path):
+    log_path, data_path = copy_flight(tmp_path)
+    key = cache.flight_key(log_path, data_path)
+    assert key == cache.flight_key(log_path, data_path)
+    assert cache.is_flight_dir(key)
+
+def test_key_changes_with_the_files(tmp_path):
+    log_path, data_path = copy_flight(tmp_path)
+    key = cache.flight_key(log_path, data_path)
+
+    with open(data_path, 'a') as f:
+        f.write('\n')
+    assert cache.flight_key(log_path, data_path) != key
+
+def test_key_changes_with_converted_units(tmp_path):
+    log_path, data_path = copy_flight(tmp_path)
+    key = cache.flight_key(log_path, data_path)
+    lp.set_convert_units(True)
+    assert cache.flight_key(log_path, data_path) != key
+
+def test_load_or_parse_round_trip(tmp_path):
+    log_path, data_path = copy_flight(tmp_path)
+    cache_dir = str(tmp_path / 'cache')
+
+    parsed = session.LogSession(log_path, data_path)
+    lp.activate(parsed)
+    assert not cache.load_or_parse(log_path, data_path, cache_dir=cache_dir)
+
+    cached = session.LogSession(log_path, data_path)
+    lp.activate(cached)
+    assert cache.load_or_parse(log_path, data_path, cache_dir=cache_dir)
+
+    expected = flight_blocks(parsed)
+    got = flight_blocks(cached)
+    assert got.keys() == expected.keys()
+    for key, (timestamps, values) in expected.items():
+        numpy.testing.assert_array_equal(got[key][0], timestamps)
+        for field, value in values.items():
+            if isinstance(value, tuple):
+                for a, b in zip(got[key][1][field], value):
+                    numpy.testing.assert_array_equal(a, b)
+            else:
+                numpy.testing.assert_array_equal(got[key][1][field], value)
+
+def make_flight(cache_dir, key, size, age):
+    path = os.path.join(cache_dir, key)
+    os.makedirs(path)
+    with open(os.path.join(path, 'column.npy'), 'wb') as f:
+        f.write(b'\0' * size)
+    manifest = os.path.join(path, cache.MANIFEST_FILENAME)
+    with open(manifest, 'w') as f:
+        f.write('{}')
+    used = time.time() - age
+    os.utime(manifest, (used, used))
+    return path
+
+def test_evict_removes_least_recently_used(tmp_path):
+    cache_dir = str(tmp_path)
+    oldest = make_flight(cache_dir, 'a' * 32, 1000, 30)
+    older = make_flight(cache_dir, 'b' * 32, 1000, 20)
+    newest = make_flight(cache_dir, 'c' * 32, 1000, 10)
+
+    cache.evict(2200, cache_dir)
+    assert not os.path.exists(oldest)
+    assert os.path.exists(older) and os.path.exists(newest)
+
+def test_evict_keeps_the_current_flight(tmp_path):
+    cache_dir = str(tmp_path)
+    kept = make_flight(cache_dir, 'a' * 32, 1000, 30)
+    other = make_flight(cache_dir, 'b' * 32, 1000, 20)
+
+    cache.evict(1500, cache_dir, keep='a' * 32)
+    assert os.path.exists(kept)
+    assert not os.path.exists(other)
+
+def test_evict_only_removes_flights(tmp_path):
+    cache_dir = str(tmp_path)
+    schemas = tmp_path / 'schemas'
+    schemas.mkdir()
+    (schemas / 'registry.json').write_bytes(b'\0' * 5000)
+
+    stale = tmp_path / ('d' * 32 + '.tmp-1')
+    stale.mkdir()
+    old = time.time() - 2 * cache.TMP_MAX_AGE
+    os.utime(stale, (old, old))
+
+    cache.evict(0, cache_dir)
+    assert schemas.exists()
+    assert not stale.exists()
@@ -0,0 +1,37 @@
+import numpy
+import pytest
+
+import pprzlogutils.decimation as decimation
+
+def assert_same_pyramid(a, b):
+    assert a.size == b.size
+    assert len(a.levels) == len(b.levels)
+    for (bucket_a, min_a, max_a), (bucket_b, min_b, max_b) in zip(a.levels, b.levels):
+        assert bucket_a == bucket_b
+        numpy.testing.assert_array_equal(min_a, min_b)
+        numpy.testing.assert_array_equal(max_a, max_b)
+
+@pytest.mark.parametrize('first, size', [(3, 5000), (100, 101), (1000, 1003), (1025, 70000), (5000, 5000), (4096, 4097)])
+def test_extend_matches_rebuild(first, size):
+    y = numpy.random.default_rng(size).standard_normal(size)
+    pyramid = decimation.MinMaxPyramid(y[:first])
+    pyramid.extend(y)
+    assert_same_pyramid(pyramid, decimation.MinMaxPyramid(y))
+
+def test_extend_in_several_steps():
+    y = numpy.random.default_rng(0).standard_normal(50000)
+    pyramid = decimation.MinMaxPyramid(y[:10])
+    for size in (11, 777, 1024, 1025, 20000, 50000):
+        pyramid.extend(y[:size])
+        assert_same_pyramid(pyramid, decimation.MinMaxPyramid(y[:size]))
+
+def test_indexes_keep_the_extremes():
+    y = numpy.random.default_rng(1).standard_normal(100000)
+    pyramid = decimation.MinMaxPyramid(y)
+    index = pyramid.indexes(1000, 90000, 2000)
+
+    assert len(index) <= 2200
+    assert numpy.all(numpy.diff(index) > 0)
+    assert y[index].min() == y[1000:90000].min()
+    assert y[index].max() == y[1000:90000].max()
+    assert pyramid.indexes(10, 20, 2000).tolist() == list(range(10, 20))
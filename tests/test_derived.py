@@ -0,0 +1,55 @@
+import numpy
+import pytest
+
+import pprzlogutils.derived as derived
+import pprzlogutils.logparser as lp
+
+from conftest import load_flight
+
+@pytest.fixture(autouse=True)
+def no_definitions():
+    derived.DEFINITIONS.clear()
+    yield
+    derived.DEFINITIONS.clear()
+
+@pytest.mark.parametrize('expression', [
+    '__import__("os").system("true")',
+    'INS.ins_x.__class__',
+    'INS.ins_x.real',
+    '(lambda: INS.ins_x)()',
+    '[INS.ins_x]',
+    'INS.ins_x if 1 else 0',
+    'INS.ins_x + "a"',
+    'getattr(INS, "ins_x")',
+    'sqrt(INS.ins_x, out=INS.ins_y)',
+    'INS[x].ins_x',
+    'INS[204]',
+    'numpy.sqrt(INS.ins_x)',
+    'INS.ins_x +',
+    '1 + 2',
+])
+def test_expressions_outside_of_the_whitelist(expression):
+    with pytest.raises(derived.DerivedError):
+        derived.define('bad', expression)
+    assert 'bad' not in derived.DEFINITIONS
+
+@pytest.mark.parametrize('name', ['sqrt', 'pi', 't', 'class', '2x', 'a b'])
+def test_invalid_names(name):
+    with pytest.raises(derived.DerivedError):
+        derived.define(name, 'INS.ins_x')
+
+def test_references():
+    definition = derived.define('dx', 'INS[205].ins_x - INS.ins_x + speed * pi + t')
+    assert definition.refs == [(205, 'INS', 'ins_x'), (None, 'INS', 'ins_x'), (None, derived.DERIVED, 'speed')]
+    with pytest.raises(derived.DerivedError):
+        derived.define('loop', 'loop + 1')
+
+def test_evaluate_on_the_sample_flight():
+    load_flight()
+    derived.define('speed', 'sqrt(INS.ins_xd**2 + INS.ins_yd**2)')
+    derived.define('speed_x2', 'speed * 2')
+
+    xd = lp.get_var(204, 'INS', 'ins_xd').astype(numpy.float64)
+    yd = lp.get_var(204, 'INS', 'ins_yd').astype(numpy.float64)
+    numpy.testing.assert_allclose(lp.get_var(204, derived.DERIVED, 'speed'), numpy.sqrt(xd ** 2 + yd ** 2))
+    numpy.testing.assert_allclose(lp.get_var(204, derived.DERIVED, 'speed_x2'), 2 * numpy.sqrt(xd ** 2 + yd ** 2))
@@ -0,0 +1,83 @@
+import numpy
+import pytest
+
+import pprzlogutils.columns as cols
+import pprzlogutils.parallel as parallel
+
+from conftest import SAMPLE_DATA, SAMPLE_LOG, flight_blocks, load_flight
+
+def assert_same_blocks(a, b):
+    assert a.keys() == b.keys()
+    for key in a:
+        timestamps, values = a[key]
+        numpy.testing.assert_array_equal(timestamps, b[key][0], err_msg=str(key))
+        assert values.keys() == b[key][1].keys()
+        for field, value in values.items():
+            other = b[key][1][field]
+            if isinstance(value, tuple): # Array field, (lengths, flat values)
+                numpy.testing.assert_array_equal(value[0], other[0], err_msg='%s %s' % (key, field))
+                numpy.testing.assert_array_equal(value[1], other[1], err_msg='%s %s' % (key, field))
+            else:
+                assert value.dtype == other.dtype
+                numpy.testing.assert_array_equal(value, other, err_msg='%s %s' % (key, field))
+
+@pytest.fixture(scope='module')
+def serial():
+    return flight_blocks(load_flight())
+
+def test_serial_parses_every_row(serial):
+    with open(SAMPLE_DATA) as f:
+        ins = [line.split() for line in f if line.split()[2] == 'INS']
+    timestamps, values = serial[(204, 'INS')]
+    assert len(timestamps) == len(ins)
+    assert timestamps[-1] == float(ins[-1][0])
+    assert values['ins_x'][-1] == int(ins[-1][3])
+
+def test_lazy_matches_serial(serial):
+    flight = load_flight(lazy=True)
+    assert_same_blocks(flight_blocks(flight), serial)
+
+def test_parallel_matches_serial(serial, monkeypatch):
+    monkeypatch.setattr(parallel, 'PARALLEL_MIN_BYTES', 0) # The sample is smaller than the pool threshold
+    ranges = []
+    split_ranges = parallel.split_ranges
+    monkeypatch.setattr(parallel, 'split_ranges', lambda *args: ranges.extend(split_ranges(*args)) or ranges)
+
+    flight = load_flight(workers=2)
+    assert len(ranges) > 1
+    assert_same_blocks(flight_blocks(flight), serial)
+
+    reference = load_flight()
+    for id, inner_dict in flight.columns.items():
+        for name, message in inner_dict.items():
+            expected = reference.columns[id][name].statistics()
+            got = message.statistics()
+            assert (got.count, got.first, got.last, got.gaps) == (expected.count, expected.first, expected.last, expected.gaps)
+
+def test_parse_numbers_keeps_64_bit_integers():
+    tokens = ['9007199254740993', '-9223372036854775808']
+    numbers, invalid = cols.parse_numbers(tokens, numpy.int64)
+    assert invalid is None
+    assert numbers.tolist() == [9007199254740993, -9223372036854775808]
+
+    numbers, invalid = cols.parse_numbers(['18446744073709551615', '1e3'], numpy.uint64)
+    assert numbers.tolist() == [18446744073709551615, 1000]
+    assert not invalid.any()
+
+def test_parse_numbers_marks_bad_tokens():
+    numbers, invalid = cols.parse_numbers(['1', 'abc', '300', '-2'], numpy.uint8)
+    assert invalid.tolist() == [False, True, True, True]
+    assert numbers[0] == 1
+
+def test_bad_lines_are_skipped(tmp_path):
+    with open(SAMPLE_DATA) as f:
+        ins = [line for line in f if line.split()[2] == 'INS'][:3]
+    tokens = ins[1].split()
+    tokens[4] = 'garbage'
+    data_path = tmp_path / 'bad.data'
+    data_path.write_text(ins[0] + ' '.join(tokens) + '\n' + ins[1].split()[0] + ' 204 INS 1 2\n' + ins[2])
+
+    flight = load_flight(SAMPLE_LOG, str(data_path))
+    timestamps, values = flight.columns[204]['INS'].to_block()
+    assert timestamps.tolist() == [float(ins[0].split()[0]), float(ins[2].split()[0])]
+    assert values['ins_x'].tolist() == [int(ins[0].split()[3]), int(ins[2].split()[3])]
@@ -0,0 +1,70 @@
+import numpy
+import pytest
+
+import pprzlogutils.columns as cols
+import pprzlogutils.statistics as stats
+
+FIELDS = [cols.Field('x', 'double', numpy.dtype(numpy.float64), False, False)]
+
+def test_field_stats_blocks_match_numpy():
+    values = numpy.random.default_rng(0).normal(1e6, 3.0, 10000)
+    field_stats = stats.FieldStats()
+    for block in numpy.array_split(values, 7):
+        field_stats.update(block)
+
+    assert field_stats.count == len(values)
+    assert field_stats.mean == pytest.approx(values.mean(), rel=1e-12)
+    assert field_stats.std == pytest.approx(values.std(), rel=1e-9)
+    assert (field_stats.min, field_stats.max) == (values.min(), values.max())
+
+def test_field_stats_merge_matches_one_pass():
+    values = numpy.random.default_rng(1).standard_normal(5000)
+    a, b, whole = stats.FieldStats(), stats.FieldStats(), stats.FieldStats()
+    a.update(values[:123])
+    b.update(values[123:])
+    whole.update(values)
+
+    a.merge(b.count, b.mean, b.m2, b.min, b.max)
+    assert a.count == whole.count
+    assert a.mean == pytest.approx(whole.mean, abs=1e-12)
+    assert a.m2 == pytest.approx(whole.m2, rel=1e-12)
+    assert (a.min, a.max) == (whole.min, whole.max)
+
+def test_field_stats_skip_nan():
+    field_stats = stats.FieldStats()
+    field_stats.update(numpy.array([1.0, numpy.nan, 3.0, numpy.inf]))
+    assert field_stats.count == 2
+    assert field_stats.mean == 2.0
+    assert stats.FieldStats().as_dict()['mean'] is None
+
+def message_stats(timestamps):
+    message_stats = stats.MessageStats(FIELDS)
+    message_stats.update(timestamps, {'x': timestamps * 2})
+    return message_stats
+
+def test_message_stats_merge_matches_one_pass():
+    timestamps = numpy.concatenate((numpy.arange(0, 10, 0.1), numpy.arange(20, 30, 0.1)))
+    whole = message_stats(timestamps)
+    merged = message_stats(timestamps[:50])
+    merged.merge(message_stats(timestamps[50:]))
+
+    for name in ('count', 'first', 'last', 'gaps', 'dropped'):
+        assert getattr(merged, name) == getattr(whole, name), name
+    assert merged.gap_seconds == pytest.approx(whole.gap_seconds)
+    assert merged.period == pytest.approx(whole.period)
+    assert merged.rate == pytest.approx(whole.rate)
+    assert merged.fields['x'].mean == pytest.approx(whole.fields['x'].mean)
+    assert merged.fields['x'].std == pytest.approx(whole.fields['x'].std)
+    assert not merged.approximate
+
+def test_message_stats_gap_between_merged_blocks():
+    timestamps = numpy.concatenate((numpy.arange(0, 5, 0.1), numpy.arange(10, 15, 0.1)))
+    merged = message_stats(timestamps[:50])
+    merged.merge(message_stats(timestamps[50:]))
+    assert merged.gaps == 1
+    assert merged.max_gap == pytest.approx(5.1)
+
+def test_message_stats_short_blocks_are_approximate():
+    merged = message_stats(numpy.arange(0, 1, 0.1))
+    merged.merge(message_stats(numpy.array([1.0, 1.1])))
+    assert merged.approximate